@@ -0,0 +1,37 @@
+"""
+PA Audio Analyzer V4.0 - 解析履歴の移行ツール
+旧形式の user_data/*.json を user_data/analyses.db (SQLite) に取り込む
+
+使い方:
+    python migrate_user_data.py
+    python migrate_user_data.py --email someone@example.com
+"""
+
+import argparse
+import sys
+
+from pa_analyzer_v4_simple import SimpleStorage
+
+
+def main():
+    parser = argparse.ArgumentParser(description="user_data/*.json を SQLite に移行")
+    parser.add_argument('--email', action='append',
+                        help="移行するユーザー（省略時は users.json の全ユーザー）")
+    args = parser.parse_args()
+    
+    storage = SimpleStorage(auto_migrate=False)
+    migrated = storage.migrate_json(args.email)
+    
+    for email, count in migrated.items():
+        print(f"{email}: {count}件")
+    
+    leftover = sorted(p.name for p in storage.data_dir.glob('*.json'))
+    if leftover:
+        print("未移行のファイル（users.json に無いユーザー）:", ', '.join(leftover))
+        print("--email で対応するメールアドレスを指定してください")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
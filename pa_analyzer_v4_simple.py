@@ -9,37 +9,29 @@ AI学習 + 楽器分離 + 認証システム
 
 import streamlit as st
 import numpy as np
-import librosa
-import matplotlib.pyplot as plt
-from scipy import signal
 import io
 from pathlib import Path
-import tempfile
 import json
-from datetime import datetime
+import sqlite3
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta
 import os
+import sys
 import hashlib
+import hmac
+import base64
 import secrets
+import time
+import shutil
+import threading
+from math import ceil
+from concurrent.futures import ThreadPoolExecutor
 
-# 楽器分離（オプション）
-try:
-    import torch
-    import torchaudio
-    from demucs.pretrained import get_model
-    from demucs.apply import apply_model
-    DEMUCS_AVAILABLE = True
-except ImportError:
-    DEMUCS_AVAILABLE = False
-
-plt.rcParams['figure.max_open_warning'] = 50
-
-st.set_page_config(
-    page_title="PA Audio Analyzer V4.0",
-    page_icon="🎛️",
-    layout="wide"
-)
-
-st.markdown("""
+# 解析モジュール（scipy / librosa / torch）と matplotlib は使う関数の中で読み込む。
+# ログイン画面の表示に必要なのは streamlit と numpy だけなので、起動・ワーカー再起動が速くなる
+_pyplot = None
+
+PAGE_CSS = """
 <style>
     .main-header {
         font-size: 2.5rem;
@@ -71,20 +63,90 @@ st.markdown("""
         margin: 0.5rem 0;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+
+# =====================================
+# 共通ユーティリティ
+# =====================================
+
+def write_json_atomic(path, data):
+    # 一時ファイルに書いてから置き換える（書き込み途中のファイルを読ませない）
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{secrets.token_hex(4)}.tmp")
+    with open(tmp, 'w') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
 
 
 # =====================================
 # 簡易認証システム
 # =====================================
 
+# パスワードは scrypt でハッシュ化する。コストは起動時に計測し、1回の照合が
+# ログイン時間の予算（ミリ秒）に収まる最大の N を選ぶ
+AUTH_LOGIN_BUDGET_MS = int(os.environ.get('PA_AUTH_BUDGET_MS', '250'))
+SCRYPT_MIN_N = 2 ** 14
+SCRYPT_MAX_N = 2 ** 20
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# ログイン後はHMAC署名付きトークンで本人確認する（再実行のたびにユーザーファイルを読まない）
+SESSION_TTL_HOURS = 12
+
+
+def scrypt_hash(password, salt, n, r=SCRYPT_R, p=SCRYPT_P):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=2 * 128 * r * n + 1024 ** 2, dklen=32)
+
+
+def tune_scrypt_n(budget_ms=AUTH_LOGIN_BUDGET_MS):
+    # N を倍にすると時間もほぼ倍になるので、予算を超えない範囲で倍々にする
+    n = SCRYPT_MIN_N
+    start = time.perf_counter()
+    scrypt_hash('calibration', b'0' * 16, n)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    while n < SCRYPT_MAX_N and elapsed_ms * 2 <= budget_ms:
+        n *= 2
+        elapsed_ms *= 2
+    return n
+
+
+def load_session_secret(path='.session_secret'):
+    # 複数プロセスで共有できるよう、環境変数かファイルに置いた鍵を使う
+    secret = os.environ.get('PA_SESSION_SECRET')
+    if secret:
+        return secret.encode()
+    path = Path(path)
+    if not path.exists():
+        tmp = path.with_name(f".{path.name}.{secrets.token_hex(4)}.tmp")
+        with open(tmp, 'w') as f:
+            f.write(secrets.token_hex(32))
+        os.chmod(tmp, 0o600)
+        try:
+            # 同時に起動した別プロセスが先に作っていればそちらを使う
+            os.link(tmp, path)
+        except FileExistsError:
+            pass
+        finally:
+            tmp.unlink()
+    return path.read_text().strip().encode()
+
+
 class SimpleAuth:
-    def __init__(self):
-        self.users_file = Path('users.json')
+    # ユーザーはメモリ上の辞書で引き、書き込みはロックをかけてアトミックに置き換える。
+    # プロセスで1つだけ作って共有する（get_auth() を参照）
+    def __init__(self, users_file='users.json', scrypt_n=None, secret=None):
+        self.users_file = Path(users_file)
+        self.lock = threading.Lock()
+        self.scrypt_n = scrypt_n or tune_scrypt_n()
+        self.secret = secret or load_session_secret()
+        self._mtime = None
         self.users = self.load_users()
         
     def load_users(self):
         if self.users_file.exists():
+            self._mtime = self.users_file.stat().st_mtime_ns
             with open(self.users_file, 'r') as f:
                 return json.load(f)
         else:
@@ -100,92 +162,263 @@ class SimpleAuth:
             return default
     
     def save_users(self, users):
-        with open(self.users_file, 'w') as f:
-            json.dump(users, f, ensure_ascii=False, indent=2)
+        write_json_atomic(self.users_file, users)
+        self._mtime = self.users_file.stat().st_mtime_ns
+    
+    def _refresh(self):
+        # 別プロセス（移行スクリプト等）がファイルを書き換えていれば読み直す
+        if self.users_file.exists() and self.users_file.stat().st_mtime_ns != self._mtime:
+            self.users = self.load_users()
     
     def _hash(self, password):
-        salt = secrets.token_hex(8)
-        pwd_hash = hashlib.sha256((password + salt).encode()).hexdigest()
-        return f"{salt}:{pwd_hash}"
+        salt = secrets.token_bytes(16)
+        digest = scrypt_hash(password, salt, self.scrypt_n)
+        return f"scrypt${self.scrypt_n}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
     
     def _verify(self, password, stored):
+        if stored.startswith('scrypt$'):
+            _, n, r, p, salt, digest = stored.split('$')
+            actual = scrypt_hash(password, bytes.fromhex(salt), int(n), int(r), int(p))
+            return hmac.compare_digest(actual.hex(), digest)
+        # 旧形式（salt:sha256）
         salt, pwd_hash = stored.split(':')
-        return hashlib.sha256((password + salt).encode()).hexdigest() == pwd_hash
+        actual = hashlib.sha256((password + salt).encode()).hexdigest()
+        return hmac.compare_digest(actual, pwd_hash)
+    
+    def _needs_rehash(self, stored):
+        return not stored.startswith('scrypt$') or int(stored.split('$')[1]) < self.scrypt_n
     
     def register(self, email, password, username):
-        if email in self.users:
-            return False, "既に登録済みです"
-        self.users[email] = {
-            'password': self._hash(password),
-            'username': username,
-            'created': datetime.now().isoformat()
-        }
-        self.save_users(self.users)
+        # ハッシュ計算（重い処理）はロックの外で済ませておく
+        password_hash = self._hash(password)
+        with self.lock:
+            self._refresh()
+            if email in self.users:
+                return False, "既に登録済みです"
+            users = dict(self.users)
+            users[email] = {
+                'password': password_hash,
+                'username': username,
+                'created': datetime.now().isoformat()
+            }
+            self.save_users(users)
+            self.users = users
         return True, "登録完了"
     
     def login(self, email, password):
-        if email not in self.users:
+        with self.lock:
+            self._refresh()
+            user = self.users.get(email)
+        if user is None:
+            # 応答時間から登録の有無を推測されないよう、同じ計算をしてから失敗を返す
+            self._hash(password)
             return False, None
-        if self._verify(password, self.users[email]['password']):
-            return True, self.users[email]
-        return False, None
+        if not self._verify(password, user['password']):
+            return False, None
+        
+        # 旧形式・低コストのハッシュはログイン成功時に今のコストで作り直す
+        if self._needs_rehash(user['password']):
+            password_hash = self._hash(password)
+            with self.lock:
+                # 検証の間に別プロセスがユーザーを削除・変更していたら作り直さない
+                self._refresh()
+                current = self.users.get(email)
+                if current is not None and current['password'] == user['password']:
+                    users = dict(self.users)
+                    users[email] = dict(current, password=password_hash)
+                    self.save_users(users)
+                    self.users = users
+        return True, user
+    
+    def issue_token(self, email, username):
+        expires = int(time.time() + SESSION_TTL_HOURS * 3600)
+        payload = base64.urlsafe_b64encode(
+            json.dumps({'email': email, 'username': username, 'exp': expires}, ensure_ascii=False).encode()
+        ).decode()
+        signature = hmac.new(self.secret, payload.encode(), hashlib.sha256).hexdigest()
+        return f"{payload}.{signature}"
+    
+    def verify_token(self, token):
+        # 署名と有効期限だけを確認する（ファイルは読まない）
+        if not token or '.' not in token:
+            return None
+        payload, signature = token.rsplit('.', 1)
+        expected = hmac.new(self.secret, payload.encode(), hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(expected, signature):
+            return None
+        data = json.loads(base64.urlsafe_b64decode(payload.encode()))
+        if data['exp'] < time.time():
+            return None
+        return {'email': data['email'], 'username': data['username']}
 
 
 # =====================================
 # AI学習システム（シンプル版）
 # =====================================
 
+# 直近値のリングバッファ長と指数移動平均の係数
+AI_RECENT_SIZE = 20
+AI_EWMA_ALPHA = 0.3
+# 旧 ai_data.json の移行はプロセス内で1回だけ（ジョブのワーカーが同時に SimpleAI を作るため）
+_AI_MIGRATE_LOCK = threading.Lock()
+
+
+class RunningStat:
+    # 平均・分散（Welford法）、指数移動平均、直近N件のリングバッファをO(1)で更新する
+    def __init__(self, size=AI_RECENT_SIZE, alpha=AI_EWMA_ALPHA):
+        self.size = size
+        self.alpha = alpha
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.ewma = None
+        self.recent = []
+        self.pos = 0
+    
+    def add(self, value):
+        value = float(value)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        
+        self.ewma = value if self.ewma is None else self.alpha * value + (1 - self.alpha) * self.ewma
+        
+        if len(self.recent) < self.size:
+            self.recent.append(value)
+        else:
+            self.recent[self.pos] = value
+        self.pos = (self.pos + 1) % self.size
+    
+    @property
+    def std(self):
+        return (self.m2 / (self.count - 1)) ** 0.5 if self.count > 1 else 0.0
+    
+    def last(self, n):
+        # 古い順に並べた直近n件
+        ordered = self.recent[self.pos:] + self.recent[:self.pos]
+        return ordered[-n:]
+    
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'm2': self.m2,
+            'ewma': self.ewma,
+            'recent': self.recent,
+            'pos': self.pos
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        stat = cls()
+        stat.count = data['count']
+        stat.mean = data['mean']
+        stat.m2 = data['m2']
+        stat.ewma = data['ewma']
+        stat.recent = data['recent']
+        stat.pos = data['pos']
+        return stat
+
+
 class SimpleAI:
-    def __init__(self):
-        self.data_file = Path('ai_data.json')
-        self.data = self.load_data()
+    # ユーザー・ミキサーごとに1ファイルずつ保存し、1回の学習で書き換えるのは該当レコードだけ
+    def __init__(self, data_dir='ai_data'):
+        self.data_dir = Path(data_dir)
+        (self.data_dir / 'users').mkdir(parents=True, exist_ok=True)
+        (self.data_dir / 'mixers').mkdir(parents=True, exist_ok=True)
+        
+        legacy = Path('ai_data.json')
+        if legacy.exists():
+            with _AI_MIGRATE_LOCK:
+                if legacy.exists():
+                    self.migrate_legacy(legacy)
     
-    def load_data(self):
-        if self.data_file.exists():
-            with open(self.data_file, 'r') as f:
-                return json.load(f)
-        return {'users': {}, 'mixers': {}}
+    def _path(self, kind, key):
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        return self.data_dir / kind / f"{digest}.json"
+    
+    def _load(self, kind, key):
+        path = self._path(kind, key)
+        if not path.exists():
+            return None
+        with open(path, 'r') as f:
+            record = json.load(f)
+        record['rms'] = RunningStat.from_dict(record['rms'])
+        return record
     
-    def save_data(self):
-        with open(self.data_file, 'w') as f:
-            json.dump(self.data, f, ensure_ascii=False, indent=2)
+    def _save(self, kind, key, record):
+        data = dict(record, rms=record['rms'].to_dict())
+        write_json_atomic(self._path(kind, key), data)
+    
+    def load_user(self, user_email):
+        return self._load('users', user_email)
+    
+    def load_mixer(self, mixer):
+        return self._load('mixers', mixer)
     
     def learn(self, user_email, result, metadata):
         # ユーザーデータ
-        if user_email not in self.data['users']:
-            self.data['users'][user_email] = {
-                'count': 0,
-                'rms_history': [],
-                'venues': {}
-            }
-        
-        user = self.data['users'][user_email]
+        user = self.load_user(user_email) or {
+            'email': user_email,
+            'count': 0,
+            'rms': RunningStat(),
+            'venues': {}
+        }
         user['count'] += 1
-        user['rms_history'].append(result['rms_db'])
+        user['rms'].add(result['rms_db'])
         
         venue = metadata.get('venue', '不明')
         user['venues'][venue] = user['venues'].get(venue, 0) + 1
+        self._save('users', user_email, user)
         
         # ミキサーデータ
         mixer = metadata.get('mixer', '不明')
-        if mixer not in self.data['mixers']:
-            self.data['mixers'][mixer] = {'count': 0, 'avg_rms': []}
+        record = self.load_mixer(mixer) or {'name': mixer, 'count': 0, 'rms': RunningStat()}
+        record['count'] += 1
+        record['rms'].add(result['rms_db'])
+        self._save('mixers', mixer, record)
+    
+    def migrate_legacy(self, legacy):
+        # 旧 ai_data.json の履歴リストを集計値に変換する。
+        # 別のプロセスが先に移行してファイルが無くなっていれば、移行済みとして何もしない
+        try:
+            with open(legacy, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        
+        for email, old in data.get('users', {}).items():
+            stat = RunningStat()
+            for value in old.get('rms_history', []):
+                stat.add(value)
+            self._save('users', email, {
+                'email': email,
+                'count': old.get('count', stat.count),
+                'rms': stat,
+                'venues': old.get('venues', {})
+            })
         
-        self.data['mixers'][mixer]['count'] += 1
-        self.data['mixers'][mixer]['avg_rms'].append(result['rms_db'])
+        for mixer, old in data.get('mixers', {}).items():
+            stat = RunningStat()
+            for value in old.get('avg_rms', []):
+                stat.add(value)
+            self._save('mixers', mixer, {'name': mixer, 'count': old.get('count', stat.count), 'rms': stat})
         
-        self.save_data()
+        try:
+            legacy.rename(legacy.with_name(legacy.name + '.migrated'))
+        except FileNotFoundError:
+            pass
     
     def get_insights(self, user_email, current_result):
         insights = []
         
-        if user_email not in self.data['users']:
+        user = self.load_user(user_email)
+        if user is None:
             return ["🎉 初回解析！データを蓄積していきましょう"]
         
-        user = self.data['users'][user_email]
-        
         if user['count'] >= 3:
-            avg_rms = np.mean(user['rms_history'][-5:])
+            avg_rms = float(np.mean(user['rms'].last(5)))
             current_rms = current_result['rms_db']
             
             if current_rms > avg_rms + 2:
@@ -196,172 +429,802 @@ class SimpleAI:
                 insights.append(f"✅ 安定した音圧です（平均: {avg_rms:.1f}dB）")
         
         if user['count'] >= 5:
-            insights.append(f"🎯 総解析数: {user['count']}回")
+            insights.append(f"🎯 総解析数: {user['count']}回（RMSのばらつき ±{user['rms'].std:.1f}dB）")
         
         return insights if insights else ["📊 データを蓄積中...（3回以上でAI分析開始）"]
 
 
 # =====================================
-# 楽器分離（シンプル版）
+# データ保存
 # =====================================
 
-class SimpleSeparator:
-    def __init__(self):
-        self.available = DEMUCS_AVAILABLE
-        self.model = None
+HISTORY_PAGE_SIZE = 20
+# 履歴の推移グラフは移動平均をとってからこの点数以下に間引く
+TREND_WINDOW = 5
+TREND_MAX_POINTS = 200
+# テーブル作成と旧JSONの移行はデータベースごとにプロセス内で1回だけ
+# （SimpleStorage は履歴画面の描画やジョブの保存のたびに作られるため）
+_STORAGE_LOCK = threading.Lock()
+_STORAGE_READY = set()
+
+
+class SimpleStorage:
+    # SQLite（WALモード）に1解析1行で追記する。
+    # 履歴はインデックス経由で新しい順にページ取得し、会場・ミキサー・日付で絞り込める
+    def __init__(self, db_path=None, auto_migrate=True):
+        self.data_dir = Path('user_data')
+        self.data_dir.mkdir(exist_ok=True)
+        self.db_path = Path(db_path) if db_path else self.data_dir / 'analyses.db'
         
-        if self.available:
-            try:
-                self.model = get_model('htdemucs')
-                self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-                self.model.to(self.device)
-            except:
-                self.available = False
+        key = str(self.db_path.resolve())
+        if key in _STORAGE_READY:
+            return
+        with _STORAGE_LOCK:
+            if key not in _STORAGE_READY:
+                self._init_db()
+                # 旧形式（user_data/*.json）が残っていれば取り込む
+                if auto_migrate and any(self.data_dir.glob('*.json')):
+                    self.migrate_json()
+                _STORAGE_READY.add(key)
     
-    def separate(self, audio_path):
-        if not self.available or self.model is None:
-            return None, "楽器分離機能が利用できません"
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+    
+    def _init_db(self):
+        with closing(self._connect()) as conn, conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS analyses (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_email TEXT NOT NULL,
+                    analysis_id TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    analysis_name TEXT,
+                    venue TEXT,
+                    mixer TEXT,
+                    rms_db REAL,
+                    peak_db REAL,
+                    crest_factor REAL,
+                    stereo_width REAL,
+                    metadata TEXT NOT NULL,
+                    result TEXT NOT NULL
+                );
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_analyses_user_time
+                    ON analyses (user_email, timestamp);
+                CREATE INDEX IF NOT EXISTS idx_analyses_user_venue
+                    ON analyses (user_email, venue, timestamp);
+                CREATE INDEX IF NOT EXISTS idx_analyses_user_mixer
+                    ON analyses (user_email, mixer, timestamp);
+            """)
+    
+    @staticmethod
+    def _row(user_email, record):
+        metadata = record['metadata']
+        result = record['result']
+        return (
+            user_email,
+            record['id'],
+            record['timestamp'],
+            metadata.get('analysis_name'),
+            metadata.get('venue'),
+            metadata.get('mixer'),
+            result.get('rms_db'),
+            result.get('peak_db'),
+            result.get('crest_factor'),
+            result.get('stereo_width'),
+            json.dumps(metadata, ensure_ascii=False),
+            json.dumps(result, ensure_ascii=False)
+        )
+    
+    _INSERT = """
+        INSERT INTO analyses (
+            user_email, analysis_id, timestamp, analysis_name, venue, mixer,
+            rms_db, peak_db, crest_factor, stereo_width, metadata, result
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+    # 移行だけは途中で止まった後の再実行で同じ記録を二重に入れないよう、既存の行を飛ばす
+    _INSERT_MIGRATE = _INSERT.replace('INSERT INTO', 'INSERT OR IGNORE INTO')
+    
+    def save(self, user_email, result, metadata):
+        now = datetime.now()
+        record = {
+            'id': now.strftime('%Y%m%d_%H%M%S'),
+            'timestamp': now.isoformat(),
+            'metadata': metadata,
+            'result': result
+        }
+        with closing(self._connect()) as conn, conn:
+            cur = conn.execute(self._INSERT, self._row(user_email, record))
+            return cur.lastrowid
+    
+    def _where(self, user_email, venue=None, mixer=None, date_from=None, date_to=None):
+        clauses = ['user_email = ?']
+        params = [user_email]
+        if venue:
+            clauses.append('venue = ?')
+            params.append(venue)
+        if mixer:
+            clauses.append('mixer = ?')
+            params.append(mixer)
+        if date_from:
+            clauses.append('timestamp >= ?')
+            params.append(date_from.isoformat())
+        if date_to:
+            clauses.append('timestamp < ?')
+            params.append(date_to.isoformat())
+        return ' AND '.join(clauses), params
+    
+    def query(self, user_email, limit=HISTORY_PAGE_SIZE, offset=0, **filters):
+        where, params = self._where(user_email, **filters)
+        sql = f"SELECT analysis_id, timestamp, metadata, result FROM analyses WHERE {where} ORDER BY timestamp DESC"
+        if limit is not None:
+            sql += ' LIMIT ? OFFSET ?'
+            params += [limit, offset]
         
-        try:
-            audio, sr = torchaudio.load(audio_path)
-            if audio.shape[0] == 1:
-                audio = audio.repeat(2, 1)
-            
-            audio = audio.to(self.device).unsqueeze(0)
-            
-            with torch.no_grad():
-                sources = apply_model(self.model, audio, device=self.device)
-            
-            sources = sources.squeeze(0).cpu().numpy()
-            
-            return {
-                'drums': sources[0],
-                'bass': sources[1],
-                'other': sources[2],
-                'vocals': sources[3]
-            }, None
-            
-        except Exception as e:
-            return None, f"分離エラー: {str(e)}"
+        with closing(self._connect()) as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [
+            {
+                'id': row['analysis_id'],
+                'timestamp': row['timestamp'],
+                'metadata': json.loads(row['metadata']),
+                'result': json.loads(row['result'])
+            }
+            for row in rows
+        ]
+    
+    def count(self, user_email, **filters):
+        where, params = self._where(user_email, **filters)
+        with closing(self._connect()) as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM analyses WHERE {where}", params).fetchone()[0]
+    
+    def distinct(self, user_email, column):
+        if column not in ('venue', 'mixer'):
+            raise ValueError(f"unknown column: {column}")
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT DISTINCT {column} FROM analyses WHERE user_email = ? ORDER BY {column}",
+                (user_email,)
+            ).fetchall()
+        return [row[0] for row in rows if row[0] is not None]
+    
+    def version(self, user_email):
+        # 保存が増えると必ず変わる値（履歴ダッシュボードのキャッシュキーに使う）
+        with closing(self._connect()) as conn:
+            count, last_id = conn.execute(
+                "SELECT COUNT(*), MAX(id) FROM analyses WHERE user_email = ?", (user_email,)
+            ).fetchone()
+        return count, last_id or 0
+    
+    def metric_series(self, user_email, **filters):
+        # 推移グラフ用に数値列だけを古い順に取得する（JSONは読まない）
+        where, params = self._where(user_email, **filters)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT timestamp, rms_db, peak_db, crest_factor, stereo_width FROM analyses "
+                f"WHERE {where} AND rms_db IS NOT NULL ORDER BY timestamp",
+                params
+            ).fetchall()
+        return [tuple(row) for row in rows]
+    
+    def breakdown(self, user_email, column, **filters):
+        # 会場・ミキサーごとの件数と平均値
+        if column not in ('venue', 'mixer'):
+            raise ValueError(f"unknown column: {column}")
+        where, params = self._where(user_email, **filters)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT {column}, COUNT(*), AVG(rms_db), AVG(peak_db), AVG(crest_factor), "
+                f"AVG(stereo_width), MAX(timestamp) FROM analyses WHERE {where} "
+                f"GROUP BY {column} ORDER BY COUNT(*) DESC",
+                params
+            ).fetchall()
+        return [
+            {
+                'name': row[0],
+                'count': row[1],
+                'rms_db': row[2],
+                'peak_db': row[3],
+                'crest_factor': row[4],
+                'stereo_width': row[5],
+                'last': row[6]
+            }
+            for row in rows
+        ]
+    
+    def load(self, user_email):
+        return self.query(user_email, limit=None)
+    
+    @staticmethod
+    def legacy_filename(user_email):
+        return user_email.replace('@', '_at_').replace('.', '_') + '.json'
+    
+    def migrate_json(self, emails=None):
+        # 旧ファイル名はメールアドレスから復元できないので、登録ユーザーの一覧と突き合わせる。
+        # ファイルが無い・.migrated が既にある（別のプロセスが移行した）ものは移行済みとして飛ばす
+        if emails is None:
+            users_file = Path('users.json')
+            emails = []
+            if users_file.exists():
+                with open(users_file, 'r') as f:
+                    emails = list(json.load(f))
+        
+        migrated = {}
+        for email in emails:
+            filepath = self.data_dir / self.legacy_filename(email)
+            done = filepath.with_name(filepath.name + '.migrated')
+            if not filepath.exists() or done.exists():
+                continue
+            try:
+                with open(filepath, 'r') as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                continue
+            rows = [self._row(email, record) for record in data.get('analyses', [])]
+            with closing(self._connect()) as conn, conn:
+                conn.executemany(self._INSERT_MIGRATE, rows)
+            try:
+                filepath.rename(done)
+            except FileNotFoundError:
+                pass
+            migrated[email] = len(rows)
+        return migrated
 
 
 # =====================================
-# 音源解析（シンプル版）
+# 解析結果キャッシュ
 # =====================================
 
-class SimpleAnalyzer:
-    def __init__(self, audio_path):
-        self.audio_path = audio_path
-        self.y, self.sr = librosa.load(audio_path, sr=44100, mono=False)
-        if len(self.y.shape) == 1:
-            self.y = np.stack([self.y, self.y])
-    
-    def analyze(self):
-        mono = np.mean(self.y, axis=0)
-        
-        # 基本指標
-        rms = np.sqrt(np.mean(mono ** 2))
-        rms_db = 20 * np.log10(rms + 1e-10)
-        
-        peak = np.max(np.abs(mono))
-        peak_db = 20 * np.log10(peak + 1e-10)
-        
-        crest = peak_db - rms_db
-        
-        # ステレオ幅
-        L, R = self.y[0], self.y[1]
-        mid = (L + R) / 2
-        side = (L - R) / 2
-        mid_e = np.sum(mid ** 2)
-        side_e = np.sum(side ** 2)
-        stereo_width = (side_e / (mid_e + side_e + 1e-10)) * 100
-        
-        # 周波数解析
-        bands = {
-            'sub_bass': (20, 60),
-            'bass': (60, 250),
-            'low_mid': (250, 500),
-            'mid': (500, 2000),
-            'high_mid': (2000, 4000),
-            'presence': (4000, 8000),
-            'brilliance': (8000, 20000)
-        }
-        
-        band_energies = {}
-        for name, (low, high) in bands.items():
-            filtered = self.bandpass(mono, low, high)
-            energy = 20 * np.log10(np.sqrt(np.mean(filtered ** 2)) + 1e-10)
-            band_energies[name] = float(energy)
+# キャッシュ全体の上限サイズ（超えたら最終アクセスが古い順に削除）
+CACHE_MAX_MB = int(os.environ.get('PA_CACHE_MAX_MB', '2048'))
+
+
+class SimpleResultCache:
+    # アップロード内容のハッシュ＋解析パラメータをキーに、指標とステムをディスクに保存する。
+    # 同じ音源をメタデータだけ変えて再投入した場合は解析・分離を省略できる。
+    # エントリは一時ディレクトリで組み立ててから cache/<key> に rename するので、途中の状態は見えない
+    def __init__(self, cache_dir='cache', max_mb=CACHE_MAX_MB):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(exist_ok=True)
+        self.max_bytes = max_mb * 1024 ** 2
+        self.lock = threading.Lock()
+        # キーごとの実行中ロック: [ロック, 待っているジョブ数]
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
         
-        return {
-            'rms_db': float(rms_db),
-            'peak_db': float(peak_db),
-            'crest_factor': float(crest),
-            'stereo_width': float(stereo_width),
-            'band_energies': band_energies
-        }
+        # 前回プロセスが組み立て途中で残した一時ディレクトリ
+        for tmp in self.cache_dir.glob('.*.tmp'):
+            shutil.rmtree(tmp, ignore_errors=True)
+        # 旧版が同じキーに重ねて保存したときに入れ子になった概観（表示には使われず容量だけ食う）
+        for nested in self.cache_dir.glob('*/overview/overview'):
+            shutil.rmtree(nested, ignore_errors=True)
     
-    def bandpass(self, audio, low, high):
-        nyq = self.sr / 2
-        low_n = np.clip(low / nyq, 0.001, 0.999)
-        high_n = np.clip(high / nyq, 0.001, 0.999)
-        
-        if low_n >= high_n:
-            return audio * 0
-        
+    @staticmethod
+    def content_hash(data):
+        return hashlib.sha256(data).hexdigest()
+    
+    @staticmethod
+    def make_key(content_hash, params):
+        blob = json.dumps(params, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(f"{content_hash}:{blob}".encode()).hexdigest()[:32]
+    
+    def _lookup(self, key):
+        entry = self.cache_dir / key
+        meta_path = entry / 'meta.json'
+        with self.lock:
+            if not meta_path.exists():
+                self.misses += 1
+                return None
+            self.hits += 1
+            # ディレクトリのmtimeを最終アクセス時刻として使う
+            os.utime(entry)
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+    
+    @contextmanager
+    def single_flight(self, key):
+        # 同じキーの解析・分離は1つずつ実行する。後から来たジョブは先のジョブが保存するまで待ち、
+        # ブロックの中で get_* を呼べばキャッシュヒットになる
+        with self.lock:
+            slot = self.inflight.setdefault(key, [threading.Lock(), 0])
+            slot[1] += 1
         try:
-            sos = signal.butter(4, [low_n, high_n], btype='band', output='sos')
-            return signal.sosfilt(sos, audio)
-        except:
-            return audio * 0
+            with slot[0]:
+                yield
+        finally:
+            with self.lock:
+                slot[1] -= 1
+                if slot[1] == 0:
+                    del self.inflight[key]
+    
+    def _store(self, key, meta, files=None):
+        # 一時ディレクトリに全ファイルと meta.json をそろえてから rename する。
+        # 同じキーのエントリが既にあれば（別のジョブが先に保存した）新しい方を捨てる
+        entry = self.cache_dir / key
+        tmp = self.cache_dir / f".{key}.{secrets.token_hex(4)}.tmp"
+        tmp.mkdir()
+        try:
+            for name, src in (files or {}).items():
+                shutil.move(str(src), str(tmp / name))
+            write_json_atomic(tmp / 'meta.json', meta)
+            if entry.exists() and not (entry / 'meta.json').exists():
+                # meta.json の無いエントリ（旧版が書きかけで残したもの）は作り直す
+                shutil.rmtree(entry, ignore_errors=True)
+            if not entry.exists():
+                try:
+                    os.rename(tmp, entry)
+                except OSError:
+                    # 確認と rename の間に別のプロセスが保存した
+                    pass
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+    
+    def get_metrics(self, key):
+        return self._lookup(key)
+    
+    def put_metrics(self, key, result, stats=None, files=None):
+        self._store(key, {'result': result, 'stats': stats}, files)
+    
+    def get_stems(self, key):
+        meta = self._lookup(key)
+        if meta is None:
+            return None
+        entry = self.cache_dir / key
+        meta['paths'] = {name: str(entry / f"{name}.wav") for name in meta['stems']}
+        return meta
+    
+    def put_stems(self, key, stem_paths, stems, masking=None):
+        files = {f"{name}.wav": path for name, path in stem_paths.items()}
+        self._store(key, {'stems': stems, 'masking': masking}, files)
+    
+    def _entries(self):
+        entries = []
+        for entry in self.cache_dir.iterdir():
+            # 組み立て途中の一時ディレクトリは数えない（削除もしない）
+            if entry.is_dir() and not entry.name.startswith('.'):
+                size = sum(f.stat().st_size for f in entry.rglob('*') if f.is_file())
+                entries.append((entry.stat().st_mtime, size, entry))
+        return entries
+    
+    def evict(self):
+        with self.lock:
+            entries = sorted(self._entries(), key=lambda e: e[0])
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in entries:
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+    
+    def stats(self):
+        entries = self._entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(entries),
+            'size_mb': sum(size for _, size, _ in entries) / 1024 ** 2
+        }
 
 
 # =====================================
-# データ保存
+# バックグラウンドジョブ
 # =====================================
 
-class SimpleStorage:
-    def __init__(self):
-        self.data_dir = Path('user_data')
-        self.data_dir.mkdir(exist_ok=True)
+# 同時に実行する解析ジョブ数（全ユーザー合計）
+JOB_WORKERS = int(os.environ.get('PA_JOB_WORKERS', '2'))
+JOB_POLL_SEC = 1.0
+# 完了・失敗したジョブを残す日数（これより古いジョブは jobs/ から削除する）
+JOB_RETENTION_DAYS = float(os.environ.get('PA_JOB_RETENTION_DAYS', '7'))
+JOB_PRUNE_INTERVAL_SEC = 3600
+
+
+class SimpleJobQueue:
+    # アップロードをジョブとして受け付け、スレッドプールで実行する。
+    # 状態は jobs/<id>/state.json に保存するので、ブラウザを更新しても結果は残る。
+    # ジョブIDは作成時刻で始まるので、ユーザーごとのID一覧から新しいものだけを読める
+    def __init__(self, jobs_dir='jobs', workers=JOB_WORKERS, cache=None, retention_days=JOB_RETENTION_DAYS):
+        self.jobs_dir = Path(jobs_dir)
+        self.jobs_dir.mkdir(exist_ok=True)
+        self.cache = cache or SimpleResultCache()
+        self.retention_days = retention_days
+        self.lock = threading.Lock()
+        self.user_jobs = {}
+        self.last_prune = time.time()
+        # 同じユーザー・ミキサーのレコードを同時に読み書きしないよう学習は直列化する
+        self.store_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='pa-job')
+        self._recover()
     
-    def save(self, user_email, result, metadata):
-        filename = user_email.replace('@', '_at_').replace('.', '_') + '.json'
-        filepath = self.data_dir / filename
+    def _state_path(self, job_id):
+        return self.jobs_dir / job_id / 'state.json'
+    
+    def _expired_before(self):
+        # この文字列より小さいジョブIDは保存期間を過ぎている
+        return (datetime.now() - timedelta(days=self.retention_days)).strftime('%Y%m%d_%H%M%S_')
+    
+    def _recover(self):
+        # 前回プロセスの未完了ジョブ: 待機中は再投入、実行中は中断扱い。
+        # 保存期間を過ぎた完了ジョブは削除し、残りでユーザーごとのID一覧を作る
+        expired = self._expired_before()
+        for path in sorted(self.jobs_dir.glob('*/state.json')):
+            with open(path, 'r') as f:
+                job = json.load(f)
+            if job['id'] < expired and job['status'] in ('done', 'failed'):
+                shutil.rmtree(path.parent, ignore_errors=True)
+                continue
+            self.user_jobs.setdefault(job['user'], []).append(job['id'])
+            if job['status'] == 'queued':
+                self.executor.submit(self._run, job['id'])
+            elif job['status'] == 'running':
+                self.update(job['id'], status='failed', error="サーバー再起動により中断されました")
+    
+    def submit(self, user_email, filename, data, metadata, options):
+        job_id = datetime.now().strftime('%Y%m%d_%H%M%S_') + secrets.token_hex(3)
+        job_dir = self.jobs_dir / job_id
+        job_dir.mkdir()
         
-        data = {'analyses': []}
-        if filepath.exists():
-            with open(filepath, 'r') as f:
-                data = json.load(f)
+        input_path = job_dir / ('input' + (Path(filename).suffix or '.wav'))
+        with open(input_path, 'wb') as f:
+            f.write(data)
         
-        data['analyses'].append({
-            'id': datetime.now().strftime('%Y%m%d_%H%M%S'),
-            'timestamp': datetime.now().isoformat(),
+        now = datetime.now().isoformat()
+        job = {
+            'id': job_id,
+            'user': user_email,
+            'filename': filename,
+            'input': input_path.name,
+            'content_hash': SimpleResultCache.content_hash(data),
+            'cache_hit': {},
             'metadata': metadata,
-            'result': result
-        })
-        
-        with open(filepath, 'w') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+            'options': options,
+            'status': 'queued',
+            'stage': '待機中',
+            'progress': 0.0,
+            'result': None,
+            'insights': [],
+            'analysis_stats': None,
+            'stems': None,
+            'masking': None,
+            'error': None,
+            'created': now,
+            'updated': now
+        }
+        write_json_atomic(self._state_path(job_id), job)
+        with self.lock:
+            self.user_jobs.setdefault(user_email, []).append(job_id)
+        self.executor.submit(self._run, job_id)
+        return job_id
     
-    def load(self, user_email):
-        filename = user_email.replace('@', '_at_').replace('.', '_') + '.json'
-        filepath = self.data_dir / filename
+    def get(self, job_id):
+        path = self._state_path(job_id)
+        if not path.exists():
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+    
+    def update(self, job_id, **fields):
+        with self.lock:
+            job = self.get(job_id)
+            job.update(fields)
+            job['updated'] = datetime.now().isoformat()
+            write_json_atomic(self._state_path(job_id), job)
+            return job
+    
+    def list(self, user_email, limit=10):
+        # 読むのはこのユーザーの新しい limit 件の state.json だけ（1秒ごとのポーリングで呼ばれる）
+        if time.time() - self.last_prune > JOB_PRUNE_INTERVAL_SEC:
+            self.prune()
+        with self.lock:
+            job_ids = self.user_jobs.get(user_email, [])[-limit:]
+        jobs = [job for job in map(self.get, job_ids) if job is not None]
+        return sorted(jobs, key=lambda x: x['created'], reverse=True)
+    
+    def prune(self):
+        # 保存期間を過ぎた完了・失敗ジョブを削除する（古いIDの state.json だけを読む）
+        expired = self._expired_before()
+        self.last_prune = time.time()
+        with self.lock:
+            for user_email, job_ids in self.user_jobs.items():
+                keep = []
+                for job_id in job_ids:
+                    if job_id < expired:
+                        job = self.get(job_id)
+                        if job is None or job['status'] in ('done', 'failed'):
+                            shutil.rmtree(self.jobs_dir / job_id, ignore_errors=True)
+                            continue
+                    keep.append(job_id)
+                self.user_jobs[user_email] = keep
+    
+    def _run(self, job_id):
+        try:
+            run_analysis_job(self, job_id)
+        except Exception as e:
+            self.update(job_id, status='failed', error=f"解析エラー: {str(e)}")
+        finally:
+            # 状態ファイルが消えていれば（保存期間切れで削除済み）入力も残っていない
+            job = self.get(job_id)
+            if job:
+                (self.jobs_dir / job_id / job['input']).unlink(missing_ok=True)
+
+
+def run_analysis_job(queue, job_id):
+    from pa_core import (
+        AudioHandle,
+        DEFAULT_BANDS,
+        SimpleAnalyzer,
+        SimpleSeparator,
+        SimpleStreamAnalyzer,
+        StageTimer
+    )
+    from pa_metering import SimpleFeedbackMeter, SimpleLoudnessMeter, SimpleStereoMeter
+    from pa_multichannel import SimpleBusMix, SimpleMultichannelAnalyzer, mix_matrices, parse_groups, stereo_bus
+    from pa_overview import SimpleOverviewMeter
+    from pa_reference import SimpleFingerprintMeter
+    from pa_stems import SimpleStemAnalyzer
+    
+    job = queue.update(job_id, status='running', stage='解析中')
+    job_dir = queue.jobs_dir / job_id
+    input_path = str(job_dir / job['input'])
+    options = job['options']
+    metadata = job['metadata']
+    timer = StageTimer()
+    
+    # 入力は1回だけ開き、解析と楽器分離で共有する（WAVはメモリマップ）。
+    # キャッシュに結果があれば開かない
+    audio = None
+    
+    def open_audio():
+        nonlocal audio
+        if audio is None:
+            audio = AudioHandle(input_path)
+        return audio
+    
+    try:
+        # 3ch以上（卓のマルチ録音）かどうかはヘッダだけで判定する（soundfile で読めない MP3 等は2ch以下）
+        cache = queue.cache
+        n_channels = 0
+        try:
+            with AudioHandle(input_path, allow_decode=False) as probe:
+                n_channels = probe.channels
+        except RuntimeError:
+            pass
+        multichannel = n_channels > 2
+        groups = {}
+        multichannel_error = None
+        if multichannel:
+            try:
+                groups = parse_groups(options.get('groups') or '')
+                # チャンネル番号が範囲外ならグループなしで解析する
+                mix_matrices(groups, n_channels)
+            except ValueError as e:
+                groups = {}
+                multichannel_error = str(e)
+        # 卓の入力をそのまま2ch前提の計測器（ラウドネスのサラウンド重み・L/R の相関や指紋）に通さない。
+        # マルチ録音ではステレオのバスを定義したときだけ、そのバスの L/R に計測器を使う
+        bus_name, bus = stereo_bus(groups)
+        stereo_meters = not multichannel or bus is not None
         
-        if filepath.exists():
-            with open(filepath, 'r') as f:
-                data = json.load(f)
-                return sorted(data['analyses'], key=lambda x: x['timestamp'], reverse=True)
-        return []
+        # 基本解析（同じ音源・同じ条件の結果があれば再利用）。
+        # ストリーミングは読み込み方が違うだけで指標は同じなので、キーには含めない
+        streaming = bool(options.get('streaming'))
+        metrics_params = {
+            'kind': 'metrics',
+            'sr': 'native',
+            'bands': DEFAULT_BANDS,
+            'band_mode': 'fft',
+            'meters': (['loudness', 'fingerprint', 'stereo'] if stereo_meters else []) + ['feedback', 'overview']
+        }
+        if multichannel:
+            metrics_params['mix'] = bus
+        metrics_key = cache.make_key(job['content_hash'], metrics_params)
+        # 同じ音源のジョブが同時に来たら、後のジョブは先の解析が保存されるのを待ってキャッシュを使う
+        with cache.single_flight(metrics_key):
+            with timer.stage('cache_lookup'):
+                cached = cache.get_metrics(metrics_key)
+            
+            if cached:
+                result = cached['result']
+                stats = cached['stats']
+            else:
+                with timer.stage('decode'):
+                    audio = open_audio()
+                    if multichannel:
+                        # 全チャンネルを一度に float32 にすると 64ch・1時間で約44GB になるので、
+                        # バス（無ければ全入力の平均）をブロックごとに合成しながら解析する
+                        analyzer = SimpleStreamAnalyzer(SimpleBusMix(audio, bus))
+                    elif streaming:
+                        analyzer = SimpleStreamAnalyzer(audio)
+                    else:
+                        analyzer = SimpleAnalyzer(audio)
+                
+                meter = None
+                stereo_meter = None
+                if stereo_meters:
+                    # ラウドネス・トゥルーピークは同じ読み込みパスで計測し、時系列は npz で保存する
+                    meter = SimpleLoudnessMeter(analyzer.sr, analyzer.channels)
+                    analyzer.add_meter('loudness', meter)
+                    # リファレンス比較用の指紋（1/3オクターブLTAS・M/S）も同じパスで求める
+                    analyzer.add_meter('fingerprint', SimpleFingerprintMeter(analyzer.sr, analyzer.channels))
+                    # 100ms窓ごとの L/R 相関・モノ損失・バンドごとの M/S 比
+                    stereo_meter = SimpleStereoMeter(analyzer.sr, analyzer.channels)
+                    analyzer.add_meter('stereo', stereo_meter)
+                # 長く続く狭帯域のピーク（ハウリング・共振）
+                analyzer.add_meter('feedback', SimpleFeedbackMeter(analyzer.sr, analyzer.channels))
+                # 波形・スペクトログラムの概観ピラミッド（表示はメモリマップで必要な段だけ読む）。
+                # 解析中の細かい段はジョブのディレクトリに追記していくのでメモリは増えない
+                overview_meter = SimpleOverviewMeter(analyzer.sr, analyzer.channels, spill_dir=job_dir)
+                analyzer.add_meter('overview', overview_meter)
+                with timer.stage('analyze'):
+                    result = analyzer.analyze()
+                stats = getattr(analyzer, 'stats', None) or None
+                if multichannel:
+                    # 全体の指標をどの信号で求めたか（None は全入力の平均）
+                    result['mix'] = bus_name
+                
+                with timer.stage('cache_store'):
+                    files = {'overview': overview_meter.save(job_dir / 'overview')}
+                    if meter is not None:
+                        files['timelines.npz'] = job_dir / 'timelines.npz'
+                        np.savez(files['timelines.npz'], **meter.timelines())
+                        files['stereo.npz'] = job_dir / 'stereo.npz'
+                        np.savez(files['stereo.npz'], **stereo_meter.timelines())
+                    cache.put_metrics(metrics_key, result, stats, files=files)
+        
+        timelines_path = cache.cache_dir / metrics_key / 'timelines.npz'
+        stereo_path = cache.cache_dir / metrics_key / 'stereo.npz'
+        overview_dir = cache.cache_dir / metrics_key / 'overview'
+        
+        # マルチ録音はチャンネル別・グループ別の指標を1ブロックずつ求める
+        if multichannel:
+            multi_key = cache.make_key(job['content_hash'], {
+                'kind': 'multichannel',
+                'bands': DEFAULT_BANDS,
+                'band_mode': 'fft',
+                'groups': groups
+            })
+            with cache.single_flight(multi_key):
+                cached_multi = cache.get_metrics(multi_key)
+                if cached_multi:
+                    multichannel_result = cached_multi['result']
+                else:
+                    with timer.stage('multichannel'):
+                        multichannel_result = SimpleMultichannelAnalyzer(open_audio(), groups).analyze()
+                    cache.put_metrics(multi_key, multichannel_result)
+            result = dict(result, multichannel=multichannel_result)
+        
+        # AI学習（記録の保存は楽器分離の結果がそろってから）
+        with queue.store_lock:
+            ai = SimpleAI()
+            with timer.stage('ai_learn'):
+                ai.learn(job['user'], result, metadata)
+            insights = ai.get_insights(job['user'], result)
+        
+        # ここまでの結果を先に公開（分離中でも画面に表示できる）
+        queue.update(
+            job_id,
+            result=result,
+            insights=insights,
+            analysis_stats=stats,
+            timelines=str(timelines_path) if timelines_path.exists() else None,
+            stereo_timelines=str(stereo_path) if stereo_path.exists() else None,
+            overview=str(overview_dir) if overview_dir.exists() else None,
+            multichannel_error=multichannel_error,
+            cache_hit={'metrics': bool(cached)},
+            timings=timer.stages,
+            stage='楽器分離中' if options.get('separation') else '完了'
+        )
+        
+        # 楽器分離
+        stems = None
+        masking = None
+        if options.get('separation'):
+            separator = SimpleSeparator(mode=options.get('separation_mode'))
+            stems_key = cache.make_key(job['content_hash'], {
+                'kind': 'stems',
+                'model': separator.model_id,
+                'bands': DEFAULT_BANDS
+            })
+            with cache.single_flight(stems_key):
+                cached_stems = cache.get_stems(stems_key)
+                
+                if cached_stems:
+                    stems = cached_stems['stems']
+                    masking = cached_stems.get('masking')
+                    queue.update(
+                        job_id,
+                        stems=stems,
+                        masking=masking,
+                        cache_hit={'metrics': bool(cached), 'stems': True}
+                    )
+                else:
+                    stems_dir = job_dir / 'stems'
+                    
+                    def on_progress(done, total):
+                        queue.update(job_id, progress=done / total, stage=f"楽器分離中 {done}/{total}")
+                    
+                    try:
+                        # 初回はここでモデルをロードする（プロセス内で共有されるので2回目以降はすぐ終わる）
+                        queue.update(job_id, stage='分離モデル読み込み中')
+                        with timer.stage('model_load'):
+                            separator.load()
+                        with timer.stage('separation'):
+                            separated, error = separator.separate_to_files(open_audio(), stems_dir, progress=on_progress)
+                        if separated:
+                            # 4ステムを (4, 2, n) のブロックに重ねて、全指標とマスキングを1パスで求める
+                            try:
+                                with timer.stage('stem_analysis'):
+                                    # 例外で抜けても閉じてから stems_dir を消す
+                                    with SimpleStemAnalyzer(separated) as stem_analyzer:
+                                        stem_result = stem_analyzer.analyze()
+                            except Exception as e:
+                                error = f"ステム解析エラー: {str(e)}"
+                            else:
+                                stems = stem_result['stems']
+                                masking = stem_result['masking']
+                                cache.put_stems(stems_key, separated, stems, masking)
+                                queue.update(job_id, stems=stems, masking=masking)
+                        if not stems:
+                            queue.update(job_id, separation_error=error)
+                    finally:
+                        shutil.rmtree(stems_dir, ignore_errors=True)
+        
+        # ステムごとの結果も同じ記録に含めて保存する
+        record = dict(result, stems=stems, masking=masking) if stems else result
+        with queue.store_lock:
+            with timer.stage('storage_save'):
+                storage = SimpleStorage()
+                storage.save(job['user'], record, metadata)
+        
+    finally:
+        # 例外で抜けても閉じる（Windowsでは開いたままの入力を削除できない）
+        if audio is not None:
+            audio.close()
+    
+    queue.update(job_id, status='done', stage='完了', progress=1.0, timings=timer.stages)
+
+
+@st.cache_resource(show_spinner=False)
+def get_auth():
+    return SimpleAuth()
+
+
+@st.cache_resource(show_spinner=False)
+def get_result_cache():
+    return SimpleResultCache()
+
+
+@st.cache_resource(show_spinner=False)
+def get_reference_index():
+    from pa_reference import SimpleReferenceIndex
+    return SimpleReferenceIndex()
+
+
+@st.cache_resource(show_spinner=False)
+def get_job_queue():
+    return SimpleJobQueue(cache=get_result_cache())
 
 
 # =====================================
 # メインアプリ
 # =====================================
 
+def setup_page():
+    st.set_page_config(
+        page_title="PA Audio Analyzer V4.0",
+        page_icon="🎛️",
+        layout="wide"
+    )
+    st.markdown(PAGE_CSS, unsafe_allow_html=True)
+
+
 def init_session():
-    if 'authenticated' not in st.session_state:
-        st.session_state.authenticated = False
+    if 'token' not in st.session_state:
+        st.session_state.token = None
     if 'user' not in st.session_state:
         st.session_state.user = None
     if 'page' not in st.session_state:
@@ -369,7 +1232,7 @@ def init_session():
 
 
 def show_login():
-    auth = SimpleAuth()
+    auth = get_auth()
     
     st.markdown('<h1 class="main-header">🎛️ PA Audio Analyzer V4.0</h1>', unsafe_allow_html=True)
     st.markdown("### 🔐 ログイン")
@@ -384,8 +1247,7 @@ def show_login():
             if st.form_submit_button("ログイン", use_container_width=True, type="primary"):
                 success, user = auth.login(email, password)
                 if success:
-                    st.session_state.authenticated = True
-                    st.session_state.user = {'email': email, 'username': user['username']}
+                    st.session_state.token = auth.issue_token(email, user['username'])
                     st.rerun()
                 else:
                     st.error("ログイン失敗")
@@ -415,20 +1277,66 @@ def show_analyzer():
         st.caption(user['email'])
         st.markdown("---")
         
-        menu = st.radio("メニュー", ["🎵 解析", "📊 履歴", "🚪 ログアウト"], label_visibility="collapsed")
+        menu = st.radio("メニュー", ["🎵 解析", "🔴 ライブ", "📊 履歴", "🚪 ログアウト"], label_visibility="collapsed")
+        st.checkbox("⏱️ 処理時間を表示", key='show_timings')
         
         if menu == "🚪 ログアウト":
-            st.session_state.authenticated = False
+            stop_live()
+            st.session_state.token = None
             st.session_state.user = None
             st.rerun()
     
     if menu == "🎵 解析":
         show_analysis_page(user)
+    elif menu == "🔴 ライブ":
+        show_live_page(user)
     elif menu == "📊 履歴":
         show_history_page(user)
+    
+    show_model_metrics()
+    show_cache_metrics()
+
+
+def show_cache_metrics():
+    stats = get_result_cache().stats()
+    
+    with st.sidebar:
+        st.markdown("---")
+        st.markdown("#### ⚡ 解析キャッシュ")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("ヒット", stats['hits'])
+        with col2:
+            st.metric("ミス", stats['misses'])
+        st.caption(f"{stats['entries']}件 / {stats['size_mb']:.0f} MB")
+
+
+def show_model_metrics():
+    # モデルは pa_core 経由でしかロードされないので、未読み込みなら表示するものもない
+    core = sys.modules.get('pa_core')
+    stats = core.separator_model_stats() if core else {}
+    if not stats:
+        return
+    
+    with st.sidebar:
+        st.markdown("---")
+        st.markdown("#### 🧠 分離モデル")
+        for name, info in stats.items():
+            st.caption(f"{name} ({info['device']} / {info['mode']}{' / compiled' if info['compiled'] else ''})")
+            col1, col2 = st.columns(2)
+            with col1:
+                st.metric("ロード時間", f"{info['load_time_sec']:.1f} s")
+            with col2:
+                st.metric("パラメータ", f"{info['param_mb']:.0f} MB")
+            if info['rss_mb'] is not None:
+                st.caption(f"プロセスRSS: {info['rss_mb']:.0f} MB")
+            if info['compile_error']:
+                st.caption(f"コンパイルなしで実行中: {info['compile_error'][:80]}")
 
 
 def show_analysis_page(user):
+    from pa_core import SEPARATION_MODE, SimpleSeparator
+    
     st.markdown('<h1 class="main-header">🎛️ PA Audio Analyzer V4.0</h1>', unsafe_allow_html=True)
     
     # 楽器分離の可否表示
@@ -440,6 +1348,7 @@ def show_analysis_page(user):
     
     st.markdown("---")
     
+    queue = get_job_queue()
     uploaded = st.file_uploader("音源ファイル（WAV/MP3）", type=['wav', 'mp3'])
     
     if uploaded:
@@ -451,150 +1360,831 @@ def show_analysis_page(user):
         
         with col2:
             mixer = st.text_input("ミキサー", placeholder="Yamaha CL5")
+            groups = st.text_input(
+                "チャンネルグループ（マルチ録音のみ）", placeholder="drums=1-8; vocals=17-20; main=31/32",
+                help="名前=チャンネル番号。L/R で指定するとステレオのバスとして扱い、最初のバスでラウドネス・ステレオを解析します"
+            )
             use_separation = st.checkbox("楽器分離AI使用", value=False, disabled=not separator.available)
+            # CPU向けの高速モード（int8量子化。精度と速度の差は pa_bench.py --separation で測れる）
+            fast_separation = st.checkbox(
+                "高速モード（int8量子化・CPU）", value=SEPARATION_MODE == 'int8', disabled=not use_separation
+            )
+            # モデルのロードは解析ジョブのワーカーで行う（スクリプトの再実行を止めない）
+            separator = SimpleSeparator(mode='int8' if fast_separation else 'float32')
+            use_streaming = st.checkbox("ストリーミング解析（長時間ファイル向け）", value=False)
         
         if st.button("🚀 解析開始", type="primary", use_container_width=True):
-            with st.spinner("解析中..."):
-                # 一時保存
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as tmp:
-                    tmp.write(uploaded.getvalue())
-                    tmp_path = tmp.name
-                
-                try:
-                    # 基本解析
-                    analyzer = SimpleAnalyzer(tmp_path)
-                    result = analyzer.analyze()
-                    
-                    # メタデータ
-                    metadata = {
-                        'analysis_name': name or '名称未設定',
-                        'venue': venue or '不明',
-                        'mixer': mixer or '不明'
-                    }
-                    
-                    # AI学習
-                    ai = SimpleAI()
-                    ai.learn(user['email'], result, metadata)
-                    
-                    # データ保存
-                    storage = SimpleStorage()
-                    storage.save(user['email'], result, metadata)
-                    
-                    # 結果表示
-                    st.success("✅ 解析完了！")
-                    
-                    col1, col2, col3, col4 = st.columns(4)
-                    with col1:
-                        st.metric("RMS", f"{result['rms_db']:.1f} dB")
-                    with col2:
-                        st.metric("Peak", f"{result['peak_db']:.1f} dB")
-                    with col3:
-                        st.metric("Crest", f"{result['crest_factor']:.1f} dB")
-                    with col4:
-                        st.metric("Stereo", f"{result['stereo_width']:.1f}%")
-                    
-                    # グラフ
-                    st.markdown("### 📊 周波数分布")
-                    fig, ax = plt.subplots(figsize=(10, 4))
-                    bands = list(result['band_energies'].keys())
-                    energies = list(result['band_energies'].values())
-                    colors = ['#8B0000', '#FF4500', '#FFD700', '#32CD32', '#4169E1', '#9370DB', '#FF1493']
-                    ax.bar(bands, energies, color=colors, alpha=0.7)
-                    ax.set_ylabel('Energy (dB)')
-                    ax.grid(True, alpha=0.3)
-                    plt.xticks(rotation=45)
-                    st.pyplot(fig)
-                    plt.close()
-                    
-                    # AI提案
-                    st.markdown("### 🧠 AI分析")
-                    insights = ai.get_insights(user['email'], result)
-                    for insight in insights:
-                        st.markdown(f'<div class="ai-insight">{insight}</div>', unsafe_allow_html=True)
-                    
-                    # 改善提案
-                    st.markdown("### 💡 改善提案")
-                    
-                    rms = result['rms_db']
-                    if -20 <= rms <= -16:
-                        st.markdown(f'<div class="good-point">✅ RMS音圧が適切です（{rms:.1f}dB）</div>', unsafe_allow_html=True)
-                    elif rms < -23:
-                        st.markdown(f'<div class="critical">⚠️ 音圧が低すぎます（{rms:.1f}dB）。マスターを上げてください</div>', unsafe_allow_html=True)
-                    
-                    peak = result['peak_db']
-                    if peak > -1:
-                        st.markdown(f'<div class="critical">⚠️ ピークが高すぎます（{peak:.1f}dB）。クリッピングの危険</div>', unsafe_allow_html=True)
-                    
-                    width = result['stereo_width']
-                    if 50 <= width <= 70:
-                        st.markdown(f'<div class="good-point">✅ ステレオ幅が理想的です（{width:.1f}%）</div>', unsafe_allow_html=True)
-                    
-                    # 楽器分離
-                    if use_separation:
-                        st.markdown("---")
-                        st.markdown("### 🎸 楽器分離解析")
-                        
-                        with st.spinner("楽器分離中...（数分かかります）"):
-                            separated, error = separator.separate(tmp_path)
-                            
-                            if separated:
-                                st.success("✅ 分離完了！")
-                                
-                                for inst_name, inst_audio in separated.items():
-                                    with st.expander(f"🎵 {inst_name.upper()}"):
-                                        mono = np.mean(inst_audio, axis=0)
-                                        rms = 20 * np.log10(np.sqrt(np.mean(mono ** 2)) + 1e-10)
-                                        peak = 20 * np.log10(np.max(np.abs(mono)) + 1e-10)
-                                        
-                                        col1, col2 = st.columns(2)
-                                        with col1:
-                                            st.metric("RMS", f"{rms:.1f} dB")
-                                        with col2:
-                                            st.metric("Peak", f"{peak:.1f} dB")
-                            else:
-                                st.error(error)
-                    
-                finally:
-                    os.unlink(tmp_path)
+            metadata = {
+                'analysis_name': name or '名称未設定',
+                'venue': venue or '不明',
+                'mixer': mixer or '不明'
+            }
+            options = {
+                'separation': bool(use_separation and separator.available),
+                'separation_mode': separator.mode,
+                'streaming': use_streaming,
+                'groups': groups
+            }
+            st.session_state.job_id = queue.submit(
+                user['email'], uploaded.name, uploaded.getbuffer(), metadata, options
+            )
+    
+    show_jobs(user, queue)
+
+
+def show_jobs(user, queue):
+    jobs = queue.list(user['email'])
+    if not jobs:
+        return
+    
+    st.markdown("---")
+    
+    labels = {
+        'queued': '⏳ 待機中',
+        'running': '🔄 実行中',
+        'done': '✅ 完了',
+        'failed': '❌ 失敗'
+    }
+    ids = [job['id'] for job in jobs]
+    current = st.session_state.get('job_id')
+    index = ids.index(current) if current in ids else 0
+    
+    selected = st.selectbox(
+        "解析ジョブ",
+        ids,
+        index=index,
+        format_func=lambda job_id: next(
+            f"{labels[job['status']]} {job['metadata']['analysis_name']} "
+            f"({datetime.fromisoformat(job['created']).strftime('%m/%d %H:%M')})"
+            for job in jobs if job['id'] == job_id
+        )
+    )
+    st.session_state.job_id = selected
+    job = next(job for job in jobs if job['id'] == selected)
+    
+    if job['status'] in ('queued', 'running'):
+        st.progress(job['progress'], text=job['stage'])
+    elif job['status'] == 'failed':
+        st.error(job['error'])
+    
+    if job['result']:
+        show_result(job)
+    
+    # 実行中のジョブがあれば一定間隔で再描画してステータスを更新する
+    if any(j['status'] in ('queued', 'running') for j in jobs):
+        time.sleep(JOB_POLL_SEC)
+        st.rerun()
+
+
+def pyplot():
+    # matplotlib.pyplot は最初にグラフを描くときに読み込む
+    global _pyplot
+    if _pyplot is None:
+        import matplotlib.pyplot as plt
+        plt.rcParams['figure.max_open_warning'] = 50
+        _pyplot = plt
+    return _pyplot
+
+
+def show_figure(fig):
+    st.pyplot(fig)
+    pyplot().close(fig)
+
+
+def format_db(value, unit):
+    return "-" if value is None else f"{value:.1f} {unit}"
+
+
+def downsample_max(values, max_points=2000):
+    # 描画用に区間ごとの最大値へ間引く（大音量の瞬間を落とさない）
+    step = max(1, int(np.ceil(len(values) / max_points)))
+    n = len(values) // step * step
+    if n == 0:
+        return values, step
+    return values[:n].reshape(-1, step).max(axis=1), step
+
+
+def show_loudness_timeline(path):
+    st.markdown("### 📈 ラウドネス推移")
+    with np.load(path) as data:
+        block_sec = float(data['block_sec'])
+        short_term = data['short_term_lufs']
+        true_peak = data['true_peak_db']
+    
+    fig, (ax1, ax2) = pyplot().subplots(2, 1, figsize=(10, 5), sharex=True)
+    
+    values, step = downsample_max(short_term)
+    # ショートタームは3秒窓の終端が時刻
+    times = (np.arange(len(values)) * step + 30) * block_sec / 60
+    ax1.plot(times, values, color='#667eea', linewidth=1)
+    ax1.set_ylabel('Short-term (LUFS)')
+    ax1.grid(True, alpha=0.3)
+    
+    values, step = downsample_max(true_peak)
+    times = (np.arange(len(values)) + 1) * step * block_sec / 60
+    ax2.plot(times, values, color='#764ba2', linewidth=1)
+    ax2.axhline(-1, color='#ff4444', linestyle='--', linewidth=1)
+    ax2.set_ylabel('True Peak (dBTP)')
+    ax2.set_xlabel('Time (min)')
+    ax2.grid(True, alpha=0.3)
+    
+    show_figure(fig)
+
+
+def show_stereo_timeline(path):
+    with np.load(path) as data:
+        block_sec = float(data['block_sec'])
+        correlation = data['correlation']
+        mono_loss = data['mono_loss_db']
+    
+    fig, (ax1, ax2) = pyplot().subplots(2, 1, figsize=(10, 4), sharex=True)
+    
+    # 相関は区間ごとの最小値、モノ損失は最大値に間引く（問題のある瞬間を落とさない）
+    values, step = downsample_max(-np.nan_to_num(correlation, nan=-1.0))
+    times = (np.arange(len(values)) + 1) * step * block_sec / 60
+    ax1.plot(times, -values, color='#667eea', linewidth=1)
+    ax1.axhline(0, color='#ff4444', linestyle='--', linewidth=1)
+    ax1.set_ylim(-1.05, 1.05)
+    ax1.set_ylabel('L/R Correlation')
+    ax1.grid(True, alpha=0.3)
+    
+    values, step = downsample_max(np.nan_to_num(mono_loss, nan=0.0))
+    times = (np.arange(len(values)) + 1) * step * block_sec / 60
+    ax2.plot(times, values, color='#764ba2', linewidth=1)
+    ax2.axhline(3, color='#ff4444', linestyle='--', linewidth=1)
+    ax2.set_ylabel('Mono Loss (dB)')
+    ax2.set_xlabel('Time (min)')
+    ax2.grid(True, alpha=0.3)
+    
+    show_figure(fig)
+
+
+def show_overview(job):
+    from pa_overview import OVERVIEW_WIDTH, SimpleOverview, spectrogram_image, waveform_image
+    
+    overview = SimpleOverview(job['overview'])
+    st.markdown("### 🌊 波形・スペクトログラム")
+    duration = max(overview.duration, 0.1)
+    start, end = st.slider(
+        "表示範囲（秒）", 0.0, float(duration), (0.0, float(duration)),
+        step=min(1.0, duration / 100), key=f"overview_{job['id']}"
+    )
+    # 表示範囲に合った段から画面幅の2倍以内だけを読むので、全体表示でも数秒の拡大でも同じ時間で描ける
+    wave = overview.waveform(start, end, OVERVIEW_WIDTH)
+    spec = overview.spectrogram(start, end, OVERVIEW_WIDTH)
+    st.image(waveform_image(wave, OVERVIEW_WIDTH), use_container_width=True)
+    st.image(spectrogram_image(spec, OVERVIEW_WIDTH), use_container_width=True)
+    st.caption(
+        f"{format_time(start)} 〜 {format_time(end)} ／ 縦軸 "
+        f"{spec['freqs'][0]:.0f} Hz 〜 {spec['freqs'][-1] / 1000:.0f} kHz（対数）"
+    )
+
+
+def show_stereo(job):
+    stereo = job['result']['stereo']
+    st.markdown("### 🔀 位相・モノラル互換性")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("L/R相関", f"{stereo['correlation']:+.2f}")
+    with col2:
+        st.metric("最小相関", "-" if stereo['min_correlation'] is None else f"{stereo['min_correlation']:+.2f}")
+    with col3:
+        st.metric("逆相気味の時間", format_db(stereo['out_of_phase_pct'], "%"))
+    with col4:
+        st.metric("モノラル損失", format_db(stereo['mono_loss_db'], "dB"))
+    
+    if job.get('stereo_timelines') and Path(job['stereo_timelines']).exists():
+        show_stereo_timeline(job['stereo_timelines'])
+
+
+def multichannel_table(rows):
+    bands = list(next(iter(rows.values()))['band_energies']) if rows else []
+    table = {
+        'RMS': {name: round(m['rms_db'], 1) for name, m in rows.items()},
+        'Peak': {name: round(m['peak_db'], 1) for name, m in rows.items()},
+        'Crest': {name: round(m['crest_factor'], 1) for name, m in rows.items()}
+    }
+    for band in bands:
+        table[band] = {name: round(m['band_energies'][band], 1) for name, m in rows.items()}
+    return table
+
+
+def show_multichannel(job):
+    multi = job['result']['multichannel']
+    st.markdown(f"### 🎚️ チャンネル別（{multi['channel_count']}ch）")
+    if job.get('multichannel_error'):
+        st.warning(f"チャンネルグループを使えませんでした: {job['multichannel_error']}")
+    if 'mix' in job['result']:
+        if job['result']['mix']:
+            st.caption(f"上の RMS・ステレオ幅・ラウドネスはバス「{job['result']['mix']}」の L/R で求めています")
+        else:
+            st.caption("上の RMS・バンドは全入力の平均です。ラウドネス・ステレオの解析にはステレオのバス（main=31/32 など）を定義してください")
+    st.dataframe(multichannel_table(multi['channels']), use_container_width=True)
+    
+    if multi['groups']:
+        st.markdown("#### グループ・バス")
+        table = multichannel_table(multi['groups'])
+        table['Stereo'] = {name: round(m['stereo_width'], 1) if 'stereo_width' in m else None
+                           for name, m in multi['groups'].items()}
+        st.dataframe(table, use_container_width=True)
+    
+    # 無音（録音されていない）チャンネルとクリップしているチャンネル
+    silent = [name for name, m in multi['channels'].items() if m['peak_db'] < -90]
+    clipped = [name for name, m in multi['channels'].items() if m['peak_db'] > -0.1]
+    if silent:
+        st.caption(f"無音のチャンネル: {', '.join(silent)}")
+    if clipped:
+        st.markdown(f'<div class="critical">⚠️ クリップしているチャンネル: {", ".join(clipped)}。ヘッドアンプのゲインを確認してください</div>', unsafe_allow_html=True)
+
+
+def format_time(sec):
+    return f"{int(sec // 60)}:{sec % 60:04.1f}"
+
+
+def show_feedback(feedback):
+    st.markdown("### 📢 ハウリング・共振")
+    if not feedback['events']:
+        st.caption("長く続く狭帯域のピークは検出されませんでした")
+        return
+    
+    # 同じ周波数で繰り返し鳴っているもの（EQで削る候補）
+    for item in feedback['frequencies'][:5]:
+        st.markdown(
+            f'<div class="critical">⚠️ {item["freq_hz"]:.0f} Hz: {item["count"]}回・合計 {item["total_sec"]:.1f}秒'
+            f'（周辺より最大 +{item["max_above_floor_db"]:.0f} dB）</div>',
+            unsafe_allow_html=True
+        )
+    events = feedback['events']
+    st.dataframe(
+        {
+            '周波数 (Hz)': [round(e['freq_hz'], 1) for e in events],
+            '開始': [format_time(e['onset_sec']) for e in events],
+            '長さ (秒)': [round(e['duration_sec'], 1) for e in events],
+            'レベル (dB)': [round(e['level_db'], 1) for e in events],
+            '周辺との差 (dB)': [round(e['above_floor_db'], 1) for e in events],
+            '増加 (dB)': [round(e['growth_db'], 1) for e in events]
+        },
+        use_container_width=True
+    )
+    if feedback['event_count'] > len(events):
+        st.caption(f"全 {feedback['event_count']}件のうち、周辺との差が大きい {len(events)}件を表示")
+
+
+def band_chart(result):
+    fig, ax = pyplot().subplots(figsize=(10, 4))
+    bands = list(result['band_energies'].keys())
+    energies = list(result['band_energies'].values())
+    colors = ['#8B0000', '#FF4500', '#FFD700', '#32CD32', '#4169E1', '#9370DB', '#FF1493']
+    ax.bar(bands, energies, color=colors, alpha=0.7)
+    ax.set_ylabel('Energy (dB)')
+    ax.grid(True, alpha=0.3)
+    ax.tick_params(axis='x', labelrotation=45)
+    fig.tight_layout()
+    return fig
+
+
+def stem_band_chart(stems):
+    # ステムごとのバンドエネルギーを横に並べた棒グラフ
+    fig, ax = pyplot().subplots(figsize=(10, 4))
+    names = list(stems)
+    bands = list(next(iter(stems.values()))['band_energies'])
+    x = np.arange(len(bands))
+    width = 0.8 / len(names)
+    for i, name in enumerate(names):
+        energies = [stems[name]['band_energies'][b] for b in bands]
+        ax.bar(x + (i - (len(names) - 1) / 2) * width, energies, width, label=name, alpha=0.8)
+    ax.set_xticks(x)
+    ax.set_xticklabels(bands, rotation=45)
+    ax.set_ylabel('Energy (dB)')
+    ax.grid(True, alpha=0.3)
+    ax.legend()
+    fig.tight_layout()
+    return fig
+
+
+def show_stems(stems, masking):
+    for inst_name, stem in stems.items():
+        with st.expander(f"🎵 {inst_name.upper()}"):
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("RMS", f"{stem['rms_db']:.1f} dB")
+            with col2:
+                st.metric("Peak", f"{stem['peak_db']:.1f} dB")
+            if 'crest_factor' in stem:
+                with col3:
+                    st.metric("Crest", f"{stem['crest_factor']:.1f} dB")
+                with col4:
+                    st.metric("Stereo", f"{stem['stereo_width']:.1f}%")
+    
+    if not all('band_energies' in stem for stem in stems.values()):
+        return
+    
+    st.markdown("#### 📊 楽器ごとの周波数分布")
+    fig = stem_band_chart(stems)
+    show_figure(fig)
+    
+    if not masking:
+        return
+    
+    st.markdown("#### 🔍 マスキング")
+    st.caption("埋もれ率: その楽器が鳴っている時間のうち、他の楽器の合計の方が大きかった割合")
+    st.dataframe(
+        {name: {band: (None if v is None else round(v)) for band, v in row.items()}
+         for name, row in masking['masked_pct'].items()},
+        use_container_width=True
+    )
+    
+    vocals = masking['masked_pct'].get('vocals', {})
+    for band in ('mid', 'high_mid', 'presence'):
+        pct = vocals.get(band)
+        if pct is not None and pct > 50:
+            st.markdown(f'<div class="critical">⚠️ ボーカルが{band}帯域で埋もれています（{pct:.0f}%）。'
+                        f'他の楽器のこの帯域を整理してください</div>', unsafe_allow_html=True)
+    
+    kick_bass = masking['overlap_pct'].get('drums/bass', {})
+    for band in ('sub_bass', 'bass'):
+        pct = kick_bass.get(band)
+        if pct is not None and pct > 50:
+            st.markdown(f'<div class="critical">⚠️ キックとベースが{band}帯域でぶつかっています（{pct:.0f}%）。'
+                        f'どちらかの帯域を住み分けてください</div>', unsafe_allow_html=True)
+
+
+def eq_delta_chart(match):
+    # リファレンスとの1/3オクターブごとの差（+ はリファレンスの方が多い）
+    fig, ax = pyplot().subplots(figsize=(10, 3))
+    bands = [b for b, v in match['eq_delta_db'].items() if v is not None]
+    deltas = [match['eq_delta_db'][b] for b in bands]
+    colors = ['#32CD32' if d >= 0 else '#FF4500' for d in deltas]
+    ax.bar(bands, deltas, color=colors, alpha=0.7)
+    ax.axhline(0, color='gray', linewidth=0.8)
+    ax.set_ylabel('Reference - Mix (dB)')
+    ax.grid(True, alpha=0.3)
+    ax.tick_params(axis='x', labelrotation=90)
+    fig.tight_layout()
+    return fig
+
+
+def show_references(job):
+    from pa_reference import EQ_SUGGEST_DB
+    
+    st.markdown("### 📐 リファレンス比較")
+    index = get_reference_index()
+    user_email = job['user']
+    result = job['result']
+    
+    # 同じ会場のリファレンスを優先し、無ければ全会場から探す
+    venue = job['metadata'].get('venue')
+    matches = []
+    if venue and venue != '不明':
+        matches = index.nearest(user_email, result, k=3, venue=venue)
+    if not matches:
+        matches = index.nearest(user_email, result, k=3)
+    
+    if not matches:
+        st.caption("登録済みのリファレンスがありません。お手本にしたい解析を下のボタンで登録してください")
+    else:
+        best = matches[0]
+        st.caption(" / ".join(
+            f"{m['name']}（{m['venue'] or '-'}・差 {m['distance_db']:.1f} dB）" for m in matches
+        ))
+        st.markdown(f"**最も近いリファレンス: {best['name']}**")
+        fig = eq_delta_chart(best)
+        show_figure(fig)
+        
+        for band, delta in best['eq_delta_db'].items():
+            if delta is None or abs(delta) < EQ_SUGGEST_DB:
+                continue
+            if delta > 0:
+                st.markdown(f'<div class="critical">🎚️ {band}Hz: リファレンスより {delta:.1f}dB 少ない（ブースト候補）</div>', unsafe_allow_html=True)
+            else:
+                st.markdown(f'<div class="critical">🎚️ {band}Hz: リファレンスより {-delta:.1f}dB 多い（カット候補）</div>', unsafe_allow_html=True)
+        
+        deltas = best['deltas']
+        labels = [
+            ('integrated_lufs', "Integrated", "LU"),
+            ('loudness_range', "LRA", "LU"),
+            ('stereo_width', "Stereo", "%"),
+            ('side_mid_db', "Side/Mid", "dB")
+        ]
+        cols = st.columns(len(labels))
+        for col, (key, label, unit) in zip(cols, labels):
+            with col:
+                value = deltas.get(key)
+                st.metric(f"{label}（リファレンス−今回）", "-" if value is None else f"{value:+.1f} {unit}")
+    
+    name = st.text_input("リファレンス名", value=job['metadata'].get('analysis_name', ''), key=f"ref_name_{job['id']}")
+    if st.button("⭐ この解析をリファレンスに登録", key=f"ref_add_{job['id']}"):
+        index.add(user_email, name or '名称未設定', result, job['metadata'])
+        st.success("✅ リファレンスに登録しました")
+
+
+def show_timings(job, render_sec):
+    timings = list(job.get('timings') or [])
+    timings.append({'stage': 'render', 'sec': render_sec})
+    
+    st.markdown("### ⏱️ 処理時間")
+    total = sum(t['sec'] for t in timings)
+    for t in timings:
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            st.progress(min(1.0, t['sec'] / total) if total else 0.0, text=t['stage'])
+        with col2:
+            st.write(f"{t['sec'] * 1000:.0f} ms")
+    st.caption(f"合計 {total:.2f} 秒")
+
+
+def show_result(job):
+    result = job['result']
+    
+    if job['status'] == 'done':
+        st.success("✅ 解析完了！")
+    if job.get('cache_hit', {}).get('metrics'):
+        st.caption("⚡ キャッシュ済みの解析結果を使用しました")
+    stats = job.get('analysis_stats')
+    if stats:
+        st.caption(
+            f"ストリーミング解析: {stats['duration_sec'] / 60:.1f}分 / "
+            f"{stats['elapsed_sec']:.1f}秒 / ピークメモリ {stats['peak_memory_mb']:.1f} MB"
+        )
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("RMS", f"{result['rms_db']:.1f} dB")
+    with col2:
+        st.metric("Peak", f"{result['peak_db']:.1f} dB")
+    with col3:
+        st.metric("Crest", f"{result['crest_factor']:.1f} dB")
+    with col4:
+        st.metric("Stereo", f"{result['stereo_width']:.1f}%")
+    
+    loudness = result.get('loudness')
+    if loudness:
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Integrated", format_db(loudness['integrated_lufs'], "LUFS"))
+        with col2:
+            st.metric("LRA", format_db(loudness['loudness_range'], "LU"))
+        with col3:
+            st.metric("Short-term Max", format_db(loudness['max_short_term_lufs'], "LUFS"))
+        with col4:
+            st.metric("True Peak", format_db(loudness['true_peak_db'], "dBTP"))
+    
+    if job.get('timelines') and Path(job['timelines']).exists():
+        show_loudness_timeline(job['timelines'])
+    
+    if result.get('stereo'):
+        show_stereo(job)
+    
+    if result.get('multichannel'):
+        show_multichannel(job)
+    
+    if result.get('feedback'):
+        show_feedback(result['feedback'])
+    
+    if job.get('overview') and Path(job['overview']).exists():
+        show_overview(job)
+    
+    # グラフ
+    st.markdown("### 📊 周波数分布")
+    render_start = time.perf_counter()
+    fig = band_chart(result)
+    show_figure(fig)
+    render_sec = time.perf_counter() - render_start
+    
+    # AI提案
+    st.markdown("### 🧠 AI分析")
+    for insight in job['insights']:
+        st.markdown(f'<div class="ai-insight">{insight}</div>', unsafe_allow_html=True)
+    
+    # 改善提案
+    st.markdown("### 💡 改善提案")
+    
+    rms = result['rms_db']
+    if -20 <= rms <= -16:
+        st.markdown(f'<div class="good-point">✅ RMS音圧が適切です（{rms:.1f}dB）</div>', unsafe_allow_html=True)
+    elif rms < -23:
+        st.markdown(f'<div class="critical">⚠️ 音圧が低すぎます（{rms:.1f}dB）。マスターを上げてください</div>', unsafe_allow_html=True)
+    
+    peak = result['peak_db']
+    if peak > -1:
+        st.markdown(f'<div class="critical">⚠️ ピークが高すぎます（{peak:.1f}dB）。クリッピングの危険</div>', unsafe_allow_html=True)
+    elif loudness and loudness['true_peak_db'] is not None and loudness['true_peak_db'] > -1:
+        tp = loudness['true_peak_db']
+        st.markdown(f'<div class="critical">⚠️ トゥルーピークが高すぎます（{tp:.1f}dBTP）。D/A変換後にクリップする恐れ</div>', unsafe_allow_html=True)
+    
+    width = result['stereo_width']
+    if 50 <= width <= 70:
+        st.markdown(f'<div class="good-point">✅ ステレオ幅が理想的です（{width:.1f}%）</div>', unsafe_allow_html=True)
+    
+    # 無相関のステレオでもモノラル化で3dB下がるので、Side が Mid より明らかに大きい
+    # （損失4.5dB超）帯域だけを逆相成分として警告する
+    stereo = result.get('stereo')
+    if stereo:
+        if stereo['out_of_phase_pct'] is not None and stereo['out_of_phase_pct'] > 5:
+            st.markdown(f'<div class="critical">⚠️ L/Rが逆相気味の時間が {stereo["out_of_phase_pct"]:.0f}% あります。オーバーヘッド等の極性を確認してください</div>', unsafe_allow_html=True)
+        for band, loss in stereo['band_mono_loss_db'].items():
+            if loss > 4.5:
+                st.markdown(f'<div class="critical">⚠️ {band}: モノラルにすると {loss:.1f}dB 下がります（逆相成分）。モノラルのフィル・中継で痩せます</div>', unsafe_allow_html=True)
+    
+    if result.get('fingerprint'):
+        show_references(job)
+    
+    # 楽器分離
+    if job['options'].get('separation'):
+        st.markdown("---")
+        st.markdown("### 🎸 楽器分離解析")
+        
+        if job.get('separation_error'):
+            st.error(job['separation_error'])
+        elif job['stems']:
+            st.success("✅ 分離完了！")
+            show_stems(job['stems'], job.get('masking'))
+        elif job['status'] in ('queued', 'running'):
+            st.info("楽器分離中...（数分かかります）")
+    
+    if st.session_state.get('show_timings'):
+        show_timings(job, render_sec)
+
+
+# ライブ画面の更新間隔（秒）
+LIVE_REFRESH_SEC = 0.5
+
+
+def stop_live():
+    session = st.session_state.get('live')
+    if session is not None:
+        session.stop()
+        st.session_state.live = None
+
+
+def show_live_page(user):
+    from pa_live import PCM_FORMATS, SimpleLiveSession, open_source
+    
+    st.markdown("## 🔴 ライブ解析")
+    session = st.session_state.get('live')
+    
+    if session is None or not session.running:
+        kind = st.radio("入力", ["録音中のWAV", "TCP（raw PCM）"], horizontal=True)
+        col1, col2 = st.columns(2)
+        if kind == "録音中のWAV":
+            with col1:
+                spec = st.text_input("WAVファイルのパス", placeholder="/Volumes/USB/REC0001.wav")
+            with col2:
+                from_start = st.checkbox("先頭から読む", value=False)
+            sr, channels, sample_format = None, 2, 's16le'
+        else:
+            with col1:
+                spec = st.text_input("接続先", placeholder="tcp://127.0.0.1:9000")
+                sample_format = st.selectbox("形式", list(PCM_FORMATS))
+            with col2:
+                sr = st.selectbox("サンプルレート", [44100, 48000, 96000], index=1)
+                channels = st.number_input("チャンネル数", min_value=1, max_value=64, value=2)
+            from_start = False
+        
+        if st.button("▶️ ライブ開始", type="primary", disabled=not spec):
+            try:
+                source = open_source(spec, sr, int(channels), sample_format, from_start=from_start)
+            except (OSError, ValueError) as e:
+                st.error(f"入力を開けません: {e}")
+            else:
+                session = SimpleLiveSession(source)
+                session.start()
+                st.session_state.live = session
+                st.rerun()
+    elif st.button("⏹️ 停止"):
+        session.stop()
+    
+    if session is None:
+        return
+    
+    snap = session.snapshot()
+    if snap['error']:
+        st.error(snap['error'])
+    
+    current = snap['current']
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("RMS（直近）", f"{current['rms_db']:.1f} dB", f"累積 {snap['rms_db']:.1f} dB", delta_color="off")
+    with col2:
+        st.metric("Peak（直近）", f"{current['peak_db']:.1f} dB", f"最大 {snap['peak_db']:.1f} dB", delta_color="off")
+    with col3:
+        st.metric("Crest（直近）", f"{current['crest_factor']:.1f} dB")
+    with col4:
+        st.metric("Stereo（直近）", f"{current['stereo_width']:.1f}%")
+    
+    if len(snap['rms_timeline_db']):
+        timeline = snap['rms_timeline_db']
+        times = (np.arange(len(timeline)) - len(timeline) + 1) * snap['block_sec']
+        st.line_chart({'秒': times, 'RMS (dB)': timeline}, x='秒', y='RMS (dB)', height=200)
+    
+    fig = band_chart(current)
+    show_figure(fig)
+    
+    latency = snap['latency']
+    st.caption(
+        f"経過 {snap['duration_sec']:.0f}秒 / 1ブロック処理 平均 {latency['mean_ms'] or 0:.2f} ms・"
+        f"最大 {latency['max_ms'] or 0:.2f} ms（予算 {latency['budget_ms']:.0f} ms・超過 {latency['over_budget']}回）"
+    )
+    if latency['over_budget']:
+        st.warning("⚠️ 処理が予算を超えたブロックがあります。表示が遅れる可能性があります")
+    
+    for event in snap['feedback']['active']:
+        st.markdown(
+            f'<div class="critical">🔊 {event["freq_hz"]:.0f} Hz が {event["duration_sec"]:.1f}秒 鳴り続けています'
+            f'（周辺 +{event["above_floor_db"]:.0f} dB）</div>',
+            unsafe_allow_html=True
+        )
+    
+    if session.running:
+        time.sleep(LIVE_REFRESH_SEC)
+        st.rerun()
+    
+    # 終了後は累積の結果を履歴に保存できる
+    if snap['duration_sec'] > 0:
+        name = st.text_input("解析名", value=f"ライブ {datetime.now().strftime('%m/%d %H:%M')}")
+        if st.button("💾 履歴に保存"):
+            result = {key: snap[key] for key in ('rms_db', 'peak_db', 'crest_factor', 'stereo_width', 'band_energies')}
+            metadata = {'analysis_name': name, 'venue': '不明', 'mixer': '不明', 'source': 'live'}
+            SimpleStorage().save(user['email'], result, metadata)
+            st.success("✅ 履歴に保存しました")
+
+
+def rolling_mean(values, window):
+    # 末尾そろえの移動平均（先頭は揃っている分だけで平均）
+    csum = np.concatenate([[0.0], np.cumsum(values)])
+    idx = np.arange(1, len(values) + 1)
+    lo = np.maximum(0, idx - window)
+    return (csum[idx] - csum[lo]) / (idx - lo)
+
+
+def downsample_mean(values, max_points):
+    # 区間ごとの平均へ間引いたときの区間の境界（最後の区間の末尾を含む）
+    n = len(values)
+    if n <= max_points:
+        return np.asarray(values), np.arange(n)
+    edges = np.linspace(0, n, max_points + 1).astype(int)
+    means = np.add.reduceat(values, edges[:-1]) / np.diff(edges)
+    return means, edges[1:] - 1
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def history_dashboard(user_email, version, venue=None, mixer=None):
+    # version（件数と最新ID）が変わる＝新しい保存があるまでは集計をやり直さない
+    storage = SimpleStorage()
+    filters = {'venue': venue, 'mixer': mixer}
+    rows = storage.metric_series(user_email, **filters)
+    if not rows:
+        return None
+    
+    timestamps = [row[0] for row in rows]
+    values = np.array([row[1:] for row in rows], dtype=float)
+    
+    trend = {}
+    for i, label in enumerate(['RMS', 'Peak', 'Crest', 'Stereo']):
+        means, index = downsample_mean(rolling_mean(values[:, i], TREND_WINDOW), TREND_MAX_POINTS)
+        trend[label] = means.tolist()
+    trend['date'] = [timestamps[i][:16].replace('T', ' ') for i in index]
+    
+    recent = values[-TREND_WINDOW:, 0]
+    previous = values[-2 * TREND_WINDOW:-TREND_WINDOW, 0]
+    return {
+        'count': len(rows),
+        'trend': trend,
+        'recent_rms': float(np.mean(recent)),
+        'previous_rms': float(np.mean(previous)) if len(previous) else None,
+        'venues': storage.breakdown(user_email, 'venue', **filters),
+        'mixers': storage.breakdown(user_email, 'mixer', **filters)
+    }
+
+
+def breakdown_table(rows):
+    return {
+        '件数': {r['name']: r['count'] for r in rows},
+        'RMS': {r['name']: round(r['rms_db'], 1) if r['rms_db'] is not None else None for r in rows},
+        'Peak': {r['name']: round(r['peak_db'], 1) if r['peak_db'] is not None else None for r in rows},
+        'Crest': {r['name']: round(r['crest_factor'], 1) if r['crest_factor'] is not None else None for r in rows},
+        'Stereo': {r['name']: round(r['stereo_width'], 1) if r['stereo_width'] is not None else None for r in rows},
+        '最終': {r['name']: r['last'][:10] for r in rows}
+    }
 
 
 def show_history_page(user):
     st.markdown("## 📊 解析履歴")
     
     storage = SimpleStorage()
-    analyses = storage.load(user['email'])
+    version = storage.version(user['email'])
     
-    if not analyses:
+    if not version[0]:
         st.info("まだ解析データがありません")
         return
     
-    st.write(f"**総解析数: {len(analyses)}件**")
+    st.write(f"**総解析数: {version[0]}件**")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        venue = st.selectbox("会場", ["すべて"] + storage.distinct(user['email'], 'venue'))
+    with col2:
+        mixer = st.selectbox("ミキサー", ["すべて"] + storage.distinct(user['email'], 'mixer'))
+    
+    filters = {
+        'venue': None if venue == "すべて" else venue,
+        'mixer': None if mixer == "すべて" else mixer
+    }
+    dashboard = history_dashboard(user['email'], version, **filters)
+    if dashboard is None:
+        st.info("条件に合う解析がありません")
+        return
+    
+    # 推移（移動平均・間引き済み）
+    st.markdown(f"### 📈 推移（直近{TREND_WINDOW}回の移動平均）")
+    col1, col2 = st.columns(2)
+    with col1:
+        delta = None
+        if dashboard['previous_rms'] is not None:
+            delta = f"{dashboard['recent_rms'] - dashboard['previous_rms']:+.1f} dB"
+        st.metric(f"直近{TREND_WINDOW}回の平均RMS", f"{dashboard['recent_rms']:.1f} dB", delta)
+    with col2:
+        st.metric("該当件数", f"{dashboard['count']}件")
+    
+    trend = dashboard['trend']
+    st.line_chart(trend, x='date', y=['RMS', 'Peak', 'Crest'])
+    
+    # 会場・ミキサーごとの集計
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("### 🏟️ 会場別")
+        st.dataframe(breakdown_table(dashboard['venues']), use_container_width=True)
+    with col2:
+        st.markdown("### 🎛️ ミキサー別")
+        st.dataframe(breakdown_table(dashboard['mixers']), use_container_width=True)
+    
+    # 個別の解析（1ページ分だけ読み込む）
+    st.markdown("### 🗂️ 解析一覧")
+    matched = storage.count(user['email'], **filters)
+    pages = max(1, ceil(matched / HISTORY_PAGE_SIZE))
+    page = st.number_input(f"ページ（全{pages}ページ）", min_value=1, max_value=pages, value=1)
+    
+    analyses = storage.query(
+        user['email'],
+        limit=HISTORY_PAGE_SIZE,
+        offset=(page - 1) * HISTORY_PAGE_SIZE,
+        **filters
+    )
     
+    labels = {}
     for analysis in analyses:
-        name = analysis['metadata']['analysis_name']
-        venue = analysis['metadata']['venue']
         timestamp = datetime.fromisoformat(analysis['timestamp'])
+        label = (f"🎵 {analysis['metadata']['analysis_name']} - {analysis['metadata']['venue']} "
+                 f"({timestamp.strftime('%Y/%m/%d %H:%M')})")
+        labels[label] = analysis
+    
+    st.dataframe(
+        {
+            '解析名': [a['metadata']['analysis_name'] for a in analyses],
+            '会場': [a['metadata']['venue'] for a in analyses],
+            'ミキサー': [a['metadata']['mixer'] for a in analyses],
+            '日時': [a['timestamp'][:16].replace('T', ' ') for a in analyses],
+            'RMS': [round(a['result']['rms_db'], 1) for a in analyses],
+            'Peak': [round(a['result']['peak_db'], 1) for a in analyses],
+            'Crest': [round(a['result']['crest_factor'], 1) for a in analyses],
+            'Stereo': [round(a['result']['stereo_width'], 1) for a in analyses]
+        },
+        use_container_width=True,
+        hide_index=True
+    )
+    
+    selected = st.selectbox("詳細を表示", ["（選択してください）"] + list(labels))
+    if selected in labels:
+        result = labels[selected]['result']
         
-        with st.expander(f"🎵 {name} - {venue} ({timestamp.strftime('%Y/%m/%d %H:%M')})"):
-            result = analysis['result']
-            
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                st.metric("RMS", f"{result['rms_db']:.1f} dB")
-            with col2:
-                st.metric("Peak", f"{result['peak_db']:.1f} dB")
-            with col3:
-                st.metric("Crest", f"{result['crest_factor']:.1f} dB")
-            with col4:
-                st.metric("Stereo", f"{result['stereo_width']:.1f}%")
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("RMS", f"{result['rms_db']:.1f} dB")
+        with col2:
+            st.metric("Peak", f"{result['peak_db']:.1f} dB")
+        with col3:
+            st.metric("Crest", f"{result['crest_factor']:.1f} dB")
+        with col4:
+            st.metric("Stereo", f"{result['stereo_width']:.1f}%")
+        
+        fig = band_chart(result)
+        show_figure(fig)
+        
+        if result.get('stems'):
+            show_stems(result['stems'], result.get('masking'))
 
 
 def main():
+    setup_page()
     init_session()
     
-    if not st.session_state.authenticated:
+    # 再実行のたびにトークンの署名と期限だけを確認する
+    user = get_auth().verify_token(st.session_state.token)
+    if user is None:
+        st.session_state.user = None
         show_login()
     else:
+        st.session_state.user = user
         show_analyzer()
 
 
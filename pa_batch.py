@@ -0,0 +1,191 @@
+"""
+PA Audio Analyzer V4.0 - バッチ解析
+ディレクトリ内の録音をまとめて解析し、JSONL / CSV / Parquet に書き出す（Streamlit不要）
+
+使い方:
+    python pa_batch.py /archive/shows -o results.jsonl
+    python pa_batch.py /archive/shows -o results.csv --workers 4 --recursive
+    python pa_batch.py /archive/shows -o results.parquet   # pyarrow が必要
+
+途中で止めても、同じコマンドを再実行すれば解析済みのファイルは飛ばして続きから再開します。
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+AUDIO_EXTENSIONS = ('.wav', '.flac', '.aif', '.aiff', '.ogg', '.mp3')
+FORMATS = ('jsonl', 'csv', 'parquet')
+
+
+def analyze_file(path, options):
+    # ワーカープロセス側で実行される（結果は1行分のレコード）
+    from pa_core import AudioHandle, SimpleAnalyzer, SimpleStreamAnalyzer
+    from pa_metering import SimpleFeedbackMeter, SimpleLoudnessMeter, SimpleStereoMeter
+
+    stat = os.stat(path)
+    record = {
+        'path': str(path),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'analyzed_at': datetime.now().isoformat()
+    }
+    start = time.perf_counter()
+
+    try:
+        # WAVはメモリマップ、soundfileで読めない形式は一度だけ全体をデコードする
+        with AudioHandle(path) as audio:
+            if options['streaming']:
+                analyzer = SimpleStreamAnalyzer(audio, band_mode=options['band_mode'])
+            else:
+                analyzer = SimpleAnalyzer(audio, band_mode=options['band_mode'])
+
+            analyzer.add_meter('loudness', SimpleLoudnessMeter(analyzer.sr, analyzer.channels))
+            analyzer.add_meter('stereo', SimpleStereoMeter(analyzer.sr, analyzer.channels))
+            analyzer.add_meter('feedback', SimpleFeedbackMeter(analyzer.sr, analyzer.channels))
+            record['result'] = analyzer.analyze()
+            record['stats'] = getattr(analyzer, 'stats', None) or None
+        record['status'] = 'ok'
+    except Exception as e:
+        record['status'] = 'error'
+        record['error'] = f"{type(e).__name__}: {e}"
+
+    record['elapsed_sec'] = time.perf_counter() - start
+    return record
+
+
+def find_files(input_dir, recursive):
+    pattern = '**/*' if recursive else '*'
+    return sorted(
+        p for p in Path(input_dir).glob(pattern)
+        if p.is_file() and p.suffix.lower() in AUDIO_EXTENSIONS
+    )
+
+
+def file_key(path, size, mtime):
+    return (str(path), size, round(mtime, 3))
+
+
+def load_journal(journal_path):
+    # 解析済み（status=ok）のファイルを返す。書き込み途中で切れた最終行は無視する
+    done = {}
+    if not journal_path.exists():
+        return done
+    with open(journal_path, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get('status') == 'ok':
+                done[file_key(record['path'], record['size'], record['mtime'])] = record
+    return done
+
+
+def flatten(record):
+    row = {k: v for k, v in record.items() if k not in ('result', 'stats')}
+    result = record.get('result') or {}
+    for key, value in result.items():
+        if key == 'band_energies':
+            for band, energy in value.items():
+                row[f"band_{band}"] = energy
+        elif isinstance(value, dict):
+            for sub, sub_value in value.items():
+                if not isinstance(sub_value, (dict, list)):
+                    row[f"{key}_{sub}"] = sub_value
+        elif not isinstance(value, list):
+            row[key] = value
+    stats = record.get('stats') or {}
+    for key, value in stats.items():
+        row[f"stats_{key}"] = value
+    return row
+
+
+def export(records, output, fmt):
+    rows = [flatten(r) for r in records]
+    columns = []
+    for row in rows:
+        for key in row:
+            if key not in columns:
+                columns.append(key)
+
+    if fmt == 'csv':
+        with open(output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+    elif fmt == 'parquet':
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet出力には pyarrow が必要です: pip install pyarrow")
+        table = pa.table({c: [row.get(c) for row in rows] for c in columns})
+        pq.write_table(table, output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="録音ディレクトリのバッチ解析")
+    parser.add_argument('input_dir', help="解析する録音のディレクトリ")
+    parser.add_argument('-o', '--output', required=True, help="出力ファイル（.jsonl / .csv / .parquet）")
+    parser.add_argument('--format', choices=FORMATS, help="出力形式（省略時は拡張子から判定）")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="並列プロセス数")
+    parser.add_argument('--recursive', action='store_true', help="サブディレクトリも対象にする")
+    parser.add_argument('--band-mode', choices=('fft', 'reference'), default='fft')
+    parser.add_argument('--no-streaming', dest='streaming', action='store_false',
+                        help="ファイル全体をメモリに読み込んで解析する")
+    args = parser.parse_args(argv)
+
+    output = Path(args.output)
+    fmt = args.format or output.suffix.lstrip('.').lower()
+    if fmt not in FORMATS:
+        parser.error(f"出力形式を判定できません: {output}")
+
+    # 進捗はJSONLに1件ずつ追記し、再実行時はここから再開する
+    journal = output if fmt == 'jsonl' else output.with_name(output.name + '.progress.jsonl')
+    done = load_journal(journal)
+
+    files = find_files(args.input_dir, args.recursive)
+    todo = []
+    for path in files:
+        stat = path.stat()
+        if file_key(path, stat.st_size, stat.st_mtime) not in done:
+            todo.append(path)
+
+    print(f"{len(files)}ファイル中 {len(files) - len(todo)}件は解析済み、{len(todo)}件を解析します")
+    options = {'streaming': args.streaming, 'band_mode': args.band_mode}
+    failed = 0
+
+    with open(journal, 'a') as f, ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(analyze_file, str(path), options): path for path in todo}
+        try:
+            for i, future in enumerate(as_completed(futures), 1):
+                record = future.result()
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                f.flush()
+
+                if record['status'] == 'ok':
+                    done[file_key(record['path'], record['size'], record['mtime'])] = record
+                    print(f"[{i}/{len(todo)}] {record['path']} ({record['elapsed_sec']:.1f}s)")
+                else:
+                    failed += 1
+                    print(f"[{i}/{len(todo)}] {record['path']} 失敗: {record['error']}", file=sys.stderr)
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            print("中断しました。再実行すると続きから再開します", file=sys.stderr)
+            return 130
+
+    if fmt != 'jsonl':
+        export(sorted(done.values(), key=lambda r: r['path']), output, fmt)
+    print(f"完了: {output}（成功 {len(done)}件 / 失敗 {failed}件）")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,433 @@
+"""
+PA Audio Analyzer V4.0 - ベンチマーク
+合成ステレオ信号（1分 / 10分 / 2時間 × 44.1 / 48 / 96kHz）で解析パイプラインの各段階を計測する。
+最初に、新しいプロセスでアプリを読み込んでログイン画面を描画するまでの起動時間も測る。
+--separation を付けると、楽器分離の推論モード（float32 / int8量子化 / compile / 軽いモデル）ごとの
+処理時間・最大メモリ・ステムのSDR（float32 の htdemucs または正解ステムとの比較）だけを測る。
+処理時間は tracemalloc を止めて測る。--memory を付けると、各段階の確保メモリのピークを別の実行で測って併記する。
+decode 段階は SimpleAnalyzer の soundfile によるネイティブレートでのデコード
+（以前の librosa.load によるデコード＋44.1kHzへのリサンプルではない）なので、それ以前の基準JSONとは比べられない
+
+使い方:
+    python pa_bench.py                                # 起動時間 + 1分・10分 × 3レート
+    python pa_bench.py --startup-only                 # 起動時間だけ
+    python pa_bench.py --memory                       # 段階ごとのメモリのピークも測る（2回実行する）
+    python pa_bench.py --full                         # 2時間も含める（数GBのディスクとメモリが必要）
+    python pa_bench.py --save-baseline bench_baseline.json
+    python pa_bench.py --baseline bench_baseline.json # 基準より遅い・結果が違う場合は終了コード1
+    python pa_bench.py --separation clip.wav          # 楽器分離のモード比較（torch / demucs が必要）
+    python pa_bench.py --separation clip.wav --separation-ref stems/   # stems/drums.wav 等の正解と比較
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+from scipy import signal
+
+from pa_core import (
+    DEFAULT_BANDS,
+    DEMUCS_AVAILABLE,
+    SimpleAnalyzer,
+    SimpleStreamAnalyzer,
+    StageTimer,
+    process_peak_rss_mb
+)
+from pa_metering import SimpleLoudnessMeter
+
+DURATIONS = [60, 600]
+FULL_DURATIONS = [60, 600, 7200]
+RATES = [44100, 48000, 96000]
+WRITE_BLOCK = 1 << 20
+
+# 基準との比較: 処理時間は25%かつ100ms以上遅くなったら、指標は0.05dB以上ずれたら退行とみなす
+TIME_TOLERANCE = 0.25
+TIME_SLACK_SEC = 0.1
+WARMUP_SEC = 2
+RESULT_TOLERANCE_DB = 0.05
+
+# 起動時間: 新しいプロセスで何回か測って中央値を取る
+STARTUP_RUNS = 3
+HEAVY_MODULES = ('scipy.signal', 'librosa', 'matplotlib.pyplot', 'pandas', 'torch', 'demucs')
+APP_DIR = Path(__file__).resolve().parent
+
+# アプリの import と、AppTest でログイン画面を1回描画するまでの時間を別々に測る
+STARTUP_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, {app_dir!r})
+start = time.perf_counter()
+import pa_analyzer_v4_simple
+import_sec = time.perf_counter() - start
+heavy = [m for m in {heavy!r} if m in sys.modules]
+
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({app_path!r}, default_timeout=120)
+start = time.perf_counter()
+at.run()
+render_sec = time.perf_counter() - start
+print(json.dumps({{'import_sec': import_sec, 'login_render_sec': render_sec, 'heavy_modules': heavy}}))
+"""
+
+# 楽器分離: (モデル, モード, compile) の組み合わせ。先頭を基準（SDR の比較相手）にする
+SEPARATION_CONFIGS = [
+    ('htdemucs', 'float32', False),
+    ('htdemucs', 'int8', False),
+    ('htdemucs', 'float32', True),
+    ('htdemucs', 'int8', True),
+    ('hdemucs_mmi', 'float32', False),
+    ('hdemucs_mmi', 'int8', False)
+]
+
+# 最大メモリをモードごとに測れるよう、1つの組み合わせを新しいプロセスで実行する
+SEPARATION_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, {app_dir!r})
+from pa_core import AudioHandle, SimpleSeparator, process_peak_rss_mb, separator_model_stats
+separator = SimpleSeparator({model!r}, {mode!r}, {compiled!r})
+start = time.perf_counter()
+if not separator.load():
+    print(json.dumps({{'error': separator.error or 'torch / demucs が未インストール'}}))
+    sys.exit(0)
+load_sec = time.perf_counter() - start
+with AudioHandle({clip!r}) as audio:
+    duration = audio.duration
+    start = time.perf_counter()
+    paths, error = separator.separate_to_files(audio, {out_dir!r})
+    separate_sec = time.perf_counter() - start
+stats = separator_model_stats()[separator.model_id]
+print(json.dumps({{
+    'error': error, 'paths': paths, 'load_sec': load_sec, 'separate_sec': separate_sec,
+    'realtime_x': duration / separate_sec, 'peak_rss_mb': process_peak_rss_mb(),
+    'model_mb': stats['param_mb'], 'compiled': stats['compiled'], 'compile_error': stats['compile_error']
+}}))
+"""
+
+
+def synth_stereo(path, seconds, sr, seed=0):
+    # 高域を落とした雑音 + キック風の低音 + ボーカル帯の正弦波を少しずつ書き出す
+    rng = np.random.default_rng(seed)
+    total = int(seconds * sr)
+    zi = np.zeros((1, 2))
+    with sf.SoundFile(path, 'w', samplerate=sr, channels=2, subtype='PCM_16') as f:
+        for start in range(0, total, WRITE_BLOCK):
+            n = min(WRITE_BLOCK, total - start)
+            t = (start + np.arange(n)) / sr
+            # 1次ローパス（状態はブロック間で引き継ぐ）
+            noise, zi = signal.lfilter([0.1], [1.0, -0.9], rng.standard_normal((n, 2)) * 0.05, axis=0, zi=zi)
+            kick = 0.3 * np.sin(2 * np.pi * 55 * t) * (np.mod(t, 0.5) < 0.1)
+            voice = 0.1 * np.sin(2 * np.pi * 440 * t + 0.3 * np.sin(2 * np.pi * 5 * t))
+            block = noise + np.stack([kick + voice, kick + 0.8 * voice], axis=1)
+            f.write(np.clip(block, -1, 1).astype(np.float32))
+
+
+def render_chart(result):
+    # アプリと同じ棒グラフをPNGに描画する（Streamlitなしで計測するため）
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from pa_analyzer_v4_simple import band_chart
+
+    fig = band_chart(result)
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    plt.close(fig)
+    return buf.getbuffer().nbytes
+
+
+def run_case(path, seconds, sr, workdir, track_memory=False):
+    # track_memory=True のときは tracemalloc の分だけ遅くなるので、処理時間とは別の実行で使う
+    from pa_analyzer_v4_simple import SimpleAI, SimpleStorage
+
+    timer = StageTimer(track_memory=track_memory)
+
+    # SimpleAnalyzer の初期化はファイル全体のデコード（ネイティブレートのまま）
+    with timer.stage('decode'):
+        analyzer = SimpleAnalyzer(path)
+    with timer.stage('analyze'):
+        result = analyzer.analyze()
+
+    mono = np.mean(analyzer.y, axis=0)
+    for name, (low, high) in DEFAULT_BANDS.items():
+        with timer.stage(f'bandpass:{name}'):
+            analyzer.bandpass(mono, low, high)
+    del mono
+
+    with timer.stage('loudness'):
+        meter = SimpleLoudnessMeter(analyzer.sr, analyzer.channels)
+        for start in range(0, analyzer.y.shape[1], 65536):
+            meter.update(analyzer.y[:, start:start + 65536])
+        meter.summary()
+    del analyzer
+
+    with timer.stage('stream_analyze'):
+        stream_result = SimpleStreamAnalyzer(path, track_memory=track_memory).analyze()
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        metadata = {'analysis_name': 'bench', 'venue': 'bench', 'mixer': 'bench'}
+        ai = SimpleAI()
+        with timer.stage('ai_learn'):
+            ai.learn('bench@pa.local', result, metadata)
+        storage = SimpleStorage()
+        with timer.stage('storage_save'):
+            storage.save('bench@pa.local', result, metadata)
+    finally:
+        os.chdir(cwd)
+
+    with timer.stage('render'):
+        render_chart(result)
+
+    return {
+        'seconds': seconds,
+        'samplerate': sr,
+        'stages': timer.stages,
+        'total_sec': timer.total(),
+        'max_rss_mb': process_peak_rss_mb(),
+        'result': {
+            'rms_db': result['rms_db'],
+            'peak_db': result['peak_db'],
+            'stereo_width': result['stereo_width'],
+            'band_energies': result['band_energies']
+        },
+        'stream_result': {
+            'rms_db': stream_result['rms_db'],
+            'band_energies': stream_result['band_energies']
+        }
+    }
+
+
+def measure_startup(workdir, runs=STARTUP_RUNS):
+    # users.json などはアプリの作業ディレクトリに作られるので、一時ディレクトリで起動する
+    script = STARTUP_SCRIPT.format(
+        app_dir=str(APP_DIR),
+        app_path=str(APP_DIR / 'pa_analyzer_v4_simple.py'),
+        heavy=HEAVY_MODULES
+    )
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, '-c', script], cwd=workdir, capture_output=True, text=True, check=True
+        )
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {
+        'import_sec': float(np.median([s['import_sec'] for s in samples])),
+        'login_render_sec': float(np.median([s['login_render_sec'] for s in samples])),
+        'heavy_modules': samples[-1]['heavy_modules']
+    }
+
+
+def print_startup(startup):
+    print(f"== 起動時間: import {startup['import_sec']:.2f}s / ログイン画面 {startup['login_render_sec']:.2f}s")
+    print(f"  ログイン前に読み込まれた重いモジュール: {', '.join(startup['heavy_modules']) or 'なし'}")
+
+
+def stem_sdr(reference_path, estimate_path):
+    # SDR = 10*log10(Σref² / Σ(ref - est)²)。モデルごとの出力長の差は短い方にそろえる
+    ref, _ = sf.read(reference_path, dtype='float32', always_2d=True)
+    est, _ = sf.read(estimate_path, dtype='float32', always_2d=True)
+    n = min(len(ref), len(est))
+    ref, est = ref[:n, :est.shape[1]], est[:n, :ref.shape[1]]
+    error = np.sum((ref.astype(np.float64) - est) ** 2)
+    return float(10 * np.log10(np.sum(ref.astype(np.float64) ** 2) / (error + 1e-20) + 1e-20))
+
+
+def measure_separation(clip, workdir, configs=SEPARATION_CONFIGS, reference_dir=None):
+    # 正解ステム（reference_dir/drums.wav 等）が無ければ先頭の組み合わせの出力を基準にする
+    runs = []
+    for model, mode, compiled in configs:
+        out_dir = Path(workdir) / f"{model}_{mode}{'_compile' if compiled else ''}"
+        script = SEPARATION_SCRIPT.format(
+            app_dir=str(APP_DIR), model=model, mode=mode, compiled=compiled,
+            clip=str(Path(clip).resolve()), out_dir=str(out_dir)
+        )
+        out = subprocess.run([sys.executable, '-c', script], cwd=workdir, capture_output=True, text=True)
+        lines = out.stdout.strip().splitlines()
+        run = json.loads(lines[-1]) if out.returncode == 0 and lines else {'error': out.stderr.strip()[-300:]}
+        runs.append(dict(run, model=model, mode=mode, compile=compiled))
+
+    baseline = runs[0]
+    for run in runs:
+        if run.get('error'):
+            continue
+        if not baseline.get('error'):
+            run['speedup'] = baseline['separate_sec'] / run['separate_sec']
+        if reference_dir:
+            references = {name: Path(reference_dir) / f"{name}.wav" for name in run['paths']}
+        elif run is baseline or baseline.get('error'):
+            continue
+        else:
+            references = baseline['paths']
+        run['sdr_db'] = {
+            name: stem_sdr(references[name], path)
+            for name, path in run['paths'].items()
+            if name in references and Path(references[name]).exists()
+        }
+    return {'clip': str(clip), 'reference': str(reference_dir) if reference_dir else 'float32', 'runs': runs}
+
+
+def print_separation(report):
+    print(f"== 楽器分離（{report['clip']} / SDR の基準: {report['reference']}）")
+    for run in report['runs']:
+        name = f"{run['model']} {run['mode']}{' +compile' if run['compile'] else ''}"
+        if run.get('error'):
+            print(f"  {name:<28} ❌ {run['error']}")
+            continue
+        sdr = run.get('sdr_db') or {}
+        sdr_text = ' '.join(f"{stem} {value:5.1f}" for stem, value in sdr.items()) if sdr else '（基準）'
+        print(f"  {name:<28} {run['separate_sec']:7.1f}s（実時間の{run['realtime_x']:.2f}倍・"
+              f"{run.get('speedup', 1):.2f}x） ロード {run['load_sec']:5.1f}s  "
+              f"最大RSS {run['peak_rss_mb'] or 0:6.0f} MB  モデル {run['model_mb']:5.0f} MB  SDR {sdr_text}")
+        if run.get('compile_error'):
+            print(f"  {'':<28} compile なしで実行: {run['compile_error'][:100]}")
+
+
+def case_name(case):
+    return f"{case['seconds']}s@{case['samplerate']}"
+
+
+def compare(cases, baseline, startup=None):
+    # 基準と比べて遅くなった段階・値が変わった指標を列挙する
+    problems = []
+    base_startup = baseline.get('startup')
+    if startup and base_startup:
+        for key in ('import_sec', 'login_render_sec'):
+            before, after = base_startup[key], startup[key]
+            if after > before * (1 + TIME_TOLERANCE) and after - before > TIME_SLACK_SEC:
+                problems.append(f"startup {key}: {before:.3f}s → {after:.3f}s")
+    base_cases = {case_name(c): c for c in baseline['cases']}
+    for case in cases:
+        base = base_cases.get(case_name(case))
+        if base is None:
+            continue
+        base_stages = {s['stage']: s['sec'] for s in base['stages']}
+        for stage in case['stages']:
+            before = base_stages.get(stage['stage'])
+            if before is None:
+                continue
+            if stage['sec'] > before * (1 + TIME_TOLERANCE) and stage['sec'] - before > TIME_SLACK_SEC:
+                problems.append(f"{case_name(case)} {stage['stage']}: {before:.3f}s → {stage['sec']:.3f}s")
+
+        for key in ('rms_db', 'peak_db', 'stereo_width'):
+            if abs(case['result'][key] - base['result'][key]) > RESULT_TOLERANCE_DB:
+                problems.append(f"{case_name(case)} {key}: {base['result'][key]:.3f} → {case['result'][key]:.3f}")
+        for band, value in case['result']['band_energies'].items():
+            before = base['result']['band_energies'].get(band)
+            if before is not None and abs(value - before) > RESULT_TOLERANCE_DB:
+                problems.append(f"{case_name(case)} {band}: {before:.3f} → {value:.3f}")
+    return problems
+
+
+def add_peak_memory(case, memory_case):
+    # メモリ計測の実行で得た段階ごとのピークを、処理時間の実行の結果に写す
+    peaks = {s['stage']: s['peak_mb'] for s in memory_case['stages']}
+    for stage in case['stages']:
+        stage['peak_mb'] = peaks.get(stage['stage'])
+
+
+def print_case(case):
+    print(f"\n== {case['seconds']}秒 @ {case['samplerate']} Hz "
+          f"（合計 {case['total_sec']:.2f}秒 / 最大RSS {case['max_rss_mb'] or 0:.0f} MB）")
+    for stage in case['stages']:
+        line = f"  {stage['stage']:<22} {stage['sec']:8.3f}s"
+        if stage.get('peak_mb') is not None:
+            line += f"  {stage['peak_mb']:8.1f} MB"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="解析パイプラインのベンチマーク")
+    parser.add_argument('--durations', type=int, nargs='+', help="信号長（秒）")
+    parser.add_argument('--rates', type=int, nargs='+', default=RATES, help="サンプルレート")
+    parser.add_argument('--full', action='store_true', help="2時間の信号も含める")
+    parser.add_argument('--output', help="結果をJSONで保存")
+    parser.add_argument('--baseline', help="比較する基準JSON")
+    parser.add_argument('--save-baseline', help="今回の結果を基準JSONとして保存")
+    parser.add_argument('--startup-only', action='store_true', help="起動時間だけを測る")
+    parser.add_argument('--memory', action='store_true', help="段階ごとのメモリのピークを別の実行で測る")
+    parser.add_argument('--separation', metavar='CLIP', help="楽器分離の推論モードを比較する音源")
+    parser.add_argument('--separation-ref', metavar='DIR', help="正解ステム（drums.wav / bass.wav / other.wav / vocals.wav）")
+    args = parser.parse_args(argv)
+
+    if args.separation:
+        if not DEMUCS_AVAILABLE:
+            print("❌ 楽器分離のベンチマークには torch と demucs が必要です", file=sys.stderr)
+            return 1
+        with tempfile.TemporaryDirectory(prefix='pa_bench_sep_') as tmp:
+            separation = measure_separation(args.separation, tmp, reference_dir=args.separation_ref)
+        for run in separation['runs']:
+            run.pop('paths', None)
+        print_separation(separation)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+                           'separation': separation}, f, ensure_ascii=False, indent=2)
+        return 0
+
+    durations = [] if args.startup_only else (args.durations or (FULL_DURATIONS if args.full else DURATIONS))
+    cases = []
+
+    with tempfile.TemporaryDirectory(prefix='pa_bench_') as tmp:
+        tmp = Path(tmp)
+
+        (tmp / 'work_startup').mkdir()
+        startup = measure_startup(tmp / 'work_startup')
+        print_startup(startup)
+
+        # 初回だけ librosa / numba の読み込みとJITが入るので、短い信号で一度空回しする
+        if durations:
+            warmup = tmp / 'warmup.wav'
+            synth_stereo(warmup, WARMUP_SEC, args.rates[0])
+            (tmp / 'work_warmup').mkdir()
+            run_case(str(warmup), WARMUP_SEC, args.rates[0], tmp / 'work_warmup')
+
+        for seconds in durations:
+            for sr in args.rates:
+                path = tmp / f"bench_{seconds}s_{sr}.wav"
+                synth_stereo(path, seconds, sr)
+                workdir = tmp / f"work_{seconds}_{sr}"
+                workdir.mkdir()
+                case = run_case(str(path), seconds, sr, workdir)
+                if args.memory:
+                    memory_dir = tmp / f"memory_{seconds}_{sr}"
+                    memory_dir.mkdir()
+                    add_peak_memory(case, run_case(str(path), seconds, sr, memory_dir, track_memory=True))
+                path.unlink()
+                print_case(case)
+                cases.append(case)
+
+    report = {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'startup': startup,
+        'cases': cases
+    }
+    for target in (args.output, args.save_baseline):
+        if target:
+            with open(target, 'w') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        problems = compare(cases, baseline, startup)
+        if problems:
+            print("\n❌ 基準からの退行:")
+            for problem in problems:
+                print("  " + problem)
+            return 1
+        print("\n✅ 基準と比べて退行なし")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,901 @@
+"""
+PA Audio Analyzer V4.0 - 解析コア
+Streamlitに依存しない音源解析・楽器分離の処理（スクリプトやバッチからも利用可能）
+
+使い方:
+    from pa_core import SimpleAnalyzer, SimpleStreamAnalyzer
+    result = SimpleStreamAnalyzer('show.wav').analyze()
+"""
+
+import numpy as np
+import soundfile as sf
+from scipy import signal
+from numpy.lib.stride_tricks import sliding_window_view
+from pathlib import Path
+from datetime import datetime
+import io
+import os
+import struct
+import sys
+import time
+import tracemalloc
+import threading
+import warnings
+from math import gcd, ceil
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from importlib.util import find_spec
+
+# 楽器分離（オプション）。torch / demucs の読み込みは数秒かかるので、
+# ここではインストールの有無だけを調べ、実際の import はモデルをロードするときに行う
+DEMUCS_AVAILABLE = find_spec('torch') is not None and find_spec('demucs') is not None
+
+
+# =====================================
+# 処理時間の計測
+# =====================================
+
+class StageTimer:
+    # 処理段階ごとの経過時間（と任意でPython/NumPyの確保メモリのピーク）を記録する
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory
+        self.stages = []
+    
+    @contextmanager
+    def stage(self, name):
+        tracing = tracemalloc.is_tracing()
+        if self.track_memory:
+            if not tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = {'stage': name, 'sec': time.perf_counter() - start}
+            if self.track_memory:
+                record['peak_mb'] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+                if not tracing:
+                    tracemalloc.stop()
+            self.stages.append(record)
+    
+    def total(self):
+        return sum(s['sec'] for s in self.stages)
+    
+    def as_dict(self):
+        return {s['stage']: s['sec'] for s in self.stages}
+
+
+# =====================================
+# 周波数バンド解析エンジン
+# =====================================
+
+# デフォルトの7バンド構成（任意のレイアウトを渡すことも可能）
+DEFAULT_BANDS = {
+    'sub_bass': (20, 60),
+    'bass': (60, 250),
+    'low_mid': (250, 500),
+    'mid': (500, 2000),
+    'high_mid': (2000, 4000),
+    'presence': (4000, 8000),
+    'brilliance': (8000, 20000)
+}
+
+BAND_MODES = ('fft', 'reference')
+BAND_FFT_SIZE = 8192
+BAND_FFT_RATE = 44100
+
+
+def design_bandpass(sr, low, high, order=4):
+    # 下限は 1e-5（96kHzでも20Hz付近のバンドがずれないように）
+    nyq = sr / 2
+    low_n = np.clip(low / nyq, 1e-5, 0.999)
+    high_n = np.clip(high / nyq, 1e-5, 0.999)
+    
+    if low_n >= high_n:
+        return None
+    
+    try:
+        return signal.butter(order, [low_n, high_n], btype='band', output='sos')
+    except ValueError:
+        return None
+
+
+def power_to_db(power):
+    return 20 * np.log10(np.sqrt(power) + 1e-10)
+
+
+class SimpleBandEngine:
+    # mode='fft': チャンク単位のWelch平均パワースペクトルから全バンドを1パスで算出
+    #             （各バンドの重みはButterworth特性 |H(f)|^2 なので reference とほぼ一致）
+    # mode='reference': バンドごとに時間領域でSOSフィルタをかける従来方式（検証用）
+    def __init__(self, sr, bands=None, mode='fft', n_fft=None, chunk_frames=256):
+        if mode not in BAND_MODES:
+            raise ValueError(f"unknown band mode: {mode}")
+        if n_fft is None:
+            # 周波数分解能をサンプルレートによらずほぼ一定（44.1kHzで8192点）に保つ
+            n_fft = 2 ** int(round(np.log2(BAND_FFT_SIZE * sr / BAND_FFT_RATE)))
+        
+        self.sr = sr
+        self.bands = dict(bands or DEFAULT_BANDS)
+        self.names = list(self.bands)
+        self.mode = mode
+        self.n_fft = n_fft
+        self.hop = n_fft // 2
+        self.chunk_frames = chunk_frames
+        self.sos = [design_bandpass(sr, low, high) for low, high in self.bands.values()]
+        
+        if mode == 'fft':
+            self.window = signal.get_window('hann', n_fft).astype(np.float32)
+            self.window_energy = float(np.sum(self.window ** 2))
+            self.freqs = np.fft.rfftfreq(n_fft, 1 / sr)
+            self.weights = self._band_weights()
+        
+        self.reset()
+    
+    def _band_weights(self):
+        # (n_bands, n_bins) の重み行列。片側スペクトルの2倍補正と1/Nもここに含める
+        scale = np.full(len(self.freqs), 2.0)
+        scale[0] = 1.0
+        scale[-1] = 1.0
+        scale /= self.n_fft
+        
+        weights = np.zeros((len(self.names), len(self.freqs)))
+        for i, sos in enumerate(self.sos):
+            if sos is None:
+                continue
+            _, h = signal.sosfreqz(sos, worN=self.freqs, fs=self.sr)
+            weights[i] = np.abs(h) ** 2
+        return weights * scale
+    
+    def reset(self):
+        self._tail = None
+        self._power = None
+        self._win_energy = 0.0
+        self._zi = [None] * len(self.names)
+        self._sq = None
+        self._count = 0
+    
+    def update(self, x, return_frames=False):
+        # x: (..., n) のブロック。先頭の次元（ステム・チャンネル等）はまとめて処理する
+        x = np.asarray(x, dtype=np.float32)
+        if self.mode == 'fft':
+            return self._update_fft(x, return_frames)
+        return self._update_reference(x)
+    
+    def _update_fft(self, x, return_frames):
+        if self._tail is not None and self._tail.shape[-1]:
+            buf = np.concatenate([self._tail, x], axis=-1)
+        else:
+            buf = x
+        
+        n = buf.shape[-1]
+        n_frames = 0 if n < self.n_fft else (n - self.n_fft) // self.hop + 1
+        if self._power is None:
+            self._power = np.zeros(buf.shape[:-1] + (len(self.freqs),))
+        
+        frame_powers = []
+        if n_frames:
+            frames = sliding_window_view(buf, self.n_fft, axis=-1)[..., ::self.hop, :][..., :n_frames, :]
+            for start in range(0, n_frames, self.chunk_frames):
+                spec = np.fft.rfft(frames[..., start:start + self.chunk_frames, :] * self.window, axis=-1)
+                p = spec.real ** 2 + spec.imag ** 2
+                self._power += p.sum(axis=-2)
+                if return_frames:
+                    frame_powers.append((p @ self.weights.T / self.window_energy).astype(np.float32))
+            self._win_energy += n_frames * self.window_energy
+        
+        self._tail = buf[..., n_frames * self.hop:].copy()
+        
+        if return_frames:
+            if frame_powers:
+                return np.concatenate(frame_powers, axis=-2)
+            return np.zeros(buf.shape[:-1] + (0, len(self.names)), dtype=np.float32)
+        return None
+    
+    def _update_reference(self, x):
+        if self._sq is None:
+            self._sq = np.zeros(x.shape[:-1] + (len(self.names),))
+        
+        for i, sos in enumerate(self.sos):
+            if sos is None:
+                continue
+            if self._zi[i] is None:
+                self._zi[i] = np.zeros((sos.shape[0],) + x.shape[:-1] + (2,))
+            filtered, self._zi[i] = signal.sosfilt(sos, x, axis=-1, zi=self._zi[i])
+            self._sq[..., i] += np.sum(filtered ** 2, axis=-1)
+        self._count += x.shape[-1]
+        return None
+    
+    def spectrum(self):
+        # 平均パワースペクトル（片側・未重み付け）。末尾の端数フレームもゼロ詰めで含める
+        if self.mode != 'fft' or self._power is None:
+            return None
+        
+        power = self._power.copy()
+        win_energy = self._win_energy
+        k = self._tail.shape[-1] if self._tail is not None else 0
+        if k:
+            frame = np.zeros(self._tail.shape[:-1] + (self.n_fft,), dtype=np.float32)
+            frame[..., :k] = self._tail
+            spec = np.fft.rfft(frame * self.window, axis=-1)
+            power += spec.real ** 2 + spec.imag ** 2
+            win_energy += float(np.sum(self.window[:k] ** 2))
+        
+        if win_energy <= 0:
+            return np.zeros_like(power)
+        return power / win_energy
+    
+    def band_power(self):
+        # 各バンドの平均二乗値 (..., n_bands)
+        if self.mode == 'fft':
+            spectrum = self.spectrum()
+            if spectrum is None:
+                return np.zeros(len(self.names))
+            return spectrum @ self.weights.T
+        
+        if self._sq is None or self._count == 0:
+            return np.zeros(len(self.names))
+        return self._sq / self._count
+    
+    def band_db(self):
+        return power_to_db(self.band_power())
+    
+    def band_energies(self):
+        db = self.band_db()
+        if db.ndim == 1:
+            return {name: float(v) for name, v in zip(self.names, db)}
+        return {name: db[..., i] for i, name in enumerate(self.names)}
+
+
+# =====================================
+# 音声の読み込み・リサンプル
+# =====================================
+
+# 解析はネイティブのサンプルレートのまま行い、リサンプルは楽器分離などモデル側の
+# レートが必要な処理だけが行う。リサンプル済みの音声はメモリ上に上限付きで保持する
+RESAMPLE_CACHE_MB = int(os.environ.get('PA_RESAMPLE_CACHE_MB', '512'))
+
+_RESAMPLE_CACHE = OrderedDict()
+_RESAMPLE_LOCK = threading.Lock()
+
+
+def decode_audio(audio_path):
+    # (channels, n) の float32 とネイティブのサンプルレートを返す。
+    # WAV/FLAC/AIFF/OGG は soundfile で直接デコードし、読めない形式（MP3等）だけ librosa を使う
+    try:
+        y, sr = sf.read(audio_path, dtype='float32', always_2d=True)
+        return y.T, sr
+    except RuntimeError:
+        pass
+    
+    import librosa
+    y, sr = librosa.load(audio_path, sr=None, mono=False)
+    if y.ndim == 1:
+        y = y[None]
+    return y, sr
+
+
+# メモリマップできるWAVのサンプル形式（dtype と float32 への換算係数）
+MAPPABLE_SUBTYPES = {
+    'PCM_16': ('<i2', 1 / 32768),
+    'PCM_32': ('<i4', 1 / 2147483648),
+    'FLOAT': ('<f4', None),
+    'DOUBLE': ('<f8', None)
+}
+
+
+def wav_data_chunk(audio_path):
+    # RIFF/WAVE の data チャンクの (オフセット, バイト数)。見つからなければ None
+    with open(audio_path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            return None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            size = struct.unpack('<I', chunk[4:])[0]
+            if chunk[:4] == b'data':
+                return f.tell(), size
+            f.seek(size + (size & 1), 1)
+
+
+class AudioHandle:
+    # 1つの音源を解析・楽器分離で共有するためのハンドル。
+    # PCM/浮動小数点のWAVはファイルをメモリマップし、読んだ範囲だけを float32 に変換する。
+    # それ以外の soundfile で読める形式は必要な範囲をその都度デコードし、
+    # soundfile で読めない形式（MP3等）は最初に一度だけ全体をデコードして保持する
+    def __init__(self, audio_path, allow_decode=True):
+        self.path = str(audio_path)
+        self.mode = None
+        self._pcm = None
+        self._scale = None
+        self._file = None
+        self._decoded = None
+        self._lock = threading.Lock()
+        
+        try:
+            info = sf.info(self.path)
+        except RuntimeError:
+            if not allow_decode:
+                raise
+            self._decoded, self.sr = decode_audio(self.path)
+            self.channels, self.frames = self._decoded.shape
+            self.mode = 'decoded'
+            return
+        
+        self.sr = info.samplerate
+        self.channels = info.channels
+        self.frames = info.frames
+        
+        chunk = wav_data_chunk(self.path) if info.format == 'WAV' else None
+        if chunk and info.subtype in MAPPABLE_SUBTYPES:
+            dtype, self._scale = MAPPABLE_SUBTYPES[info.subtype]
+            offset, size = chunk
+            frame_bytes = np.dtype(dtype).itemsize * self.channels
+            self.frames = min(self.frames, size // frame_bytes)
+            self._pcm = np.memmap(self.path, dtype=dtype, mode='r', offset=offset,
+                                  shape=(self.frames, self.channels))
+            self.mode = 'memmap'
+        else:
+            self._file = sf.SoundFile(self.path)
+            self.mode = 'soundfile'
+    
+    @property
+    def duration(self):
+        return self.frames / self.sr
+    
+    def read(self, start=0, frames=None):
+        # (channels, n) の float32。float32 のWAVならコピーなしのビューを返すので書き換えないこと
+        stop = self.frames if frames is None else min(self.frames, start + frames)
+        start = min(start, stop)
+        
+        if self.mode == 'decoded':
+            return self._decoded[:, start:stop]
+        
+        if self.mode == 'memmap':
+            block = self._pcm[start:stop].T
+            if self._scale is not None:
+                return block.astype(np.float32) * np.float32(self._scale)
+            return block.astype(np.float32, copy=False)
+        
+        with self._lock:
+            self._file.seek(start)
+            return self._file.read(stop - start, dtype='float32', always_2d=True).T
+    
+    def blocks(self, block_size):
+        for start in range(0, self.frames, block_size):
+            yield self.read(start, block_size)
+    
+    def array(self):
+        # 全体を (channels, n) の float32 で返す（デコード結果は保持する）
+        if self._decoded is None:
+            self._decoded = self.read()
+        return self._decoded
+    
+    def close(self):
+        # Windowsではメモリマップ中のファイルを削除できないので、使い終わったら閉じる
+        self._pcm = None
+        self._decoded = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+def resample(y, sr_in, sr_out):
+    # 整数比のポリフェーズフィルタ（ファイル全体を一度に変換する）
+    if sr_in == sr_out:
+        return y
+    g = gcd(int(sr_in), int(sr_out))
+    return signal.resample_poly(y, sr_out // g, sr_in // g, axis=-1).astype(np.float32)
+
+
+def load_audio(source, sr=None):
+    # source はファイルパスか AudioHandle。sr=None ならネイティブレートのまま。
+    # sr を指定した場合はリサンプル結果をキャッシュから返すので、戻り値の配列は書き換えないこと
+    if isinstance(source, AudioHandle):
+        path = source.path
+        decode = lambda: (source.array(), source.sr)
+    else:
+        path = source
+        decode = lambda: decode_audio(source)
+    
+    if sr is None or (isinstance(source, AudioHandle) and source.sr == sr):
+        return decode()
+    
+    stat = os.stat(path)
+    key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns, int(sr))
+    with _RESAMPLE_LOCK:
+        if key in _RESAMPLE_CACHE:
+            _RESAMPLE_CACHE.move_to_end(key)
+            return _RESAMPLE_CACHE[key], sr
+    
+    y, sr_in = decode()
+    y = resample(y, sr_in, sr)
+    
+    with _RESAMPLE_LOCK:
+        _RESAMPLE_CACHE[key] = y
+        total = sum(v.nbytes for v in _RESAMPLE_CACHE.values())
+        while len(_RESAMPLE_CACHE) > 1 and total > RESAMPLE_CACHE_MB * 1024 ** 2:
+            _, old = _RESAMPLE_CACHE.popitem(last=False)
+            total -= old.nbytes
+    return y, sr
+
+
+# =====================================
+# 音源解析（シンプル版）
+# =====================================
+
+# 追加の計測エンジン（meter）に渡すブロック長
+METER_BLOCK_SIZE = 65536
+
+
+class SimpleAnalyzer:
+    # audio_path はファイルパスか AudioHandle（楽器分離と同じ読み込みを共有する場合）。
+    # sr=None ならファイルのサンプルレートのまま解析する（レベル・バンドの指標にリサンプルは不要）
+    def __init__(self, audio_path, bands=None, band_mode='fft', sr=None):
+        self.audio_path = audio_path
+        self.bands = bands or DEFAULT_BANDS
+        self.band_mode = band_mode
+        self.meters = {}
+        self.y, self.sr = load_audio(audio_path, sr=sr)
+        if self.y.shape[0] == 1:
+            self.y = np.concatenate([self.y, self.y])
+        self.channels = self.y.shape[0]
+    
+    def add_meter(self, name, meter):
+        # meter は update(block) と summary() を持つオブジェクト。
+        # block は (channels, n) の float32 で、summary() の結果は result[name] に入る
+        self.meters[name] = meter
+    
+    def analyze(self):
+        mono = np.mean(self.y, axis=0)
+        
+        # 基本指標
+        rms = np.sqrt(np.mean(mono ** 2))
+        rms_db = 20 * np.log10(rms + 1e-10)
+        
+        peak = np.max(np.abs(mono))
+        peak_db = 20 * np.log10(peak + 1e-10)
+        
+        crest = peak_db - rms_db
+        
+        # ステレオ幅
+        L, R = self.y[0], self.y[1]
+        mid = (L + R) / 2
+        side = (L - R) / 2
+        mid_e = np.sum(mid ** 2)
+        side_e = np.sum(side ** 2)
+        stereo_width = (side_e / (mid_e + side_e + 1e-10)) * 100
+        
+        # 周波数解析（全バンドを1パスで算出）
+        engine = SimpleBandEngine(self.sr, self.bands, mode=self.band_mode)
+        engine.update(mono)
+        band_energies = engine.band_energies()
+        
+        result = {
+            'rms_db': float(rms_db),
+            'peak_db': float(peak_db),
+            'crest_factor': float(crest),
+            'stereo_width': float(stereo_width),
+            'band_energies': band_energies
+        }
+        
+        if self.meters:
+            for start in range(0, self.y.shape[1], METER_BLOCK_SIZE):
+                block = self.y[:, start:start + METER_BLOCK_SIZE]
+                for meter in self.meters.values():
+                    meter.update(block)
+            for name, meter in self.meters.items():
+                result[name] = meter.summary()
+        
+        return result
+    
+    def bandpass(self, audio, low, high):
+        sos = design_bandpass(self.sr, low, high)
+        if sos is None:
+            return audio * 0
+        return signal.sosfilt(sos, audio)
+
+
+class SimpleStreamAnalyzer:
+    # 長時間ファイル向け: AudioHandle からブロックごとに読み込み、
+    # RMS・ピーク・Mid/Side・バンドの累積値だけを保持する（メモリはファイル長に依存しない）。
+    # パスを渡した場合、soundfile で読めない形式は RuntimeError になる。
+    # AudioHandle の代わりに同じ blocks() を持つ読み込み元（pa_multichannel.SimpleBusMix）も渡せる。
+    # track_memory=False にすると tracemalloc を使わない（処理時間だけを測るとき。peak_memory_mb は None）
+    def __init__(self, audio_path, bands=None, band_mode='fft', block_size=65536, track_memory=True):
+        self.audio_path = audio_path
+        self.bands = bands or DEFAULT_BANDS
+        self.band_mode = band_mode
+        self.block_size = block_size
+        self.track_memory = track_memory
+        self.meters = {}
+        
+        if isinstance(audio_path, (str, os.PathLike)):
+            self.audio = AudioHandle(audio_path, allow_decode=False)
+        else:
+            self.audio = audio_path
+        self.sr = self.audio.sr
+        self.channels = self.audio.channels
+        self.stats = {}
+    
+    def add_meter(self, name, meter):
+        # SimpleAnalyzer.add_meter と同じ（同じブロックを1回の読み込みで共有する）
+        self.meters[name] = meter
+    
+    def analyze(self):
+        tracing = tracemalloc.is_tracing()
+        if self.track_memory:
+            if not tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        peak_mem = None
+        
+        engine = SimpleBandEngine(self.sr, self.bands, mode=self.band_mode)
+        n_samples = 0
+        n_blocks = 0
+        sum_sq = 0.0
+        peak = 0.0
+        mid_e = 0.0
+        side_e = 0.0
+        
+        try:
+            for block in self.audio.blocks(self.block_size):
+                mono = np.mean(block, axis=0)
+                
+                sum_sq += float(np.dot(mono, mono))
+                peak = max(peak, float(np.max(np.abs(mono))))
+                
+                L = block[0]
+                R = block[1] if block.shape[0] > 1 else block[0]
+                mid = (L + R) / 2
+                side = (L - R) / 2
+                mid_e += float(np.dot(mid, mid))
+                side_e += float(np.dot(side, side))
+                
+                engine.update(mono)
+                for meter in self.meters.values():
+                    meter.update(block)
+                n_samples += block.shape[1]
+                n_blocks += 1
+            
+            band_energies = engine.band_energies()
+            if self.track_memory:
+                _, peak_mem = tracemalloc.get_traced_memory()
+        finally:
+            if self.track_memory and not tracing:
+                tracemalloc.stop()
+        
+        rms = np.sqrt(sum_sq / max(n_samples, 1))
+        rms_db = 20 * np.log10(rms + 1e-10)
+        peak_db = 20 * np.log10(peak + 1e-10)
+        stereo_width = (side_e / (mid_e + side_e + 1e-10)) * 100
+        
+        self.stats = {
+            'duration_sec': n_samples / self.sr,
+            'samplerate': self.sr,
+            'channels': self.channels,
+            'blocks': n_blocks,
+            'elapsed_sec': time.perf_counter() - start,
+            'peak_memory_mb': peak_mem / 1024 ** 2 if peak_mem is not None else None
+        }
+        
+        result = {
+            'rms_db': float(rms_db),
+            'peak_db': float(peak_db),
+            'crest_factor': float(peak_db - rms_db),
+            'stereo_width': float(stereo_width),
+            'band_energies': band_energies
+        }
+        for name, meter in self.meters.items():
+            result[name] = meter.summary()
+        return result
+
+
+# =====================================
+# 楽器分離（シンプル版）
+# =====================================
+
+def process_peak_rss_mb():
+    # プロセスの最大常駐メモリ（resourceが無いWindowsではNone）
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss / 1024 ** 2
+    return rss / 1024
+
+
+# チャンク分離の並列数（CPUサーバー向けに環境変数で調整可能）と、1チャンクの長さ・重なり（秒）
+SEPARATION_WORKERS = int(os.environ.get('PA_SEPARATION_WORKERS', '2'))
+SEPARATION_SEGMENT_SEC = 30.0
+SEPARATION_OVERLAP_SEC = 1.0
+
+# CPU向けの推論モード。
+# float32: 従来どおり / int8: Linear・LSTM の重みを int8 にする動的量子化（畳み込みは float32 のまま）。
+# compile: torch.compile でモデルの forward をコンパイルする（失敗したら通常の実行に戻す）。
+# モデルは demucs の名前で指定（htdemucs より軽い単体モデルとして hdemucs_mmi も選べる）
+SEPARATION_MODES = ('float32', 'int8')
+SEPARATION_MODEL = os.environ.get('PA_SEPARATION_MODEL', 'htdemucs')
+SEPARATION_MODE = os.environ.get('PA_SEPARATION_MODE', 'float32')
+if SEPARATION_MODE not in SEPARATION_MODES:
+    # 設定ミスで画面の描画ごとに例外にならないよう、起動時に1回だけ警告して float32 に戻す
+    warnings.warn(f"PA_SEPARATION_MODE={SEPARATION_MODE!r} は未対応のため float32 を使います"
+                  f"（指定できる値: {', '.join(SEPARATION_MODES)}）")
+    SEPARATION_MODE = 'float32'
+SEPARATION_COMPILE = os.environ.get('PA_SEPARATION_COMPILE', '0') == '1'
+
+
+# プロセス全体で共有するモデルのレジストリ（セッション・再実行をまたいで1回だけロード）
+_MODEL_REGISTRY = {}
+_MODEL_STATS = {}
+_MODEL_LOCK = threading.Lock()
+
+
+def separator_model_stats():
+    # ロード済みモデルの計測値（サイドバー表示用）
+    with _MODEL_LOCK:
+        return dict(_MODEL_STATS)
+
+
+def separator_model_id(name='htdemucs', mode='float32', compiled=False):
+    # レジストリ・キャッシュのキー（量子化すると出力が変わるので区別する）
+    model_id = name if mode == 'float32' else f"{name}:{mode}"
+    return model_id + '+compile' if compiled else model_id
+
+
+def load_separator_model(name='htdemucs', mode='float32', compiled=False):
+    model_id = separator_model_id(name, mode, compiled)
+    with _MODEL_LOCK:
+        if model_id not in _MODEL_REGISTRY:
+            _MODEL_REGISTRY[model_id] = _load_model(name, mode, compiled, model_id)
+        return _MODEL_REGISTRY[model_id]
+
+
+def _model_bytes(model):
+    # 量子化した重みは parameters() に出てこないので、state_dict を書き出した大きさで測る
+    import torch
+    
+    buf = io.BytesIO()
+    torch.save(model.state_dict(), buf)
+    return buf.getbuffer().nbytes
+
+
+def _compile_model(model, device):
+    # BagOfModels は中の各モデルの forward だけをコンパイルする（apply_model の型判定を変えないため）。
+    # コンパイルは初回の実行時に行われるので、separate_to_files と同じ長さ（1チャンク分）の無音で
+    # 一度動かして確かめる（apply_model が内部で切り分ける形がそのままコンパイルされる）
+    import torch
+    from demucs.apply import apply_model
+    
+    models = list(model.models) if hasattr(model, 'models') else [model]
+    originals = [m.forward for m in models]
+    try:
+        for m in models:
+            m.forward = torch.compile(m.forward)
+        length = int(SEPARATION_SEGMENT_SEC * model.samplerate)
+        with torch.inference_mode():
+            apply_model(model, torch.zeros(1, model.audio_channels, length, device=device), device=device)
+        return None
+    except Exception as e:
+        for m, forward in zip(models, originals):
+            m.forward = forward
+        return f"{type(e).__name__}: {e}"
+
+
+def _load_model(name, mode, compiled, model_id):
+    import torch
+    from demucs.pretrained import get_model
+    
+    if mode not in SEPARATION_MODES:
+        raise ValueError(f"unknown separation mode: {mode}")
+    
+    rss_before = process_peak_rss_mb()
+    start = time.perf_counter()
+    
+    model = get_model(name)
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    model.to(device)
+    model.eval()
+    
+    # 動的量子化はCPUだけ（GPUでは float32 のまま動かす）
+    if mode == 'int8' and device == 'cpu':
+        torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear, torch.nn.LSTM}, dtype=torch.qint8, inplace=True
+        )
+    load_sec = time.perf_counter() - start
+    
+    compile_error = None
+    if compiled:
+        compile_start = time.perf_counter()
+        compile_error = _compile_model(model, device)
+    
+    rss_after = process_peak_rss_mb()
+    _MODEL_STATS[model_id] = {
+        'device': device,
+        'mode': mode if device == 'cpu' else 'float32',
+        'compiled': compiled and compile_error is None,
+        'compile_error': compile_error,
+        'compile_sec': time.perf_counter() - compile_start if compiled else None,
+        'load_time_sec': load_sec,
+        'param_mb': _model_bytes(model) / 1024 ** 2,
+        'rss_mb': rss_after,
+        'rss_delta_mb': (rss_after - rss_before) if rss_before is not None else None,
+        'loaded_at': datetime.now().isoformat()
+    }
+    return model, device
+
+
+class SimpleSeparator:
+    # モデルは separate() か load() が呼ばれるまでロードしない。
+    # 引数を省略するとモデル・推論モードは環境変数（PA_SEPARATION_MODEL / MODE / COMPILE）に従う
+    def __init__(self, model_name=None, mode=None, compiled=None):
+        mode = mode or SEPARATION_MODE
+        if mode not in SEPARATION_MODES:
+            raise ValueError(f"unknown separation mode: {mode}")
+        self.available = DEMUCS_AVAILABLE
+        self.model_name = model_name or SEPARATION_MODEL
+        self.mode = mode
+        self.compiled = SEPARATION_COMPILE if compiled is None else compiled
+        self.model_id = separator_model_id(self.model_name, self.mode, self.compiled)
+        self.model = None
+        self.device = None
+        self.error = None
+    
+    @property
+    def loaded(self):
+        return self.model is not None
+    
+    def load(self):
+        if not self.available:
+            return False
+        if self.model is None:
+            try:
+                self.model, self.device = load_separator_model(self.model_name, self.mode, self.compiled)
+            except Exception as e:
+                self.available = False
+                self.error = f"モデル読み込みエラー: {str(e)}"
+                return False
+        return True
+    
+    def separate(self, audio_path):
+        if not self.load():
+            return None, self.error or "楽器分離機能が利用できません"
+        
+        import torch
+        from demucs.apply import apply_model
+        
+        try:
+            y, _ = load_audio(audio_path, sr=self.model.samplerate)
+            audio = torch.from_numpy(np.ascontiguousarray(y))
+            if audio.shape[0] == 1:
+                audio = audio.repeat(2, 1)
+            elif audio.shape[0] > 2:
+                audio = audio[:2]
+            
+            audio = audio.to(self.device).unsqueeze(0)
+            
+            with torch.inference_mode():
+                sources = apply_model(self.model, audio, device=self.device)
+            
+            sources = sources.squeeze(0).cpu().numpy()
+            
+            return {
+                'drums': sources[0],
+                'bass': sources[1],
+                'other': sources[2],
+                'vocals': sources[3]
+            }, None
+            
+        except Exception as e:
+            return None, f"分離エラー: {str(e)}"
+    
+    def separate_to_files(self, audio_path, out_dir, segment_sec=SEPARATION_SEGMENT_SEC,
+                          overlap_sec=SEPARATION_OVERLAP_SEC, workers=None, threads_per_worker=None,
+                          progress=None):
+        # 入力を重なりのあるセグメントに分けてワーカーで分離し、
+        # クロスフェードでつなぎながらステムをWAVに逐次書き出す。
+        # audio_path に AudioHandle を渡すと解析と同じ読み込みを共有する
+        if not self.load():
+            return None, self.error or "楽器分離機能が利用できません"
+        
+        import torch
+        from demucs.apply import apply_model
+        
+        owns_audio = not isinstance(audio_path, AudioHandle)
+        audio = None if owns_audio else audio_path
+        try:
+            if audio is None:
+                audio = AudioHandle(audio_path)
+            sr_in = audio.sr
+            sr_out = self.model.samplerate
+            
+            # リサンプル比で割り切れる長さにそろえ、出力側のサンプル位置を整数に保つ
+            g = gcd(sr_in, sr_out)
+            down, up = sr_in // g, sr_out // g
+            overlap = max(1, int(overlap_sec * sr_in) // down) * down
+            seg_len = max(2 * overlap, int(segment_sec * sr_in) // down * down)
+            hop = seg_len - overlap
+            overlap_out = overlap * up // down
+            n_segments = max(1, ceil((audio.frames - overlap) / hop))
+            
+            if workers is None:
+                workers = 1 if self.device == 'cuda' else SEPARATION_WORKERS
+            workers = max(1, workers)
+            if self.device == 'cpu':
+                # set_num_threads はプロセス全体の設定なので、ワーカー数で割った値にする
+                torch.set_num_threads(threads_per_worker or max(1, (os.cpu_count() or 1) // workers))
+            
+            fade_in = ((np.arange(overlap_out) + 0.5) / overlap_out).astype(np.float32)
+            fade_out = 1 - fade_in
+            
+            out_dir = Path(out_dir)
+            out_dir.mkdir(parents=True, exist_ok=True)
+            paths = {name: out_dir / f"{name}.wav" for name in self.model.sources}
+            writers = {
+                name: sf.SoundFile(path, 'w', samplerate=sr_out, channels=2, subtype='FLOAT')
+                for name, path in paths.items()
+            }
+            
+            def run(segment):
+                x = torch.from_numpy(np.ascontiguousarray(resample(segment, sr_in, sr_out)))
+                if x.shape[0] == 1:
+                    x = x.repeat(2, 1)
+                elif x.shape[0] > 2:
+                    x = x[:2]
+                with torch.inference_mode():
+                    sources = apply_model(self.model, x.unsqueeze(0).to(self.device), device=self.device)
+                return sources.squeeze(0).cpu().numpy()
+            
+            def write(block):
+                for name, data in zip(self.model.sources, block):
+                    writers[name].write(data.T)
+            
+            try:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    pending = []
+                    tail = None
+                    next_read = 0
+                    
+                    for i in range(n_segments):
+                        # 先読みはワーカー数の2倍までに抑えてメモリを一定に保つ
+                        while next_read < n_segments and len(pending) < workers * 2:
+                            segment = audio.read(next_read * hop, seg_len)
+                            pending.append(pool.submit(run, segment))
+                            next_read += 1
+                        
+                        block = pending.pop(0).result()
+                        if tail is not None:
+                            block[..., :overlap_out] = block[..., :overlap_out] * fade_in + tail
+                        
+                        if i == n_segments - 1:
+                            write(block)
+                        else:
+                            write(block[..., :-overlap_out])
+                            tail = block[..., -overlap_out:] * fade_out
+                        
+                        if progress:
+                            progress(i + 1, n_segments)
+            finally:
+                for writer in writers.values():
+                    writer.close()
+            
+            return {name: str(path) for name, path in paths.items()}, None
+            
+        except Exception as e:
+            return None, f"分離エラー: {str(e)}"
+        finally:
+            if owns_audio and audio is not None:
+                audio.close()
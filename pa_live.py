@@ -0,0 +1,480 @@
+"""
+PA Audio Analyzer V4.0 - ライブ解析
+本番中の音声をブロック単位で受け取り、RMS・ピーク・クレスト・ステレオ幅・バンドと
+ハウリング・共振（鳴り続けている狭帯域のピーク）を逐次更新する。
+入力は「卓のUSB録音で書き込み中のWAV」か「raw PCM を流すTCP/パイプ」
+
+使い方:
+    from pa_live import GrowingWavSource, SimpleLiveAnalyzer, SimpleLiveSession
+
+    source = GrowingWavSource('/Volumes/USB/REC0001.wav')
+    session = SimpleLiveSession(source)
+    session.start()
+    session.snapshot()        # SimpleAnalyzer.analyze() と同じ指標（累積）+ 直近3秒 + 処理時間
+    session.stop()
+
+コマンドライン（Streamlit不要）:
+    python pa_live.py /Volumes/USB/REC0001.wav                 # 書き込み中のWAVを追いかける
+    python pa_live.py tcp://127.0.0.1:9000 --sr 48000 --channels 2 --format s16le
+    ffmpeg -i show.wav -f s16le - | python pa_live.py - --sr 48000 --channels 2
+"""
+
+import argparse
+import socket
+import struct
+import sys
+import threading
+import time
+from math import ceil
+
+import numpy as np
+from scipy import signal
+
+from pa_core import DEFAULT_BANDS, design_bandpass, power_to_db
+from pa_metering import SimpleFeedbackMeter
+
+# 1ブロック100ms。処理はブロック長の半分以内に収める（超えた回数を数えて表示する）
+LIVE_BLOCK_SEC = 0.1
+LIVE_BUDGET_RATIO = 0.5
+# 「直近」の指標に使う長さと、画面の推移グラフに残す長さ
+LIVE_HISTORY_SEC = 3.0
+LIVE_TIMELINE_SEC = 60.0
+# データが来ていないときの待ち時間
+LIVE_POLL_SEC = 0.02
+
+# raw PCM の形式: (バイト数, dtype, 整数→[-1, 1) の係数)
+PCM_FORMATS = {
+    's16le': (2, '<i2', 1 / 32768),
+    's24le': (3, None, 1 / 8388608),
+    's32le': (4, '<i4', 1 / 2147483648),
+    'f32le': (4, '<f4', None)
+}
+
+
+class PCMDecoder:
+    # 受け取ったバイト列を、あらかじめ確保した (channels, block_size) の float32 に変換する
+    def __init__(self, channels, block_size, sample_format):
+        if sample_format not in PCM_FORMATS:
+            raise ValueError(f"unknown sample format: {sample_format}")
+        self.channels = channels
+        self.block_size = block_size
+        self.width, self.dtype, self.scale = PCM_FORMATS[sample_format]
+        self.frame_bytes = self.width * channels
+        self.raw = bytearray(block_size * self.frame_bytes)
+        self._flat = np.empty(block_size * channels, dtype=np.float32)
+        self._i32 = np.empty(block_size * channels, dtype=np.int32) if self.dtype is None else None
+
+    def decode(self, n_bytes):
+        # raw[:n_bytes]（フレーム境界にそろっていること）を変換し、(channels, n) のビューを返す
+        n = n_bytes // self.frame_bytes
+        count = n * self.channels
+        flat = self._flat[:count]
+        if self.dtype is None:
+            # 24bit: 3バイトを上位に詰めて int32 にし、8bit 右シフトで符号を残す
+            b = np.frombuffer(self.raw, dtype=np.uint8, count=count * 3).reshape(-1, 3)
+            i32 = self._i32[:count]
+            np.left_shift(b[:, 2].astype(np.int32), 24, out=i32)
+            i32 |= b[:, 1].astype(np.int32) << 16
+            i32 |= b[:, 0].astype(np.int32) << 8
+            i32 >>= 8
+            np.multiply(i32, np.float32(self.scale), out=flat, casting='unsafe')
+        else:
+            samples = np.frombuffer(self.raw, dtype=self.dtype, count=count)
+            if self.scale is None:
+                flat[:] = samples
+            else:
+                np.multiply(samples, np.float32(self.scale), out=flat, casting='unsafe')
+        return flat.reshape(n, self.channels).T
+
+
+def wav_format(path):
+    # RIFF/WAVE の fmt と data の位置を読む。
+    # 録音中のWAVは data のサイズが 0 や仮の値のことがあるので、サイズは使わない
+    with open(path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            raise ValueError(f"not a WAV file: {path}")
+        fmt = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                raise ValueError(f"data chunk not found (yet): {path}")
+            size = struct.unpack('<I', chunk[4:])[0]
+            if chunk[:4] == b'fmt ':
+                body = f.read(size + (size & 1))
+                tag, channels, sr = struct.unpack('<HHI', body[:8])
+                bits = struct.unpack('<H', body[14:16])[0]
+                if tag == 0xFFFE:
+                    # WAVE_FORMAT_EXTENSIBLE はサブフォーマットGUIDの先頭2バイトが実際の形式
+                    tag = struct.unpack('<H', body[24:26])[0]
+                fmt = (tag, channels, sr, bits)
+            elif chunk[:4] == b'data':
+                if fmt is None:
+                    raise ValueError(f"fmt chunk not found: {path}")
+                tag, channels, sr, bits = fmt
+                formats = {(1, 16): 's16le', (1, 24): 's24le', (1, 32): 's32le', (3, 32): 'f32le'}
+                if (tag, bits) not in formats:
+                    raise ValueError(f"unsupported WAV format: tag={tag} bits={bits}")
+                return {'sr': sr, 'channels': channels, 'format': formats[(tag, bits)], 'offset': f.tell()}
+            else:
+                f.seek(size + (size & 1), 1)
+
+
+class GrowingWavSource:
+    # 書き込み中のWAVを追いかけて読む（tail -f と同じ）。
+    # from_start=False なら開いた時点の末尾から、True なら先頭から読む。
+    # idle_sec 秒ファイルが伸びなければ終了とみなす（None なら止めるまで待つ）
+    def __init__(self, path, block_sec=LIVE_BLOCK_SEC, from_start=False, idle_sec=None):
+        self.path = str(path)
+        info = wav_format(self.path)
+        self.sr = info['sr']
+        self.channels = info['channels']
+        self.block_size = int(round(self.sr * block_sec))
+        self.decoder = PCMDecoder(self.channels, self.block_size, info['format'])
+        self.idle_sec = idle_sec
+        self.ended = False
+
+        self._file = open(self.path, 'rb')
+        start = info['offset']
+        if not from_start:
+            self._file.seek(0, 2)
+            start += (self._file.tell() - start) // self.decoder.frame_bytes * self.decoder.frame_bytes
+        self._file.seek(start)
+        self._last_data = time.monotonic()
+
+    def read_block(self):
+        # 1ブロック分（足りなければある分だけ）の (channels, n) を返す。データが無ければ None
+        n_bytes = self._file.readinto(self.decoder.raw) or 0
+        extra = n_bytes % self.decoder.frame_bytes
+        if extra:
+            # フレームの途中までしか書かれていない分は次回読み直す
+            self._file.seek(-extra, 1)
+            n_bytes -= extra
+        if n_bytes == 0:
+            if self.idle_sec is not None and time.monotonic() - self._last_data > self.idle_sec:
+                self.ended = True
+            return None
+        self._last_data = time.monotonic()
+        return self.decoder.decode(n_bytes)
+
+    def close(self):
+        self._file.close()
+
+
+class RawPCMSource:
+    # パイプ・ソケットから interleaved の raw PCM を読む（ヘッダなし）。
+    # stream は readinto() を持つバイナリストリーム（sys.stdin.buffer、socket.makefile('rb') など）
+    def __init__(self, stream, sr, channels=2, sample_format='s16le', block_sec=LIVE_BLOCK_SEC):
+        self.stream = stream
+        self.sr = sr
+        self.channels = channels
+        self.block_size = int(round(sr * block_sec))
+        self.decoder = PCMDecoder(channels, self.block_size, sample_format)
+        self.ended = False
+        self._sock = None
+
+    @classmethod
+    def connect(cls, host, port, sr, channels=2, sample_format='s16le', block_sec=LIVE_BLOCK_SEC, timeout=5.0):
+        # TCPで接続して読む（ffmpeg の tcp://...?listen などの送信側に繋ぐ）
+        sock = socket.create_connection((host, port), timeout=timeout)
+        sock.settimeout(None)
+        source = cls(sock.makefile('rb'), sr, channels, sample_format, block_sec)
+        source._sock = sock
+        return source
+
+    def read_block(self):
+        # 1ブロックそろうまで待つ（終端では残りのフレームだけ返す）
+        raw = memoryview(self.decoder.raw)
+        got = 0
+        while got < len(raw):
+            n = self.stream.readinto(raw[got:])
+            if not n:
+                self.ended = True
+                break
+            got += n
+        n_bytes = got - got % self.decoder.frame_bytes
+        if n_bytes == 0:
+            return None
+        return self.decoder.decode(n_bytes)
+
+    def close(self):
+        # 別スレッドで recv 中でも戻るよう、ソケットは shutdown してから閉じる
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sock.close()
+        self.stream.close()
+
+
+class SimpleLiveAnalyzer:
+    # ブロックごとに update() を呼ぶと、累積の指標と直近 history_sec 秒の指標を更新する。
+    # バンドは状態付きSOS（sosfilt の zi）で時間領域のままフィルタするので、ブロック境界で途切れない。
+    # 作業用の配列・直近の値のリングバッファは最初に確保し、update() 中は新たに確保しない
+    def __init__(self, sr, channels=2, bands=None, block_size=None,
+                 history_sec=LIVE_HISTORY_SEC, timeline_sec=LIVE_TIMELINE_SEC, budget_ms=None):
+        self.sr = sr
+        self.channels = channels
+        self.bands = dict(bands or DEFAULT_BANDS)
+        self.band_names = list(self.bands)
+        self.block_size = block_size or int(round(sr * LIVE_BLOCK_SEC))
+        self.budget_ms = budget_ms or self.block_size / sr * 1000 * LIVE_BUDGET_RATIO
+        self.sos = [design_bandpass(sr, low, high) for low, high in self.bands.values()]
+        # ハウリング検出はファイル解析と同じ計測器にモノラルのブロックを流す
+        self.feedback = SimpleFeedbackMeter(sr, channels)
+
+        n = self.block_size
+        self._mono = np.empty(n, dtype=np.float32)
+        self._mid = np.empty(n, dtype=np.float32)
+        self._side = np.empty(n, dtype=np.float32)
+
+        # 直近の指標用（ブロック単位のリングバッファ）
+        self.history_blocks = max(1, ceil(history_sec * sr / n))
+        self.timeline_blocks = max(1, ceil(timeline_sec * sr / n))
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        n_bands = len(self.band_names)
+        self._zi = [None if sos is None else np.zeros((sos.shape[0], 2)) for sos in self.sos]
+        self._band_block = np.zeros(n_bands)
+
+        self._ring_n = np.zeros(self.history_blocks)
+        self._ring_sq = np.zeros(self.history_blocks)
+        self._ring_peak = np.zeros(self.history_blocks)
+        self._ring_mid = np.zeros(self.history_blocks)
+        self._ring_side = np.zeros(self.history_blocks)
+        self._ring_band = np.zeros((self.history_blocks, n_bands))
+        self._timeline = np.full(self.timeline_blocks, np.nan, dtype=np.float32)
+        self._latency = np.zeros(self.timeline_blocks)
+
+        self.blocks = 0
+        self.n_samples = 0
+        self.over_budget = 0
+        self._sum_sq = 0.0
+        self._peak = 0.0
+        self._mid_e = 0.0
+        self._side_e = 0.0
+        self._band_sq = np.zeros(n_bands)
+        self.feedback.reset()
+
+    def update(self, block):
+        start = time.perf_counter()
+        n = block.shape[-1]
+        if n > self.block_size:
+            # 大きいブロックは分けて処理する（バッファを固定長に保つ）
+            for s in range(0, n, self.block_size):
+                self.update(block[..., s:s + self.block_size])
+            return
+
+        mono = self._mono[:n]
+        mid = self._mid[:n]
+        side = self._side[:n]
+        L = block[0]
+        R = block[1] if block.shape[0] > 1 else block[0]
+
+        # モノラル = 全チャンネルの平均（SimpleAnalyzer と同じ）
+        np.copyto(mono, L)
+        for c in range(1, block.shape[0]):
+            np.add(mono, block[c], out=mono)
+        mono *= np.float32(1 / block.shape[0])
+        np.add(L, R, out=mid)
+        mid *= np.float32(0.5)
+        np.subtract(L, R, out=side)
+        side *= np.float32(0.5)
+
+        sq = float(np.dot(mono, mono))
+        peak = max(float(mono.max()), -float(mono.min())) if n else 0.0
+        mid_e = float(np.dot(mid, mid))
+        side_e = float(np.dot(side, side))
+        band = self._band_block
+        for i, sos in enumerate(self.sos):
+            if sos is None:
+                continue
+            filtered, self._zi[i] = signal.sosfilt(sos, mono, zi=self._zi[i])
+            band[i] = np.dot(filtered, filtered)
+
+        with self.lock:
+            self.feedback.update(mono)
+            slot = self.blocks % self.history_blocks
+            self._ring_n[slot] = n
+            self._ring_sq[slot] = sq
+            self._ring_peak[slot] = peak
+            self._ring_mid[slot] = mid_e
+            self._ring_side[slot] = side_e
+            self._ring_band[slot] = band
+
+            self.n_samples += n
+            self._sum_sq += sq
+            self._peak = max(self._peak, peak)
+            self._mid_e += mid_e
+            self._side_e += side_e
+            self._band_sq += band
+
+            t = self.blocks % self.timeline_blocks
+            self._timeline[t] = 10 * np.log10(sq / max(n, 1) + 1e-20)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._latency[t] = elapsed_ms
+            if elapsed_ms > self.budget_ms:
+                self.over_budget += 1
+            self.blocks += 1
+
+    @staticmethod
+    def _metrics(n, sum_sq, peak, mid_e, side_e, band_sq, band_names):
+        # SimpleAnalyzer.analyze() と同じ形の辞書
+        rms_db = 20 * np.log10(np.sqrt(sum_sq / max(n, 1)) + 1e-10)
+        peak_db = 20 * np.log10(peak + 1e-10)
+        band_db = power_to_db(band_sq / max(n, 1))
+        return {
+            'rms_db': float(rms_db),
+            'peak_db': float(peak_db),
+            'crest_factor': float(peak_db - rms_db),
+            'stereo_width': float(side_e / (mid_e + side_e + 1e-10) * 100),
+            'band_energies': {name: float(v) for name, v in zip(band_names, band_db)}
+        }
+
+    def result(self):
+        # 開始からの累積
+        with self.lock:
+            return self._metrics(self.n_samples, self._sum_sq, self._peak, self._mid_e,
+                                 self._side_e, self._band_sq, self.band_names)
+
+    def snapshot(self):
+        with self.lock:
+            total = self._metrics(self.n_samples, self._sum_sq, self._peak, self._mid_e,
+                                  self._side_e, self._band_sq, self.band_names)
+            current = self._metrics(self._ring_n.sum(), self._ring_sq.sum(), self._ring_peak.max(),
+                                    self._ring_mid.sum(), self._ring_side.sum(),
+                                    self._ring_band.sum(axis=0), self.band_names)
+            # 推移と処理時間は古い順に並べ直す
+            filled = min(self.blocks, self.timeline_blocks)
+            order = (np.arange(filled) + self.blocks - filled) % self.timeline_blocks
+            latency = self._latency[order]
+            timeline = self._timeline[order]
+            feedback = self.feedback.summary()
+            over_budget = self.over_budget
+            blocks = self.blocks
+            n_samples = self.n_samples
+
+        return dict(
+            total,
+            current=current,
+            duration_sec=n_samples / self.sr,
+            block_sec=self.block_size / self.sr,
+            rms_timeline_db=timeline,
+            feedback=feedback,
+            latency={
+                'budget_ms': self.budget_ms,
+                'last_ms': float(latency[-1]) if len(latency) else None,
+                'mean_ms': float(latency.mean()) if len(latency) else None,
+                'max_ms': float(latency.max()) if len(latency) else None,
+                'over_budget': over_budget,
+                'blocks': blocks
+            }
+        )
+
+
+class SimpleLiveSession:
+    # 入力を読むスレッドを1本動かし、届いたブロックから順に解析する。
+    # 画面側は snapshot() を一定間隔で読むだけ
+    def __init__(self, source, bands=None):
+        self.source = source
+        self.analyzer = SimpleLiveAnalyzer(source.sr, source.channels, bands, block_size=source.block_size)
+        self.status = 'stopped'
+        self.error = None
+        self.started = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self.status = 'running'
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                block = self.source.read_block()
+                if block is not None:
+                    self.analyzer.update(block)
+                elif self.source.ended:
+                    break
+                else:
+                    self._stop.wait(LIVE_POLL_SEC)
+            self.status = 'stopped' if self._stop.is_set() else 'ended'
+        except Exception as e:
+            self.status = 'failed'
+            self.error = f"{type(e).__name__}: {e}"
+        finally:
+            self.source.close()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self, timeout=2.0):
+        # パイプ・ソケットの読み込み中でも止まるよう、先に入力を閉じる
+        self._stop.set()
+        if isinstance(self.source, RawPCMSource):
+            self.source.close()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def snapshot(self):
+        return dict(self.analyzer.snapshot(), status=self.status, error=self.error)
+
+
+def open_source(spec, sr=None, channels=2, sample_format='s16le', from_start=False, idle_sec=None):
+    # "tcp://host:port"、"-"（標準入力）、それ以外は書き込み中のWAVのパス
+    if spec == '-':
+        return RawPCMSource(sys.stdin.buffer, sr, channels, sample_format)
+    if spec.startswith('tcp://'):
+        host, port = spec[len('tcp://'):].rsplit(':', 1)
+        return RawPCMSource.connect(host, int(port), sr, channels, sample_format)
+    return GrowingWavSource(spec, from_start=from_start, idle_sec=idle_sec)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ライブ入力のリアルタイム計測")
+    parser.add_argument('source', help="書き込み中のWAV / tcp://host:port / -（標準入力）")
+    parser.add_argument('--sr', type=int, default=48000, help="raw PCM のサンプルレート")
+    parser.add_argument('--channels', type=int, default=2, help="raw PCM のチャンネル数")
+    parser.add_argument('--format', choices=list(PCM_FORMATS), default='s16le', help="raw PCM の形式")
+    parser.add_argument('--from-start', action='store_true', help="WAVを先頭から読む")
+    parser.add_argument('--idle-sec', type=float, default=None, help="WAVがこの秒数伸びなければ終了")
+    parser.add_argument('--refresh', type=float, default=1.0, help="表示間隔（秒）")
+    args = parser.parse_args(argv)
+
+    source = open_source(args.source, args.sr, args.channels, args.format, args.from_start, args.idle_sec)
+    session = SimpleLiveSession(source)
+    session.start()
+    try:
+        while session.running:
+            time.sleep(args.refresh)
+            snap = session.snapshot()
+            current = snap['current']
+            latency = snap['latency']
+            print(f"{snap['duration_sec']:8.1f}s  RMS {current['rms_db']:6.1f} dB  "
+                  f"Peak {current['peak_db']:6.1f} dB  Stereo {current['stereo_width']:5.1f}%  "
+                  f"処理 {latency['mean_ms'] or 0:.2f}/{latency['max_ms'] or 0:.2f} ms "
+                  f"(予算 {latency['budget_ms']:.0f} ms, 超過 {latency['over_budget']})", flush=True)
+            for event in snap['feedback']['active']:
+                print(f"    🔊 {event['freq_hz']:.0f} Hz が {event['duration_sec']:.1f}秒 鳴り続けています"
+                      f"（周辺 +{event['above_floor_db']:.0f} dB）", flush=True)
+    except KeyboardInterrupt:
+        session.stop()
+
+    snap = session.snapshot()
+    if snap['error']:
+        print(f"❌ {snap['error']}", file=sys.stderr)
+        return 1
+    print(f"合計 {snap['duration_sec']:.1f}s  RMS {snap['rms_db']:.1f} dB  Peak {snap['peak_db']:.1f} dB  "
+          f"Crest {snap['crest_factor']:.1f} dB  Stereo {snap['stereo_width']:.1f}%")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
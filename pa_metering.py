@@ -0,0 +1,676 @@
+"""
+PA Audio Analyzer V4.0 - ラウドネス・ステレオ計測
+ITU-R BS.1770 準拠のモメンタリー／ショートターム／インテグレーテッド LUFS、
+4倍オーバーサンプリングのトゥルーピーク、100ms窓ごとのバンドエネルギーと、
+100ms窓ごとの L/R 相関・モノラル化したときの損失・バンドごとの M/S 比、
+ハウリング・共振（長く続く狭帯域のピーク）の周波数・発生時刻・継続時間を算出する
+
+使い方:
+    from pa_core import SimpleStreamAnalyzer
+    from pa_metering import SimpleLoudnessMeter
+
+    analyzer = SimpleStreamAnalyzer('show.wav')
+    meter = SimpleLoudnessMeter(analyzer.sr, analyzer.channels)
+    analyzer.add_meter('loudness', meter)
+    result = analyzer.analyze()       # result['loudness'] に集計値
+    timelines = meter.timelines()     # float32 の時系列
+
+    stereo = SimpleStereoMeter(analyzer.sr, analyzer.channels)
+    analyzer.add_meter('stereo', stereo)  # result['stereo'] に相関・モノ損失の集計値
+
+    feedback = SimpleFeedbackMeter(analyzer.sr, analyzer.channels)
+    analyzer.add_meter('feedback', feedback)  # result['feedback']['events'] に検出したピーク
+
+ベンチマーク（ファイル長に対する処理速度）:
+    python pa_metering.py --minutes 1 10 60
+    python pa_metering.py --meter stereo --minutes 60 180
+    python pa_metering.py --meter feedback --minutes 60 180
+"""
+
+import argparse
+import time
+
+import numpy as np
+from scipy import signal
+
+from pa_core import DEFAULT_BANDS, SimpleBandEngine, power_to_db
+
+# BS.1770 のゲーティングブロック（100ms刻み）
+BLOCK_SEC = 0.1
+MOMENTARY_BLOCKS = 4      # 400ms
+SHORT_TERM_BLOCKS = 30    # 3s
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+LRA_RELATIVE_GATE_LU = -20.0
+
+TRUE_PEAK_OVERSAMPLE = 4
+TRUE_PEAK_TAPS = 48
+
+# ステレオ計測: 相関がこれ未満の窓を「逆相気味」として数える（無相関の揺らぎは数えない）。
+# L/R 平均のエネルギーがこれより小さい窓（無音）は相関・モノ損失の集計から外す。
+# 完全な逆相ではモノ損失が発散するので上限で止める
+PHASE_WARN_CORRELATION = -0.2
+STEREO_GATE_DB = -70.0
+MONO_LOSS_MAX_DB = 60.0
+
+# ハウリング・共振の検出: 約6Hz分解能・50%オーバーラップのFFTで、
+# 周辺のスペクトル（±FEEDBACK_FLOOR_BINS ビンのdB平均）より PROMINENCE_DB 以上突き出た
+# 極大を拾い、フレーム間で±1ビンまでの移動を同じピークとして追跡する。
+# GAP_FRAMES フレームまでの途切れは許し、MIN_SEC 以上続いたものを検出として残す。
+# 周波数の揺れ（標準偏差）が MAX_DRIFT_HZ を超えるもの（ビブラートのある歌・楽器）は除く。
+# 突き出方が15dBぎりぎりのピークでも、安定した正弦波なら揺れは1Hz以内に収まる
+FEEDBACK_RESOLUTION_HZ = 6.0
+FEEDBACK_FREQ_RANGE = (60.0, 16000.0)
+FEEDBACK_FLOOR_BINS = 16
+FEEDBACK_PROMINENCE_DB = 15.0
+FEEDBACK_MIN_LEVEL_DB = -70.0
+FEEDBACK_MAX_PEAKS = 16
+FEEDBACK_GAP_FRAMES = 2
+FEEDBACK_MIN_SEC = 2.0
+FEEDBACK_MAX_DRIFT_HZ = 1.0
+# 結果に残す検出の件数。確定した検出もこの件数（周辺より突き出ている順）だけを保持し、
+# 件数と周波数ごとの集計は確定のたびに更新するので、録音が長くてもメモリは増えない
+FEEDBACK_MAX_EVENTS = 100
+
+
+def k_weighting_sos(sr):
+    # K特性フィルタ（ハイシェルフ + RLBハイパス）。任意のサンプルレート用に係数を計算する
+    f0 = 1681.974450955533
+    gain_db = 3.999843853973347
+    q = 0.7071752369554196
+    k = np.tan(np.pi * f0 / sr)
+    vh = 10 ** (gain_db / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k ** 2
+    shelf = [
+        (vh + vb * k / q + k ** 2) / a0,
+        2 * (k ** 2 - vh) / a0,
+        (vh - vb * k / q + k ** 2) / a0,
+        1.0,
+        2 * (k ** 2 - 1) / a0,
+        (1 - k / q + k ** 2) / a0
+    ]
+
+    f0 = 38.13547087602444
+    q = 0.5003270373238773
+    k = np.tan(np.pi * f0 / sr)
+    a0 = 1 + k / q + k ** 2
+    highpass = [1.0, -2.0, 1.0, 1.0, 2 * (k ** 2 - 1) / a0, (1 - k / q + k ** 2) / a0]
+
+    return np.array([shelf, highpass])
+
+
+def energy_to_lufs(energy):
+    return -0.691 + 10 * np.log10(np.maximum(energy, 1e-20))
+
+
+def moving_mean(values, n):
+    # 末尾がそろう長さ n の移動平均（窓が埋まった位置からのみ）
+    if len(values) < n:
+        return np.zeros(0)
+    csum = np.concatenate([[0.0], np.cumsum(values)])
+    return (csum[n:] - csum[:-n]) / n
+
+
+def default_channel_weights(channels):
+    # BS.1770 のチャンネル重み。5.1ch以上は L, R, C, LFE, Ls, Rs, ... の並びとみなし、
+    # LFE は0（ラウドネスに含めない）、サラウンドは1.41。4〜5chは L, R, C の後をサラウンドとみなす
+    weights = [1.0 if c < 3 else 1.41 for c in range(channels)]
+    if channels >= 6:
+        weights[3] = 0.0
+    return weights
+
+
+class SimpleLoudnessMeter:
+    # ブロック単位で update() を呼ぶストリーミング計測器。
+    # 保持するのは100msごとの二乗平均とピークだけなので、長時間でも数MBに収まる
+    def __init__(self, sr, channels=2, bands=None, channel_weights=None):
+        self.sr = sr
+        self.channels = channels
+        self.block_len = int(round(sr * BLOCK_SEC))
+        self.sos = k_weighting_sos(sr)
+
+        if channel_weights is None:
+            channel_weights = default_channel_weights(channels)
+        self.weights = np.asarray(channel_weights, dtype=np.float64)[:, None]
+
+        self.tp_filter = (signal.firwin(TRUE_PEAK_TAPS, 1 / TRUE_PEAK_OVERSAMPLE)
+                          * TRUE_PEAK_OVERSAMPLE).astype(np.float32)
+        self.tp_history = int(np.ceil(TRUE_PEAK_TAPS / TRUE_PEAK_OVERSAMPLE))
+
+        # 窓長200ms・ホップ100msのFFTで窓ごとのバンドエネルギーを求める
+        self.band_engine = SimpleBandEngine(sr, bands or DEFAULT_BANDS, n_fft=2 * self.block_len)
+        self.reset()
+
+    def reset(self):
+        self._zi = np.zeros((self.sos.shape[0], self.channels, 2))
+        self._tp_prev = np.zeros((self.channels, self.tp_history), dtype=np.float32)
+        self._carry_energy = np.zeros(0)
+        self._carry_peak = np.zeros(0)
+        self._energy = []
+        self._peak = []
+        self._bands = []
+        self.band_engine.reset()
+
+    def update(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        if block.ndim == 1:
+            block = block[None]
+        block = block[:self.channels]
+
+        # K特性 → チャンネル重み付き二乗和
+        filtered, self._zi = signal.sosfilt(self.sos, block, axis=-1, zi=self._zi)
+        energy = np.sum(self.weights * filtered ** 2, axis=0)
+
+        x = np.concatenate([self._tp_prev, block], axis=-1)
+        peak = self._oversampled_peak(x)
+        self._tp_prev = x[:, -self.tp_history:]
+
+        # 100msブロックに集約（端数は次回に持ち越す）
+        energy = np.concatenate([self._carry_energy, energy])
+        peak = np.concatenate([self._carry_peak, peak])
+        n_blocks = len(energy) // self.block_len
+        used = n_blocks * self.block_len
+        if n_blocks:
+            self._energy.append(energy[:used].reshape(n_blocks, -1).mean(axis=1))
+            self._peak.append(peak[:used].reshape(n_blocks, -1).max(axis=1).astype(np.float32))
+        self._carry_energy = energy[used:]
+        self._carry_peak = peak[used:]
+
+        frames = self.band_engine.update(np.mean(block, axis=0), return_frames=True)
+        if frames.shape[0]:
+            self._bands.append(frames)
+
+    def _oversampled_peak(self, x):
+        # 4倍オーバーサンプリングして、先頭の履歴 tp_history サンプルを除いた入力1サンプルごとの最大値にまとめる。
+        # フィルタの遅延（約 TAPS / 2 / OVERSAMPLE サンプル）の分、各サンプルの値は少し前の区間を表す
+        up = signal.upfirdn(self.tp_filter, x, up=TRUE_PEAK_OVERSAMPLE, axis=-1)
+        start = self.tp_history * TRUE_PEAK_OVERSAMPLE
+        phases = up[:, start:start + (x.shape[1] - self.tp_history) * TRUE_PEAK_OVERSAMPLE].reshape(
+            self.channels, -1, TRUE_PEAK_OVERSAMPLE)
+        # 要素数4の軸での縮約は遅いので、位相ごとに最大値を取っていく
+        peak = np.abs(phases[..., 0])
+        for p in range(1, TRUE_PEAK_OVERSAMPLE):
+            np.maximum(peak, np.abs(phases[..., p]), out=peak)
+        return peak.max(axis=0)
+
+    def _tail_peak(self):
+        # フィルタの遅延で update() がまだ出していない最後の数サンプルを、無音を足して押し出す。
+        # 100msに満たない持ち越し分のピークも含める（状態は変えないので、この後も update() できる）
+        tail = self._oversampled_peak(np.concatenate([self._tp_prev, np.zeros_like(self._tp_prev)], axis=-1))
+        return max(float(tail.max()), float(self._carry_peak.max()) if len(self._carry_peak) else 0.0)
+
+    def _blocks(self):
+        energy = np.concatenate(self._energy) if self._energy else np.zeros(0)
+        peak = np.concatenate(self._peak) if self._peak else np.zeros(0, dtype=np.float32)
+        return energy, peak
+
+    def timelines(self):
+        energy, peak = self._blocks()
+        momentary = energy_to_lufs(moving_mean(energy, MOMENTARY_BLOCKS))
+        short_term = energy_to_lufs(moving_mean(energy, SHORT_TERM_BLOCKS))
+        if self._bands:
+            bands = power_to_db(np.concatenate(self._bands))
+        else:
+            bands = np.zeros((0, len(self.band_engine.names)))
+
+        # 各値の時刻は窓の終端（秒）。block_sec 刻みなので時刻配列は持たない
+        return {
+            'block_sec': BLOCK_SEC,
+            'momentary_lufs': momentary.astype(np.float32),
+            'short_term_lufs': short_term.astype(np.float32),
+            'true_peak_db': (20 * np.log10(peak + 1e-10)).astype(np.float32),
+            'band_db': bands.astype(np.float32),
+            'band_names': np.array(self.band_engine.names)
+        }
+
+    def summary(self):
+        energy, peak = self._blocks()
+
+        # インテグレーテッド: 400ms窓（75%オーバーラップ）に絶対・相対ゲートをかける
+        gating = moving_mean(energy, MOMENTARY_BLOCKS)
+        gated = gating[energy_to_lufs(gating) > ABSOLUTE_GATE_LUFS]
+        integrated = None
+        if len(gated):
+            threshold = energy_to_lufs(np.mean(gated)) + RELATIVE_GATE_LU
+            gated = gated[energy_to_lufs(gated) > threshold]
+            integrated = float(energy_to_lufs(np.mean(gated)))
+
+        # ラウドネスレンジ（EBU Tech 3342）: ショートターム値の10〜95パーセンタイル
+        short_term = moving_mean(energy, SHORT_TERM_BLOCKS)
+        st_gated = short_term[energy_to_lufs(short_term) > ABSOLUTE_GATE_LUFS]
+        lra = None
+        if len(st_gated):
+            threshold = energy_to_lufs(np.mean(st_gated)) + LRA_RELATIVE_GATE_LU
+            st_lufs = energy_to_lufs(st_gated)
+            st_lufs = st_lufs[st_lufs > threshold]
+            lra = float(np.percentile(st_lufs, 95) - np.percentile(st_lufs, 10))
+
+        return {
+            'integrated_lufs': integrated,
+            'loudness_range': lra,
+            'max_momentary_lufs': float(energy_to_lufs(gating.max())) if len(gating) else None,
+            'max_short_term_lufs': float(energy_to_lufs(short_term.max())) if len(short_term) else None,
+            'true_peak_db': (float(20 * np.log10(max(peak.max(initial=0), self._tail_peak()) + 1e-10))
+                             if len(peak) or len(self._carry_peak) else None)
+        }
+
+
+class SimpleStereoMeter:
+    # 100ms窓ごとの L/R 相関係数とモノラル化損失、バンドごとの M/S 比を求める計測器。
+    # 窓は (窓数, 窓長) に reshape してまとめて計算し、端数は次回に持ち越す
+    def __init__(self, sr, channels=2, bands=None):
+        self.sr = sr
+        self.channels = channels
+        self.block_len = int(round(sr * BLOCK_SEC))
+        self.gate = 10 ** (STEREO_GATE_DB / 10)
+        # Mid と Side を (2, n) に重ね、窓長200ms・ホップ100msのFFTで同時に処理する
+        self.band_engine = SimpleBandEngine(sr, bands or DEFAULT_BANDS, n_fft=2 * self.block_len)
+        self.reset()
+
+    def reset(self):
+        self._carry = np.zeros((2, 0), dtype=np.float32)
+        self._windows = []
+        self._bands = []
+        self._totals = np.zeros(3)
+        self.band_engine.reset()
+
+    def update(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        if block.ndim == 1:
+            block = block[None]
+        L = block[0]
+        R = block[1] if block.shape[0] > 1 else block[0]
+        mid = (L + R) / 2
+        side = (L - R) / 2
+
+        # 窓ごとの ΣL², ΣR², ΣLR（M/S のエネルギーはここから求まるので持たない）
+        lr = np.concatenate([self._carry, np.stack([L, R])], axis=-1)
+        n_windows = lr.shape[1] // self.block_len
+        used = n_windows * self.block_len
+        if n_windows:
+            w = lr[:, :used].reshape(2, n_windows, self.block_len)
+            sums = np.stack([
+                np.einsum('wn,wn->w', w[0], w[0]),
+                np.einsum('wn,wn->w', w[1], w[1]),
+                np.einsum('wn,wn->w', w[0], w[1])
+            ])
+            self._windows.append(sums)
+        self._carry = lr[:, used:]
+
+        frames = self.band_engine.update(np.stack([mid, side]), return_frames=True)
+        if frames.shape[1]:
+            self._bands.append(frames)
+
+        self._totals += [float(np.dot(L, L)), float(np.dot(R, R)), float(np.dot(L, R))]
+
+    def _sums(self):
+        if not self._windows:
+            return np.zeros((3, 0))
+        return np.concatenate(self._windows, axis=1)
+
+    @staticmethod
+    def _correlation(ll, rr, lr):
+        return lr / np.sqrt(ll * rr + 1e-20)
+
+    @staticmethod
+    def _mono_loss_db(ll, rr, lr):
+        # L と R をそのまま足した (L+R)/2 のエネルギーが、L/R 平均のエネルギーより何dB下がるか。
+        # 同相のモノ = 0dB、無相関 = 3dB、完全な逆相で大きくなる
+        mono = (ll + rr + 2 * lr) / 4
+        loss = 10 * np.log10((ll + rr) / 2 + 1e-20) - 10 * np.log10(np.maximum(mono, 0) + 1e-20)
+        return np.minimum(loss, MONO_LOSS_MAX_DB)
+
+    def timelines(self):
+        ll, rr, lr = self._sums()
+        if self._bands:
+            frames = np.concatenate(self._bands, axis=1)
+            ms_db = 10 * np.log10((frames[0] + 1e-20) / (frames[1] + 1e-20))
+        else:
+            ms_db = np.zeros((0, len(self.band_engine.names)))
+
+        # 各値の時刻は窓の終端（秒）。無音の窓の相関は NaN
+        silent = (ll + rr) / 2 < self.gate * self.block_len
+        return {
+            'block_sec': BLOCK_SEC,
+            'correlation': np.where(silent, np.nan, self._correlation(ll, rr, lr)).astype(np.float32),
+            'mono_loss_db': np.where(silent, np.nan, self._mono_loss_db(ll, rr, lr)).astype(np.float32),
+            'band_ms_db': ms_db.astype(np.float32),
+            'band_names': np.array(self.band_engine.names)
+        }
+
+    def summary(self):
+        ll, rr, lr = self._sums()
+        active = (ll + rr) / 2 >= self.gate * self.block_len
+        correlation = self._correlation(ll, rr, lr)[active]
+        mono_loss = self._mono_loss_db(ll, rr, lr)[active]
+
+        total_ll, total_rr, total_lr = self._totals
+        band_power = self.band_engine.band_power()
+        if band_power.ndim == 1:
+            band_power = np.zeros((2, len(self.band_engine.names)))
+        mid_p, side_p = band_power
+        band_ms = 10 * np.log10((mid_p + 1e-20) / (side_p + 1e-20))
+        band_loss = np.minimum(10 * np.log10((mid_p + side_p + 1e-20) / (mid_p + 1e-20)), MONO_LOSS_MAX_DB)
+
+        return {
+            'correlation': float(self._correlation(total_ll, total_rr, total_lr)),
+            'min_correlation': float(correlation.min()) if len(correlation) else None,
+            'out_of_phase_pct': float(np.mean(correlation < PHASE_WARN_CORRELATION) * 100) if len(correlation) else None,
+            'mono_loss_db': float(self._mono_loss_db(total_ll, total_rr, total_lr)),
+            'max_mono_loss_db': float(mono_loss.max()) if len(mono_loss) else None,
+            'band_ms_db': {band: float(v) for band, v in zip(self.band_engine.names, band_ms)},
+            'band_mono_loss_db': {band: float(v) for band, v in zip(self.band_engine.names, band_loss)}
+        }
+
+
+def pick(values, index):
+    # values[index]。index が -1（該当なし）の位置は np.where で捨てる前提で 0 を返す
+    if not len(values):
+        return np.zeros(len(index))
+    return values[np.maximum(index, 0)]
+
+
+class SimpleFeedbackMeter:
+    # 長く続く狭帯域のピーク（ハウリング・ルームモードの共振）を検出する計測器。
+    # フレームはブロックをまたいで (フレーム数, n_fft) にまとめてFFTし、ピークの抽出とフレーム間の追跡も
+    # ブロック単位の配列演算で行う（Python のループはフレームごとに回さない）。
+    # 引き継ぐ状態は追跡中のピークの集計と直近数フレームの対応表だけなので、処理量は録音の長さによらない
+    # （ライブのブロック処理でもそのまま使える）
+    EVENT_FIELDS = ('freq_hz', 'onset_sec', 'duration_sec', 'level_db', 'above_floor_db',
+                    'max_above_floor_db', 'growth_db', 'drift_hz')
+
+    def __init__(self, sr, channels=2, freq_range=FEEDBACK_FREQ_RANGE, prominence_db=FEEDBACK_PROMINENCE_DB,
+                 min_sec=FEEDBACK_MIN_SEC):
+        self.sr = sr
+        self.channels = channels
+        self.n_fft = 1 << int(np.ceil(np.log2(sr / FEEDBACK_RESOLUTION_HZ)))
+        self.hop = self.n_fft // 2
+        self.bin_hz = sr / self.n_fft
+        self.prominence_db = prominence_db
+        self.min_frames = int(np.ceil(min_sec * sr / self.hop))
+        self.window = np.hanning(self.n_fft).astype(np.float32)
+        # 正弦波の実効値が 20*log10(rms) dB になるように振幅を正規化する
+        self.scale = np.sqrt(2) / self.window.sum()
+
+        # 追跡するのは freq_range 内のビンだけ（端の極大判定用に両側1ビン余分に切り出す）
+        low, high = freq_range
+        self.lo = max(1, int(low / self.bin_hz))
+        self.hi = min(self.n_fft // 2, int(np.ceil(min(high, sr / 2) / self.bin_hz)))
+        self.reset()
+
+    TRACK_FIELDS = ('start', 'last', 'count', 'sum_freq', 'sum_freq2', 'sum_level', 'sum_above',
+                    'max_above', 'first_level', 'last_level')
+
+    def reset(self):
+        n_bins = self.hi - self.lo
+        self._carry = np.zeros(0, dtype=np.float32)
+        self.frames = 0
+        # 追跡中のピーク（フィールドごとの配列）と、直近 GAP_FRAMES+1 フレームで
+        # 各ビンのピークがどの追跡のものか（-1 はなし）。ブロックをまたいだ追跡はこの2つだけで引き継ぐ
+        self._open = self._empty_tracks()
+        self._context = np.full((FEEDBACK_GAP_FRAMES + 1, n_bins), -1, dtype=np.int64)
+        self._event_count = 0
+        self._kept = np.zeros((0, len(self.EVENT_FIELDS)))
+        self._recurring = []
+
+    def _empty_tracks(self):
+        return {name: np.zeros(0, dtype=np.int64 if name in ('start', 'last', 'count') else np.float64)
+                for name in self.TRACK_FIELDS}
+
+    def update(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        mono = block if block.ndim == 1 else block.mean(axis=0)
+        buf = np.concatenate([self._carry, mono])
+        n_frames = (len(buf) - self.n_fft) // self.hop + 1 if len(buf) >= self.n_fft else 0
+        self._carry = buf[n_frames * self.hop:]
+        if not n_frames:
+            return
+
+        frames = np.lib.stride_tricks.sliding_window_view(buf, self.n_fft)[::self.hop][:n_frames]
+        spec = np.fft.rfft(frames * self.window, axis=1)[:, self.lo - 1:self.hi + 1]
+        level = 20 * np.log10(np.abs(spec) * self.scale + 1e-12)
+
+        # 周辺のスペクトル = dB の移動平均（累積和で全フレーム・全ビンをまとめて求める）
+        k = FEEDBACK_FLOOR_BINS
+        padded = np.pad(level, ((0, 0), (k + 1, k)), mode='edge')
+        csum = np.cumsum(padded, axis=1)
+        floor = (csum[:, 2 * k + 1:] - csum[:, :-2 * k - 1]) / (2 * k + 1)
+        above = (level - floor)[:, 1:-1]
+
+        # 極大かつ周辺より prominence_db 以上高いビン（両端の余分な1ビンは判定にだけ使う）
+        center = level[:, 1:-1]
+        is_peak = ((center > level[:, :-2]) & (center >= level[:, 2:])
+                   & (above >= self.prominence_db) & (center >= FEEDBACK_MIN_LEVEL_DB))
+        # 1フレームあたり突き出ている順に MAX_PEAKS 個まで
+        if is_peak.sum(axis=1).max() > FEEDBACK_MAX_PEAKS:
+            score = np.where(is_peak, above, -np.inf)
+            kth = -np.partition(-score, FEEDBACK_MAX_PEAKS - 1, axis=1)[:, FEEDBACK_MAX_PEAKS - 1:FEEDBACK_MAX_PEAKS]
+            is_peak &= score >= kth
+        # 放物線補間でビン間の周波数を求める
+        a, b, c = level[:, :-2], center, level[:, 2:]
+        denom = a - 2 * b + c
+        offset = np.where(denom < 0, 0.5 * (a - c) / np.where(denom < 0, denom, -1), 0.0)
+        freq = (np.arange(self.lo, self.hi) + offset) * self.bin_hz
+
+        self._track(is_peak, freq, center, above)
+
+    def _track(self, peaks, freq, level, above):
+        # ブロック内の全フレームをまとめて追跡する。
+        # ピークの (フレーム, ビン) を時間方向に GAP_FRAMES 先まで伸ばし、8近傍でつながる成分を1つの追跡とする
+        # （±1ビンの移動と GAP_FRAMES までの途切れを許す）。直近のフレーム（_context）を先頭に足して
+        # 前のブロックから続く追跡とつなぎ、成分ごとの集計は bincount でまとめて求める
+        from scipy import ndimage
+        from scipy.sparse import coo_matrix
+        from scipy.sparse.csgraph import connected_components
+
+        gap = FEEDBACK_GAP_FRAMES
+        n_ctx = gap + 1
+        n_new = len(peaks)
+        context = self._context
+        n_open = len(self._open['start'])
+        if not n_open and not peaks.any():
+            self.frames += n_new
+            return
+        mask = np.concatenate([context >= 0, peaks])
+        grown = mask.copy()
+        for g in range(1, gap + 1):
+            grown[g:] |= mask[:-g]
+        labels, n_labels = ndimage.label(grown, structure=np.ones((3, 3), dtype=bool))
+        labels[~mask] = 0
+
+        # 1つの追跡の直近のピークが離れた成分に分かれた場合は、その成分どうしを同じ追跡としてまとめる
+        ctx_rows, ctx_bins = np.nonzero(context >= 0)
+        track_ids = context[ctx_rows, ctx_bins]
+        ctx_labels = labels[ctx_rows, ctx_bins]
+        group = np.arange(n_labels + 1)
+        track_group = np.zeros(n_open, dtype=np.int64)
+        track_group[track_ids] = ctx_labels
+        if np.any(track_group[track_ids] != ctx_labels):
+            graph = coo_matrix((np.ones(len(track_ids)), (ctx_labels, n_labels + 1 + track_ids)),
+                               shape=(n_labels + 1 + n_open,) * 2)
+            _, components = connected_components(graph, directed=False)
+            group = components[:n_labels + 1]
+            track_group = components[n_labels + 1:]
+
+        # 新しいフレームのピーク（行優先なので同じ成分の中ではフレーム順）
+        rows, bins = np.nonzero(peaks)
+        pix_group = group[labels[n_ctx + rows, bins]]
+        pix_frame = self.frames + rows
+        pix_freq, pix_level, pix_above = freq[rows, bins], level[rows, bins], above[rows, bins]
+
+        # 追跡を引き継ぐ成分と新しく始まる成分を通し番号 0..n-1 にする
+        present = np.unique(np.concatenate([pix_group, track_group]))
+        n = len(present)
+        pix = np.searchsorted(present, pix_group)
+        old = np.searchsorted(present, track_group)
+        tracks = self._open
+
+        def total(weights_new, weights_old):
+            return np.bincount(pix, weights_new, minlength=n) + np.bincount(old, weights_old, minlength=n)
+
+        merged = {
+            'count': total(np.ones(len(pix)), tracks['count']).astype(np.int64),
+            'sum_freq': total(pix_freq, tracks['sum_freq']),
+            'sum_freq2': total(pix_freq ** 2, tracks['sum_freq2']),
+            'sum_level': total(pix_level, tracks['sum_level']),
+            'sum_above': total(pix_above, tracks['sum_above']),
+            'start': np.full(n, np.iinfo(np.int64).max),
+            'last': np.full(n, -1, dtype=np.int64),
+            'max_above': np.full(n, -np.inf),
+            'first_level': np.zeros(n),
+            'last_level': np.zeros(n)
+        }
+        for target, values, op in (('start', (pix_frame, tracks['start']), np.minimum),
+                                   ('last', (pix_frame, tracks['last']), np.maximum),
+                                   ('max_above', (pix_above, tracks['max_above']), np.maximum)):
+            op.at(merged[target], pix, values[0])
+            op.at(merged[target], old, values[1])
+        # 最初のレベルは最も早く始まった追跡（無ければ最初のピーク）、最後のレベルは最後のピークのもの
+        first_new = np.full(n, -1)
+        first_new[pix[::-1]] = np.arange(len(pix))[::-1]
+        last_new = np.full(n, -1)
+        last_new[pix] = np.arange(len(pix))
+        order = np.argsort(-tracks['start'], kind='stable')
+        first_old = np.full(n, -1)
+        first_old[old[order]] = order
+        order = np.argsort(tracks['last'], kind='stable')
+        last_old = np.full(n, -1)
+        last_old[old[order]] = order
+        merged['first_level'] = np.where(first_old >= 0, pick(tracks['first_level'], first_old),
+                                         pick(pix_level, first_new))
+        merged['last_level'] = np.where(last_new >= 0, pick(pix_level, last_new),
+                                        pick(tracks['last_level'], last_old))
+
+        # 最後のピークから GAP_FRAMES を超えて途切れたものを確定し、残りを次のブロックへ引き継ぐ
+        end = self.frames + n_new - 1
+        alive = merged['last'] >= end - gap
+        self._close({name: values[~alive] for name, values in merged.items()})
+        self._open = {name: values[alive] for name, values in merged.items()}
+
+        index = np.full(n, -1, dtype=np.int64)
+        index[alive] = np.arange(alive.sum())
+        recent = labels[-n_ctx:]
+        next_context = np.full(recent.shape, -1, dtype=np.int64)
+        on = recent > 0
+        next_context[on] = index[np.searchsorted(present, group[recent[on]])]
+        self._context = next_context
+        self.frames += n_new
+
+    def _describe(self, tracks):
+        # 追跡の集計を (件数, EVENT_FIELDS) の配列にする
+        count = tracks['count']
+        mean_freq = tracks['sum_freq'] / count
+        drift = np.sqrt(np.maximum(tracks['sum_freq2'] / count - mean_freq ** 2, 0))
+        return np.stack([
+            mean_freq,
+            (tracks['start'] * self.hop + self.n_fft / 2) / self.sr,
+            (tracks['last'] - tracks['start'] + 1) * self.hop / self.sr,
+            tracks['sum_level'] / count,
+            tracks['sum_above'] / count,
+            tracks['max_above'],
+            tracks['last_level'] - tracks['first_level'],
+            drift
+        ], axis=1)
+
+    def _qualified(self, tracks):
+        # MIN_SEC 以上続き、周波数の揺れが MAX_DRIFT_HZ 以内のものだけを残す
+        long_enough = tracks['last'] - tracks['start'] + 1 >= self.min_frames
+        events = self._describe({name: values[long_enough] for name, values in tracks.items()})
+        return events[events[:, 7] <= FEEDBACK_MAX_DRIFT_HZ]
+
+    def _close(self, tracks):
+        if not len(tracks['start']):
+            return
+        events = self._qualified(tracks)
+        if len(events):
+            # 件数と周波数ごとの集計を更新し、行は上位 MAX_EVENTS 件だけを残す
+            self._event_count += len(events)
+            self._add_recurring(self._recurring, events)
+            kept = np.concatenate([self._kept, events])
+            self._kept = kept[np.argsort(-kept[:, 4], kind='stable')[:FEEDBACK_MAX_EVENTS]]
+
+    @staticmethod
+    def _add_recurring(recurring, events):
+        # 同じ周波数（半音以内）で繰り返し鳴っているものをまとめる（長く続いたものから）
+        for event in events[np.argsort(-events[:, 2], kind='stable')]:
+            for item in recurring:
+                if abs(12 * np.log2(event[0] / item['freq_hz'])) <= 0.5:
+                    item['count'] += 1
+                    item['total_sec'] += float(event[2])
+                    item['max_above_floor_db'] = max(item['max_above_floor_db'], float(event[5]))
+                    break
+            else:
+                if len(recurring) < FEEDBACK_MAX_EVENTS:
+                    recurring.append({'freq_hz': float(event[0]), 'count': 1, 'total_sec': float(event[2]),
+                                      'max_above_floor_db': float(event[5])})
+
+    def _all_events(self):
+        # 保持している確定済み + 追跡中で条件を満たしたもの（状態は変えないので途中でも何度でも呼べる）
+        active = self._qualified(self._open)
+        events = np.concatenate([self._kept, active])
+        return events[np.argsort(events[:, 1], kind='stable')], active
+
+    def timelines(self):
+        # 保持している検出（突き出ている順に上位 MAX_EVENTS 件と追跡中のもの）を発生順に
+        events, _ = self._all_events()
+        return {name: events[:, i].astype(np.float32) for i, name in enumerate(self.EVENT_FIELDS)}
+
+    def summary(self):
+        events, active = self._all_events()
+        # 周辺より突き出ている順に上位だけを残す（長時間の録音でも結果の大きさを一定に保つ）
+        top = events[np.argsort(-events[:, 4], kind='stable')[:FEEDBACK_MAX_EVENTS]]
+        top = top[np.argsort(top[:, 1], kind='stable')]
+
+        recurring = [dict(item) for item in self._recurring]
+        self._add_recurring(recurring, active)
+        recurring.sort(key=lambda item: -item['total_sec'])
+
+        def as_dicts(rows):
+            return [{name: float(v) for name, v in zip(self.EVENT_FIELDS, row)} for row in rows]
+
+        return {
+            'event_count': self._event_count + len(active),
+            'events': as_dicts(top),
+            'active': as_dicts(active),
+            'frequencies': recurring
+        }
+
+
+METERS = {'loudness': SimpleLoudnessMeter, 'stereo': SimpleStereoMeter, 'feedback': SimpleFeedbackMeter}
+
+
+def benchmark(minutes, sr=48000, block_size=65536, meter='loudness'):
+    # 合成ステレオ信号をブロックで流し込み、実時間比を測る
+    rng = np.random.default_rng(0)
+    block = (0.1 * rng.standard_normal((2, block_size))).astype(np.float32)
+    n_blocks = int(minutes * 60 * sr / block_size)
+
+    meter = METERS[meter](sr, 2)
+    start = time.perf_counter()
+    for _ in range(n_blocks):
+        meter.update(block)
+    meter.summary()
+    timelines = meter.timelines()
+    elapsed = time.perf_counter() - start
+
+    audio_sec = n_blocks * block_size / sr
+    size_kb = sum(v.nbytes for v in timelines.values() if isinstance(v, np.ndarray)) / 1024
+    return {'audio_sec': audio_sec, 'elapsed_sec': elapsed, 'realtime_x': audio_sec / elapsed, 'timelines_kb': size_kb}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ラウドネス・ステレオ計測のベンチマーク")
+    parser.add_argument('--minutes', type=float, nargs='+', default=[1, 10, 60])
+    parser.add_argument('--sr', type=int, default=48000)
+    parser.add_argument('--meter', choices=list(METERS), default='loudness')
+    args = parser.parse_args()
+
+    for minutes in args.minutes:
+        r = benchmark(minutes, args.sr, meter=args.meter)
+        print(f"{minutes:6.1f}分: {r['elapsed_sec']:7.2f}秒 "
+              f"（実時間の{r['realtime_x']:.0f}倍） 時系列 {r['timelines_kb']:.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
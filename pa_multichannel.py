@@ -0,0 +1,344 @@
+"""
+PA Audio Analyzer V4.0 - マルチチャンネル解析
+卓のバーチャルサウンドチェック録音（CL5 / Dante など 32〜64ch のWAV）を入力ごとに解析し、
+ユーザー定義のグループ（モノラルの合算）・バス（L/R のステレオ）の指標も同じパスで求める
+
+チャンネル番号は卓と同じ1始まり。(channels, n) のブロックを1つずつ読み、
+全チャンネルを1回のベクトル演算で処理する（メモリは1ブロック分だけ）。
+workers を指定するとチャンネルを分けてプロセスプールで並列に解析する
+
+使い方:
+    from pa_multichannel import SimpleMultichannelAnalyzer, analyze_multichannel
+
+    groups = {'drums': [1, 2, 3, 4, 5, 6, 7, 8], 'main': {'L': [31], 'R': [32]}}
+    result = SimpleMultichannelAnalyzer('soundcheck.wav', groups).analyze()
+    result['channels']['ch01']['band_energies']
+    result['groups']['main']['stereo_width']
+
+    result = analyze_multichannel('soundcheck.wav', groups, workers=4)
+
+    # ステレオのバスの L/R（バスが無ければ全入力のモノラル合算）をステレオ用の計測器に渡す
+    from pa_core import SimpleStreamAnalyzer
+    bus = SimpleBusMix(AudioHandle('soundcheck.wav'), groups['main'])
+    SimpleStreamAnalyzer(bus).analyze()
+
+コマンドライン:
+    python pa_multichannel.py soundcheck.wav --group drums=1-8 --group main=31/32 -o result.json
+    python pa_multichannel.py soundcheck.wav --groups groups.json --workers 4
+"""
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pa_core import DEFAULT_BANDS, AudioHandle, SimpleBandEngine, power_to_db
+
+# 64ch × 32768 フレームの float32 で 8MB（FFTの作業領域を含めても1ブロック数十MB）
+MULTI_BLOCK_SIZE = 32768
+
+
+def parse_channels(spec):
+    # "1-8,12" → [1, ..., 8, 12]。リストはそのまま int にする
+    if isinstance(spec, (list, tuple)):
+        return [int(c) for c in spec]
+    channels = []
+    for part in str(spec).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            channels.extend(range(int(first), int(last) + 1))
+        else:
+            channels.append(int(part))
+    return channels
+
+
+def parse_group(spec):
+    # "1-8" はモノラルのグループ、"31/32"（左/右）はステレオのバス
+    if isinstance(spec, dict):
+        return {'L': parse_channels(spec['L']), 'R': parse_channels(spec['R'])}
+    if isinstance(spec, str) and '/' in spec:
+        left, right = spec.split('/', 1)
+        return {'L': parse_channels(left), 'R': parse_channels(right)}
+    return parse_channels(spec)
+
+
+def parse_groups(items):
+    # ["drums=1-8", "main=31/32"] または "drums=1-8; main=31/32"（改行区切りも可）→ {名前: 定義}
+    if isinstance(items, str):
+        items = items.replace('\n', ';').split(';')
+    groups = {}
+    for item in items:
+        item = item.strip()
+        if not item:
+            continue
+        if '=' not in item:
+            raise ValueError(f"group '{item}': expected name=channels (e.g. drums=1-8, main=31/32)")
+        name, spec = item.split('=', 1)
+        groups[name.strip()] = parse_group(spec.strip())
+    return groups
+
+
+def group_channels(group):
+    return group['L'] + group['R'] if isinstance(group, dict) else list(group)
+
+
+def mix_matrices(groups, channels):
+    # グループ・バスを「入力チャンネルの重み付き和」の行列にする。
+    # mono: (グループ数, channels) の合算（ステレオのバスは (L+R)/2）、
+    # side: ステレオのバスだけの (L-R)/2。1ブロック分の行列積でまとめて求める
+    names = list(groups)
+    mono = np.zeros((len(names), channels), dtype=np.float32)
+    stereo = [name for name in names if isinstance(groups[name], dict)]
+    side = np.zeros((len(stereo), channels), dtype=np.float32)
+    for g, name in enumerate(names):
+        group = groups[name]
+        for ch in group_channels(group):
+            if not 1 <= ch <= channels:
+                raise ValueError(f"group '{name}': channel {ch} is out of range (1-{channels})")
+        if isinstance(group, dict):
+            s = stereo.index(name)
+            for ch in group['L']:
+                mono[g, ch - 1] += 0.5
+                side[s, ch - 1] += 0.5
+            for ch in group['R']:
+                mono[g, ch - 1] += 0.5
+                side[s, ch - 1] -= 0.5
+        else:
+            for ch in group:
+                mono[g, ch - 1] += 1.0
+    return names, stereo, mono, side
+
+
+def stereo_bus(groups):
+    # 最初に定義されたステレオのバス (名前, 定義)。無ければ (None, None)
+    for name, group in groups.items():
+        group = parse_group(group)
+        if isinstance(group, dict):
+            return name, group
+    return None, None
+
+
+class SimpleBusMix:
+    # AudioHandle と同じ sr / channels / frames / blocks() を持つ読み込み元。
+    # ステレオのバスを渡すと (2, n) の L/R、None なら全入力の平均（モノラル）を (1, n) で返すので、
+    # SimpleStreamAnalyzer と2ch前提の計測器（ラウドネス・ステレオ・指紋）をそのまま使える
+    def __init__(self, audio, bus=None):
+        self.audio = audio
+        self.sr = audio.sr
+        self.frames = audio.frames
+        if bus is None:
+            self._mix = np.full((1, audio.channels), 1.0 / audio.channels, dtype=np.float32)
+        else:
+            bus = parse_group(bus)
+            _, _, mono, _ = mix_matrices({'L': bus['L'], 'R': bus['R']}, audio.channels)
+            # グループと同じく各側は入力の合算
+            self._mix = mono
+        self.channels = self._mix.shape[0]
+
+    def blocks(self, block_size):
+        for block in self.audio.blocks(block_size):
+            yield self._mix @ block
+
+
+class SimpleMultichannelAnalyzer:
+    # audio_path はファイルパスか AudioHandle。
+    # channels で個別に解析するチャンネル（1始まり）を絞れる（None なら全チャンネル）。
+    # グループ・バスは絞り込みに関係なく全入力から合算する
+    def __init__(self, audio_path, groups=None, channel_names=None, bands=None, band_mode='fft',
+                 block_size=MULTI_BLOCK_SIZE, channels=None):
+        self.audio_path = audio_path
+        self.owns_audio = not isinstance(audio_path, AudioHandle)
+        self.audio = AudioHandle(audio_path) if self.owns_audio else audio_path
+        self.sr = self.audio.sr
+        self.channels = self.audio.channels
+        self.bands = bands or DEFAULT_BANDS
+        self.band_mode = band_mode
+        self.block_size = block_size
+
+        self.all_channels = channels is None
+        self.selected = list(range(1, self.channels + 1)) if channels is None else parse_channels(channels)
+        self._index = np.array(self.selected, dtype=np.intp) - 1
+        # 名前が足りないチャンネルは ch01 形式にする
+        defaults = [f"ch{c:02d}" for c in range(1, self.channels + 1)]
+        channel_names = list(channel_names or [])[:self.channels]
+        channel_names += defaults[len(channel_names):]
+        self.channel_names = [channel_names[c - 1] for c in self.selected]
+
+        self.groups = {name: parse_group(spec) for name, spec in (groups or {}).items()}
+        self.group_names, self.stereo_names, self._mono_mix, self._side_mix = mix_matrices(
+            self.groups, self.channels)
+        self.reset()
+
+    def reset(self):
+        n_ch, n_groups = len(self.selected), len(self.group_names)
+        self.n_samples = 0
+        self._sum_sq = np.zeros(n_ch)
+        self._peak = np.zeros(n_ch)
+        self._group_sq = np.zeros(n_groups)
+        self._group_peak = np.zeros(n_groups)
+        self._side_sq = np.zeros(len(self.stereo_names))
+        self._engine = SimpleBandEngine(self.sr, self.bands, mode=self.band_mode)
+        self._group_engine = SimpleBandEngine(self.sr, self.bands, mode=self.band_mode)
+
+    @staticmethod
+    def _levels(x):
+        # 行ごとの二乗和とピーク（abs のコピーを作らない）
+        sq = np.einsum('cn,cn->c', x, x, dtype=np.float64)
+        peak = np.maximum(x.max(axis=1), -x.min(axis=1))
+        return sq, peak
+
+    def update(self, block):
+        # block: (全チャンネル, n) の float32
+        block = np.asarray(block, dtype=np.float32)
+        if self.selected:
+            x = block if self.all_channels else block[self._index]
+            sq, peak = self._levels(x)
+            self._sum_sq += sq
+            np.maximum(self._peak, peak, out=self._peak)
+            self._engine.update(x)
+
+        if self.group_names:
+            mono = self._mono_mix @ block
+            sq, peak = self._levels(mono)
+            self._group_sq += sq
+            np.maximum(self._group_peak, peak, out=self._group_peak)
+            self._group_engine.update(mono)
+            if self.stereo_names:
+                side = self._side_mix @ block
+                self._side_sq += np.einsum('cn,cn->c', side, side, dtype=np.float64)
+        self.n_samples += block.shape[1]
+
+    def analyze(self):
+        self.reset()
+        try:
+            for block in self.audio.blocks(self.block_size):
+                self.update(block)
+            return self.summary()
+        finally:
+            if self.owns_audio:
+                self.audio.close()
+
+    def _metrics(self, sum_sq, peak, band_power, names):
+        n = max(self.n_samples, 1)
+        rms_db = 20 * np.log10(np.sqrt(sum_sq / n) + 1e-10)
+        peak_db = 20 * np.log10(peak + 1e-10)
+        band_names = list(self.bands)
+        # 1ブロックも読めなかった（短すぎる）場合も (行, バンド) の形にそろえる
+        band_db = power_to_db(np.broadcast_to(band_power, (len(names), len(band_names))))
+        return {
+            name: {
+                'rms_db': float(rms_db[i]),
+                'peak_db': float(peak_db[i]),
+                'crest_factor': float(peak_db[i] - rms_db[i]),
+                'band_energies': {band: float(band_db[i, b]) for b, band in enumerate(band_names)}
+            }
+            for i, name in enumerate(names)
+        }
+
+    def summary(self):
+        channels = {}
+        if self.selected:
+            channels = self._metrics(self._sum_sq, self._peak, self._engine.band_power(), self.channel_names)
+            for name, number in zip(self.channel_names, self.selected):
+                channels[name]['channel'] = number
+
+        groups = {}
+        if self.group_names:
+            groups = self._metrics(self._group_sq, self._group_peak,
+                                   self._group_engine.band_power(), self.group_names)
+            for name in self.group_names:
+                groups[name]['channels'] = group_channels(self.groups[name])
+            for s, name in enumerate(self.stereo_names):
+                # ステレオのバスは (L+R)/2 を Mid として SimpleAnalyzer と同じ幅を出す
+                mid_e = self._group_sq[self.group_names.index(name)]
+                side_e = self._side_sq[s]
+                groups[name]['stereo_width'] = float(side_e / (mid_e + side_e + 1e-10) * 100)
+
+        return {
+            'samplerate': self.sr,
+            'channel_count': self.channels,
+            'duration_sec': self.n_samples / self.sr,
+            'channels': channels,
+            'groups': groups
+        }
+
+
+def _analyze_part(path, groups, channels, options):
+    # ワーカープロセス側で実行される（ファイルは各プロセスで開き直す）
+    return SimpleMultichannelAnalyzer(path, groups, channels=channels, **options).analyze()
+
+
+def analyze_multichannel(path, groups=None, workers=1, **options):
+    # workers > 1 なら、チャンネルを workers 個に分けた解析と、グループ・バスの解析を
+    # プロセスプールで並列に実行して結果をまとめる（各プロセスのメモリも1ブロック分）
+    if workers <= 1:
+        return SimpleMultichannelAnalyzer(path, groups, **options).analyze()
+
+    with AudioHandle(path, allow_decode=False) as audio:
+        n_channels = audio.channels
+    parts = [list(map(int, part + 1)) for part in np.array_split(np.arange(n_channels), workers) if len(part)]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_analyze_part, str(path), None, part, options) for part in parts]
+        if groups:
+            # グループ・バスは全入力の合算が要るので、個別チャンネルを持たない1プロセスで求める
+            futures.append(pool.submit(_analyze_part, str(path), groups, [], options))
+        results = [f.result() for f in futures]
+
+    merged = dict(results[0], channels={}, groups={})
+    for result in results[:len(parts)]:
+        merged['channels'].update(result['channels'])
+    if groups:
+        merged['groups'] = results[-1]['groups']
+    return merged
+
+
+def print_table(result):
+    bands = list(next(iter(result['channels'].values()))['band_energies']) if result['channels'] else []
+    header = f"{'':<12}{'RMS':>7}{'Peak':>7}{'Crest':>7}" + ''.join(f"{b[:8]:>9}" for b in bands)
+    print(header)
+    for section in ('channels', 'groups'):
+        for name, m in result[section].items():
+            print(f"{name[:12]:<12}{m['rms_db']:7.1f}{m['peak_db']:7.1f}{m['crest_factor']:7.1f}"
+                  + ''.join(f"{m['band_energies'][b]:9.1f}" for b in bands))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="マルチチャンネル録音のチャンネル別解析")
+    parser.add_argument('input', help="マルチチャンネルのWAV")
+    parser.add_argument('--group', action='append', default=[],
+                        help="グループ（drums=1-8）またはステレオのバス（main=31/32）。複数指定可")
+    parser.add_argument('--groups', help="グループ定義のJSON（{\"drums\": [1, 2], \"main\": {\"L\": [31], \"R\": [32]}}）")
+    parser.add_argument('--names', help="チャンネル名のテキスト（1行1チャンネル）")
+    parser.add_argument('--workers', type=int, default=1, help="並列プロセス数")
+    parser.add_argument('--band-mode', choices=('fft', 'reference'), default='fft')
+    parser.add_argument('-o', '--output', help="結果をJSONで保存")
+    args = parser.parse_args(argv)
+
+    groups = {}
+    if args.groups:
+        with open(args.groups, 'r') as f:
+            groups.update(json.load(f))
+    groups.update(parse_groups(args.group))
+
+    options = {'band_mode': args.band_mode}
+    if args.names:
+        with open(args.names, 'r') as f:
+            options['channel_names'] = [line.strip() for line in f if line.strip()]
+
+    result = analyze_multichannel(args.input, groups, workers=min(args.workers, os.cpu_count() or 1), **options)
+    print_table(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,389 @@
+"""
+PA Audio Analyzer V4.0 - 波形・スペクトログラムの概観ピラミッド
+解析と同じ読み込みパスで、公演全体の波形（min / max / RMS）と対数周波数のスペクトログラムを
+細かい順に 1/4 ずつ間引いた多段の配列（ピラミッド）にして、float16 の .npy で保存する。
+解析中は最も細かい段を一時ファイルに追記し、保存時に少しずつ読みながら上の段を作るので、
+録音が長くてもメモリは一定。
+表示するときはメモリマップで開き、表示範囲に合った段から画面幅の2倍以内の行だけを読むので、
+ファイルの長さによらず一定時間で描ける
+
+保存形式（ディレクトリ1つ）:
+    overview.json     サンプルレート・1点あたりのサンプル数・バンドの中心周波数・段数
+    wave_0.npy ...    (点数, 3) の min / max / RMS（全チャンネルをまとめた振幅）
+    spec_0.npy ...    (フレーム数, バンド数) の dB
+
+使い方:
+    from pa_core import SimpleStreamAnalyzer
+    from pa_overview import SimpleOverviewMeter, SimpleOverview
+
+    analyzer = SimpleStreamAnalyzer('show.wav')
+    meter = SimpleOverviewMeter(analyzer.sr, analyzer.channels)
+    analyzer.add_meter('overview', meter)
+    analyzer.analyze()
+    meter.save('show_overview')
+
+    overview = SimpleOverview('show_overview')
+    wave = overview.waveform(600, 660, width=1200)      # 10分目からの1分間
+    image = waveform_image(wave, width=1200)            # (高さ, 幅, 3) の uint8
+
+コマンドライン（作成と表示時間の計測）:
+    python pa_overview.py show.wav -o show_overview
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+# 波形の最も細かい段は256サンプル（48kHzで約5ms）ごとの min / max / RMS
+OVERVIEW_WAVE_BIN = 256
+# スペクトログラムは約85ms（48kHzで4096点）の窓をオーバーラップなしで並べ、
+# 30Hz〜20kHz を対数で80バンドにまとめる
+OVERVIEW_SPEC_RESOLUTION_HZ = 12.0
+OVERVIEW_SPEC_BANDS = 80
+OVERVIEW_FREQ_RANGE = (30.0, 20000.0)
+OVERVIEW_FLOOR_DB = -120.0
+# 段ごとに 1/4 に間引き、この点数以下になったら止める
+OVERVIEW_FACTOR = 4
+OVERVIEW_TOP_POINTS = 2048
+# 段を作るときに一度に読む点数（作業ファイルからこの単位で読み書きする。OVERVIEW_FACTOR の倍数）
+OVERVIEW_CHUNK = 1 << 12
+# 画面に出す幅（列数）と、スペクトログラムの表示レンジ
+OVERVIEW_WIDTH = 1200
+OVERVIEW_RANGE_DB = 80.0
+
+# 暗い紫 → 赤 → 黄 の配色（0〜1 の値を RGB にする）
+COLORMAP = np.array([
+    [0, 0, 4], [40, 11, 84], [101, 21, 110], [159, 42, 99],
+    [212, 72, 66], [245, 125, 21], [250, 193, 39], [252, 255, 164]
+], dtype=np.float32)
+
+
+def log_bands(sr, n_fft, n_bands=OVERVIEW_SPEC_BANDS, freq_range=OVERVIEW_FREQ_RANGE):
+    # 中心周波数と (バンド数, ビン数) の平均化行列。ビンより狭い低域のバンドは最も近いビンを使う
+    low, high = freq_range
+    high = min(high, sr / 2 * 0.95)
+    edges = np.geomspace(low, high, n_bands + 1)
+    centers = np.sqrt(edges[:-1] * edges[1:])
+    freqs = np.fft.rfftfreq(n_fft, 1 / sr)
+    weights = np.zeros((n_bands, len(freqs)), dtype=np.float32)
+    for i, (lo, hi) in enumerate(zip(edges[:-1], edges[1:])):
+        inside = (freqs >= lo) & (freqs < hi)
+        if inside.any():
+            weights[i, inside] = 1.0 / inside.sum()
+        else:
+            weights[i, np.argmin(np.abs(freqs - centers[i]))] = 1.0
+    return centers, weights
+
+
+def reduce_level(data, kind, factor=OVERVIEW_FACTOR):
+    # 1段上（factor 点を1点にまとめた配列）を作る。端数は最後の値で埋める
+    n = -(-len(data) // factor)
+    padded = np.concatenate([data, np.repeat(data[-1:], n * factor - len(data), axis=0)])
+    groups = padded.reshape(n, factor, *data.shape[1:])
+    if kind == 'wave':
+        # min / max はそのまま、RMS は二乗平均で合成する
+        return np.stack([
+            groups[:, :, 0].min(axis=1),
+            groups[:, :, 1].max(axis=1),
+            np.sqrt((groups[:, :, 2] ** 2).mean(axis=1))
+        ], axis=1)
+    # スペクトログラムはパワーで平均して dB に戻す
+    power = 10 ** (groups / 10)
+    return 10 * np.log10(power.mean(axis=1))
+
+
+def build_pyramid(data, kind, factor=OVERVIEW_FACTOR, top_points=OVERVIEW_TOP_POINTS):
+    levels = [data]
+    while len(levels[-1]) > top_points:
+        levels.append(reduce_level(levels[-1], kind, factor))
+    return levels
+
+
+def open_rows(path, dtype, n_rows, n_cols):
+    # 追記した生データを (n_rows, n_cols) で開く（0行ならメモリマップできないので空の配列）
+    if not n_rows:
+        return np.zeros((0, n_cols), dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(n_rows, n_cols))
+
+
+def write_pyramid(data, kind, out_dir, work_dir, factor=OVERVIEW_FACTOR, top_points=OVERVIEW_TOP_POINTS):
+    # build_pyramid と同じ段を OVERVIEW_CHUNK 点ずつ作って {kind}_i.npy（float16）に書き、段数を返す。
+    # 上の段の計算は float16 に丸める前の値（作業ディレクトリの float32）から行う
+    level = 0
+    while True:
+        out_path = out_dir / f"{kind}_{level}.npy"
+        if not len(data):
+            np.save(out_path, np.asarray(data, dtype=np.float16))
+            return level + 1
+        out = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.float16, shape=data.shape)
+        for i in range(0, len(data), OVERVIEW_CHUNK):
+            out[i:i + OVERVIEW_CHUNK] = data[i:i + OVERVIEW_CHUNK]
+        out.flush()
+        del out
+        if len(data) <= top_points:
+            return level + 1
+
+        n = -(-len(data) // factor)
+        upper = np.memmap(work_dir / f"{kind}_{level + 1}.f32", dtype=np.float32, mode='w+',
+                          shape=(n,) + data.shape[1:])
+        for i in range(0, len(data), OVERVIEW_CHUNK):
+            part = reduce_level(np.asarray(data[i:i + OVERVIEW_CHUNK], dtype=np.float32), kind, factor)
+            upper[i // factor:i // factor + len(part)] = part
+        upper.flush()
+        data = upper
+        level += 1
+
+
+class SimpleOverviewMeter:
+    # 解析パスに載せる計測器。update() ではいちばん細かい段を作業ディレクトリのファイルに追記し、
+    # save() でそれをメモリマップで読みながら上の段を作って書き出す（メモリは録音の長さによらない）。
+    # spill_dir は作業ディレクトリを作る場所（None ならシステムの一時ディレクトリ）
+    def __init__(self, sr, channels=2, wave_bin=OVERVIEW_WAVE_BIN, spill_dir=None):
+        self.sr = sr
+        self.channels = channels
+        self.wave_bin = wave_bin
+        self.spill_dir = spill_dir
+        self.n_fft = 1 << int(np.ceil(np.log2(sr / OVERVIEW_SPEC_RESOLUTION_HZ)))
+        self.hop = self.n_fft
+        self.window = np.hanning(self.n_fft).astype(np.float32)
+        # 正弦波の実効値が 20*log10(rms) dB になるように正規化する
+        self.scale = 2.0 / self.window.sum() ** 2
+        self.centers, self.weights = log_bands(sr, self.n_fft)
+        self._work = None
+        self.reset()
+
+    def reset(self):
+        self._wave_carry = np.zeros((self.channels, 0), dtype=np.float32)
+        self._spec_carry = np.zeros(0, dtype=np.float32)
+        self.wave_points = 0
+        self.spec_frames = 0
+        self.n_samples = 0
+        self.close()
+        self._work = Path(tempfile.mkdtemp(prefix='pa_overview_', dir=self.spill_dir))
+
+    def close(self):
+        # 作業ディレクトリを消す（save() の後は自動で呼ばれる）
+        if self._work is not None:
+            shutil.rmtree(self._work, ignore_errors=True)
+            self._work = None
+
+    def _append(self, name, rows):
+        with open(self._work / name, 'ab') as f:
+            rows.tofile(f)
+
+    def update(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        if block.ndim == 1:
+            block = block[None]
+        self.n_samples += block.shape[1]
+
+        # 波形: 全チャンネルをまとめた wave_bin サンプルごとの min / max / RMS
+        x = np.concatenate([self._wave_carry, block], axis=1)
+        n_bins = x.shape[1] // self.wave_bin
+        used = n_bins * self.wave_bin
+        if n_bins:
+            bins = x[:, :used].reshape(x.shape[0], n_bins, self.wave_bin)
+            ms = np.einsum('cbn,cbn->b', bins, bins) / (x.shape[0] * self.wave_bin)
+            rows = np.stack([bins.min(axis=(0, 2)), bins.max(axis=(0, 2)), np.sqrt(ms)], axis=1)
+            self._append('wave.f32', rows.astype(np.float32))
+            self.wave_points += n_bins
+        self._wave_carry = x[:, used:]
+
+        # スペクトログラム: モノラル（チャンネル平均）を n_fft ごとに区切ってまとめてFFTする
+        mono = np.concatenate([self._spec_carry, block.mean(axis=0)])
+        n_frames = len(mono) // self.hop
+        if n_frames:
+            frames = mono[:n_frames * self.hop].reshape(n_frames, self.hop)
+            spec = np.fft.rfft(frames * self.window, axis=1)
+            power = (spec.real ** 2 + spec.imag ** 2) * self.scale
+            db = 10 * np.log10(power @ self.weights.T + 1e-12)
+            self._append('spec.f16', np.maximum(db, OVERVIEW_FLOOR_DB).astype(np.float16))
+            self.spec_frames += n_frames
+        self._spec_carry = mono[n_frames * self.hop:]
+
+    def _finest(self):
+        # 作業ファイルのメモリマップ（最後の端数の波形も1点にして追記する）
+        if self._wave_carry.shape[1]:
+            tail = self._wave_carry
+            self._append('wave.f32', np.array([[tail.min(), tail.max(), np.sqrt(np.mean(tail ** 2))]],
+                                              dtype=np.float32))
+            self.wave_points += 1
+            self._wave_carry = tail[:, :0]
+        wave = open_rows(self._work / 'wave.f32', np.float32, self.wave_points, 3)
+        spec = open_rows(self._work / 'spec.f16', np.float16, self.spec_frames, len(self.centers))
+        return wave, spec
+
+    def summary(self):
+        # 結果（履歴）には配列を入れず、大きさだけを残す
+        return {
+            'duration_sec': self.n_samples / self.sr,
+            'wave_points': self.wave_points + int(self._wave_carry.shape[1] > 0),
+            'spec_frames': self.spec_frames
+        }
+
+    def save(self, out_dir):
+        # 既存のディレクトリに保存し直す場合は前回の段を消し、overview.json は最後に置き換える
+        # （SimpleOverview が新しい段数で古いファイルを読まないように）
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        for old in list(out_dir.glob('wave_*.npy')) + list(out_dir.glob('spec_*.npy')):
+            old.unlink()
+        wave, spec = self._finest()
+        try:
+            wave_levels = write_pyramid(wave, 'wave', out_dir, self._work)
+            spec_levels = write_pyramid(spec, 'spec', out_dir, self._work)
+        finally:
+            del wave, spec
+            self.close()
+
+        meta = {
+            'samplerate': self.sr,
+            'duration_sec': self.n_samples / self.sr,
+            'factor': OVERVIEW_FACTOR,
+            'wave_bin': self.wave_bin,
+            'wave_levels': wave_levels,
+            'spec_hop': self.hop,
+            'spec_levels': spec_levels,
+            'spec_freqs': [float(f) for f in self.centers]
+        }
+        tmp = out_dir / 'overview.json.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp, out_dir / 'overview.json')
+        return out_dir
+
+
+class SimpleOverview:
+    # 保存したピラミッドをメモリマップで開く（読み込むのは表示に使う行だけ）
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / 'overview.json', 'r') as f:
+            self.meta = json.load(f)
+        self.sr = self.meta['samplerate']
+        self.duration = self.meta['duration_sec']
+        self.factor = self.meta['factor']
+        self.freqs = np.array(self.meta['spec_freqs'])
+        self.wave = [np.load(self.path / f"wave_{i}.npy", mmap_mode='r')
+                     for i in range(self.meta['wave_levels'])]
+        self.spec = [np.load(self.path / f"spec_{i}.npy", mmap_mode='r')
+                     for i in range(self.meta['spec_levels'])]
+
+    def _slice(self, levels, step, start_sec, end_sec, width):
+        # 範囲内の点数が width の2倍以下になる最も細かい段を選び、その範囲だけを切り出す
+        start_sec = max(0.0, start_sec or 0.0)
+        end_sec = self.duration if end_sec is None else min(end_sec, self.duration)
+        end_sec = max(end_sec, start_sec)
+        points = (end_sec - start_sec) * self.sr / step
+        level = 0
+        while level < len(levels) - 1 and points / self.factor ** level > 2 * width:
+            level += 1
+        unit = step * self.factor ** level / self.sr
+        i0 = int(start_sec / unit)
+        i1 = min(len(levels[level]), int(np.ceil(end_sec / unit)) + 1)
+        data = np.asarray(levels[level][i0:i1], dtype=np.float32)
+        times = (i0 + np.arange(len(data))) * unit
+        return times, data, level
+
+    def waveform(self, start_sec=0.0, end_sec=None, width=OVERVIEW_WIDTH):
+        times, data, level = self._slice(self.wave, self.meta['wave_bin'], start_sec, end_sec, width)
+        return {'times': times, 'min': data[:, 0], 'max': data[:, 1], 'rms': data[:, 2], 'level': level}
+
+    def spectrogram(self, start_sec=0.0, end_sec=None, width=OVERVIEW_WIDTH):
+        times, data, level = self._slice(self.spec, self.meta['spec_hop'], start_sec, end_sec, width)
+        return {'times': times, 'freqs': self.freqs, 'db': data, 'level': level}
+
+
+def columns(n, width):
+    # n 点を width 列に割り当てたときの各列の先頭の点（n < width なら同じ点を繰り返す）
+    return np.minimum((np.arange(width) * n) // width, max(n - 1, 0))
+
+
+def colorize(values):
+    # 0〜1 の配列を COLORMAP で RGB の uint8 にする
+    pos = np.clip(values, 0, 1) * (len(COLORMAP) - 1)
+    low = np.minimum(pos.astype(np.intp), len(COLORMAP) - 2)
+    frac = (pos - low)[..., None]
+    return (COLORMAP[low] * (1 - frac) + COLORMAP[low + 1] * frac).astype(np.uint8)
+
+
+def waveform_image(wave, width=OVERVIEW_WIDTH, height=160):
+    # 列ごとに min〜max を塗り、±RMS の範囲を明るくした画像（matplotlib を使わない）
+    n = len(wave['min'])
+    image = np.full((height, width, 3), 14, dtype=np.uint8)
+    if not n:
+        return image
+    start = columns(n, width)
+    if n >= width:
+        # 1列に複数の点が入るので、列ごとにまとめる
+        lo = np.minimum.reduceat(wave['min'], start)
+        hi = np.maximum.reduceat(wave['max'], start)
+        rms = np.sqrt(np.add.reduceat(wave['rms'] ** 2, start) / np.diff(np.append(start, n)))
+    else:
+        lo, hi, rms = wave['min'][start], wave['max'][start], wave['rms'][start]
+    y = np.linspace(1, -1, height)[:, None]
+    peak = (y <= hi) & (y >= lo)
+    body = np.abs(y) <= rms
+    image[peak] = (102, 126, 234)
+    image[peak & body] = (180, 196, 255)
+    image[height // 2] = np.maximum(image[height // 2], 60)
+    return image
+
+
+def spectrogram_image(spec, width=OVERVIEW_WIDTH, height=160, range_db=OVERVIEW_RANGE_DB):
+    # (height, width, 3) の画像。低域が下になるよう上下を反転し、最大値から range_db を表示する
+    db = spec['db']
+    if not len(db):
+        return np.zeros((height, width, 3), dtype=np.uint8)
+    rows = columns(db.shape[1], height)[::-1]
+    image = db[columns(len(db), width)][:, rows].T
+    top = float(image.max())
+    return colorize((image - (top - range_db)) / range_db)
+
+
+def build_overview(path, out_dir):
+    from pa_core import SimpleStreamAnalyzer
+
+    analyzer = SimpleStreamAnalyzer(path)
+    meter = SimpleOverviewMeter(analyzer.sr, analyzer.channels)
+    analyzer.add_meter('overview', meter)
+    analyzer.analyze()
+    return meter.save(out_dir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="波形・スペクトログラムの概観ピラミッドを作成")
+    parser.add_argument('input', help="音源ファイル")
+    parser.add_argument('-o', '--output', required=True, help="保存先ディレクトリ")
+    parser.add_argument('--width', type=int, default=OVERVIEW_WIDTH)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    out_dir = build_overview(args.input, args.output)
+    print(f"作成: {time.perf_counter() - start:.2f}秒 → {out_dir}")
+    size_kb = sum(p.stat().st_size for p in Path(out_dir).glob('*.npy')) / 1024
+    print(f"サイズ: {size_kb:.0f} KB")
+
+    # 全体から数秒まで、ズームごとの読み出し＋画像化の時間
+    overview = SimpleOverview(out_dir)
+    span = overview.duration
+    while True:
+        start = time.perf_counter()
+        waveform_image(overview.waveform(0, span, args.width), args.width)
+        spectrogram_image(overview.spectrogram(0, span, args.width), args.width)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"  表示範囲 {span:10.1f}秒: {elapsed:6.2f} ms")
+        if span <= 5:
+            break
+        span /= 10
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
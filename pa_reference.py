@@ -0,0 +1,357 @@
+"""
+PA Audio Analyzer V4.0 - リファレンス比較
+お手本にしたいミックス（会場ごとの好評だった公演など）をリファレンスとして登録し、
+新しい解析結果に近いものを探して帯域ごとのEQ差分を返す
+
+指紋（フィンガープリント）は登録時に1回だけ計算してSQLiteに保存する:
+    - 1/3オクターブ30バンド（25Hz〜20kHz）の長時間平均スペクトル（LTAS）
+    - ラウドネス（Integrated / LRA / トゥルーピーク）と RMS・クレスト
+    - 帯域ごとの Mid/Side 比と全体の Side/Mid 比
+
+使い方:
+    from pa_core import SimpleStreamAnalyzer
+    from pa_reference import SimpleFingerprintMeter, SimpleReferenceIndex
+
+    analyzer = SimpleStreamAnalyzer('show.wav')
+    analyzer.add_meter('fingerprint', SimpleFingerprintMeter(analyzer.sr))
+    result = analyzer.analyze()                       # result['fingerprint'] に指紋
+
+    index = SimpleReferenceIndex()
+    index.add('me@pa.local', 'Zepp 2024-05', result, {'venue': 'Zepp'})
+    matches = index.nearest('me@pa.local', result, k=3, venue='Zepp')
+    matches[0]['eq_delta_db']['125']                  # +ならリファレンスの方が多い（ブースト方向）
+
+コマンドラインから録音をまとめて登録:
+    python pa_reference.py add me@pa.local approved/*.wav --venue Zepp
+    python pa_reference.py list me@pa.local
+"""
+
+import argparse
+import json
+import sqlite3
+import sys
+import threading
+import warnings
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from pa_core import BAND_FFT_RATE, SimpleBandEngine, power_to_db
+
+# 1/3オクターブの公称中心周波数（IEC 61260、基準1kHz・10^(1/10)刻み）
+THIRD_OCTAVE_CENTERS = [
+    25, 31.5, 40, 50, 63, 80, 100, 125, 160, 200, 250, 315, 400, 500, 630,
+    800, 1000, 1250, 1600, 2000, 2500, 3150, 4000, 5000, 6300, 8000, 10000, 12500, 16000, 20000
+]
+
+
+def third_octave_bands():
+    # {ラベル: (下端, 上端)}。帯域端は正確な中心周波数の ±1/6 オクターブ
+    bands = {}
+    for k, nominal in enumerate(THIRD_OCTAVE_CENTERS, start=-16):
+        fc = 1000 * 10 ** (k / 10)
+        label = f"{nominal:g}"
+        bands[label] = (fc * 10 ** (-1 / 20), fc * 10 ** (1 / 20))
+    return bands
+
+
+THIRD_OCTAVE_BANDS = third_octave_bands()
+
+# 低域の1/3オクターブ幅（25Hzで約6Hz）を分解できるよう、44.1kHzで32768点のFFTを使う
+FINGERPRINT_FFT_SIZE = 32768
+# これより小さいバンドは無音（またはナイキスト超え）として比較から外す
+FLOOR_DB = -120.0
+# EQ差分がこれ以上のバンドを改善提案に出す
+EQ_SUGGEST_DB = 3.0
+
+
+class SimpleFingerprintMeter:
+    # SimpleAnalyzer / SimpleStreamAnalyzer の add_meter() に渡す計測器。
+    # Mid と Side を (2, n) に重ねて1つのバンドエンジンで処理する
+    def __init__(self, sr, channels=2):
+        self.sr = sr
+        self.channels = channels
+        n_fft = 2 ** int(round(np.log2(FINGERPRINT_FFT_SIZE * sr / BAND_FFT_RATE)))
+        self.engine = SimpleBandEngine(sr, THIRD_OCTAVE_BANDS, n_fft=n_fft)
+        self.reset()
+
+    def reset(self):
+        self.engine.reset()
+
+    def update(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        L = block[0]
+        R = block[1] if block.shape[0] > 1 else block[0]
+        self.engine.update(np.stack([(L + R) / 2, (L - R) / 2]))
+
+    def summary(self):
+        power = self.engine.band_power()
+        if power.ndim == 1:
+            power = np.zeros((2, len(self.engine.names)))
+        mid_db = power_to_db(power[0])
+        side_db = power_to_db(power[1])
+        valid = mid_db > FLOOR_DB
+
+        # JSONにそのまま入るよう、比較に使えないバンドは None にする
+        def as_list(values):
+            return [float(v) if ok else None for v, ok in zip(values, valid)]
+
+        return {
+            'bands': self.engine.names,
+            'ltas_db': as_list(mid_db),
+            'ms_db': as_list(mid_db - side_db),
+            'side_mid_db': float(power_to_db(power[1].sum()) - power_to_db(power[0].sum()))
+        }
+
+
+def fingerprint_vector(fingerprint):
+    # 指紋のLTASを THIRD_OCTAVE_BANDS の順の float32 配列にする（無いバンドは NaN）
+    values = dict(zip(fingerprint['bands'], fingerprint['ltas_db']))
+    return np.array(
+        [np.nan if values.get(band) is None else values[band] for band in THIRD_OCTAVE_BANDS],
+        dtype=np.float32
+    )
+
+
+def fingerprint_features(result):
+    # スペクトル以外の比較項目（リファレンスとの差を表示する）
+    loudness = result.get('loudness') or {}
+    return {
+        'integrated_lufs': loudness.get('integrated_lufs'),
+        'loudness_range': loudness.get('loudness_range'),
+        'true_peak_db': loudness.get('true_peak_db'),
+        'rms_db': result.get('rms_db'),
+        'crest_factor': result.get('crest_factor'),
+        'stereo_width': result.get('stereo_width'),
+        'side_mid_db': result['fingerprint'].get('side_mid_db'),
+        'ms_db': result['fingerprint'].get('ms_db')
+    }
+
+
+def spectral_distance(matrix, query):
+    # matrix: (N, バンド) のLTAS、query: (バンド,)。
+    # 全体の音量差を除いた形の差（dB のRMS）と、各バンドのEQ差分（リファレンス − 今回）を返す。
+    # どちらかが NaN のバンドは除外する
+    diff = matrix - query
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        offset = np.nanmean(diff, axis=1)
+        shape = diff - offset[:, None]
+        distance = np.sqrt(np.nanmean(shape ** 2, axis=1))
+    return np.where(np.isnan(distance), np.inf, distance), shape, offset
+
+
+class SimpleReferenceIndex:
+    # リファレンスは analyses.db の reference_mixes テーブルに指紋（float32のBLOB）ごと保存する。
+    # 検索時はユーザーごとのLTAS行列をメモリに持ち、件数・最終IDが変わったときだけ読み直す
+    def __init__(self, db_path=None):
+        self.data_dir = Path('user_data')
+        self.data_dir.mkdir(exist_ok=True)
+        self.db_path = Path(db_path) if db_path else self.data_dir / 'analyses.db'
+        self.lock = threading.Lock()
+        self._matrices = {}
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _init_db(self):
+        with closing(self._connect()) as conn, conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS reference_mixes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_email TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    venue TEXT,
+                    mixer TEXT,
+                    created TEXT NOT NULL,
+                    fingerprint BLOB NOT NULL,
+                    features TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_reference_user_venue
+                    ON reference_mixes (user_email, venue);
+            """)
+
+    def add(self, user_email, name, result, metadata=None):
+        if not result.get('fingerprint'):
+            raise ValueError("result has no fingerprint (analyze with SimpleFingerprintMeter)")
+        metadata = metadata or {}
+        vector = fingerprint_vector(result['fingerprint'])
+        with closing(self._connect()) as conn, conn:
+            cur = conn.execute(
+                "INSERT INTO reference_mixes (user_email, name, venue, mixer, created, fingerprint, features) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    user_email,
+                    name,
+                    metadata.get('venue'),
+                    metadata.get('mixer'),
+                    datetime.now().isoformat(),
+                    vector.tobytes(),
+                    json.dumps(fingerprint_features(result), ensure_ascii=False)
+                )
+            )
+            return cur.lastrowid
+
+    def remove(self, user_email, ref_id):
+        with closing(self._connect()) as conn, conn:
+            cur = conn.execute(
+                "DELETE FROM reference_mixes WHERE user_email = ? AND id = ?", (user_email, ref_id)
+            )
+            return cur.rowcount > 0
+
+    def list(self, user_email, venue=None):
+        sql = "SELECT id, name, venue, mixer, created FROM reference_mixes WHERE user_email = ?"
+        params = [user_email]
+        if venue:
+            sql += " AND venue = ?"
+            params.append(venue)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(sql + " ORDER BY created DESC", params).fetchall()
+        return [dict(row) for row in rows]
+
+    def version(self, user_email):
+        # 削除でも変わるように件数と最終IDの組にする
+        with closing(self._connect()) as conn:
+            count, last_id = conn.execute(
+                "SELECT COUNT(*), MAX(id) FROM reference_mixes WHERE user_email = ?", (user_email,)
+            ).fetchone()
+        return count, last_id or 0
+
+    def _matrix(self, user_email):
+        version = self.version(user_email)
+        with self.lock:
+            cached = self._matrices.get(user_email)
+            if cached and cached['version'] == version:
+                return cached
+
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT id, name, venue, mixer, fingerprint, features FROM reference_mixes "
+                "WHERE user_email = ? ORDER BY id",
+                (user_email,)
+            ).fetchall()
+        n_bands = len(THIRD_OCTAVE_BANDS)
+        matrix = np.empty((len(rows), n_bands), dtype=np.float32)
+        for i, row in enumerate(rows):
+            matrix[i] = np.frombuffer(row['fingerprint'], dtype=np.float32, count=n_bands)
+        cached = {
+            'version': version,
+            'matrix': matrix,
+            'venues': np.array([row['venue'] or '' for row in rows], dtype=object),
+            'entries': [
+                {'id': row['id'], 'name': row['name'], 'venue': row['venue'], 'mixer': row['mixer'],
+                 'features': json.loads(row['features'])}
+                for row in rows
+            ]
+        }
+        with self.lock:
+            self._matrices[user_email] = cached
+        return cached
+
+    def nearest(self, user_email, result, k=3, venue=None):
+        # 今回の結果に近い順にリファレンスを返す（venue を指定すればその会場のものだけ）
+        if not result.get('fingerprint'):
+            return []
+        cached = self._matrix(user_email)
+        matrix = cached['matrix']
+        rows = np.arange(len(matrix))
+        if venue:
+            rows = np.flatnonzero(cached['venues'] == venue)
+            matrix = matrix[rows]
+        if not len(rows):
+            return []
+
+        query = fingerprint_vector(result['fingerprint'])
+        distance, shape, offset = spectral_distance(matrix, query)
+        k = min(k, len(rows))
+        top = np.argpartition(distance, k - 1)[:k] if k < len(rows) else np.arange(len(rows))
+        top = top[np.argsort(distance[top])]
+
+        current = fingerprint_features(result)
+        matches = []
+        for i in top:
+            if not np.isfinite(distance[i]):
+                continue
+            entry = cached['entries'][rows[i]]
+            features = entry['features']
+            deltas = {}
+            for key, value in features.items():
+                if key == 'ms_db':
+                    continue
+                if value is not None and current.get(key) is not None:
+                    deltas[key] = value - current[key]
+            matches.append({
+                'id': entry['id'],
+                'name': entry['name'],
+                'venue': entry['venue'],
+                'mixer': entry['mixer'],
+                'distance_db': float(distance[i]),
+                'level_offset_db': float(offset[i]),
+                'eq_delta_db': {
+                    band: (None if np.isnan(v) else float(v))
+                    for band, v in zip(THIRD_OCTAVE_BANDS, shape[i])
+                },
+                'deltas': deltas
+            })
+        return matches
+
+
+def fingerprint_file(path):
+    # 録音ファイルから登録用の結果（基本指標 + ラウドネス + 指紋）を求める
+    from pa_core import AudioHandle, SimpleStreamAnalyzer
+    from pa_metering import SimpleLoudnessMeter
+
+    with AudioHandle(path) as audio:
+        analyzer = SimpleStreamAnalyzer(audio)
+        analyzer.add_meter('loudness', SimpleLoudnessMeter(audio.sr, audio.channels))
+        analyzer.add_meter('fingerprint', SimpleFingerprintMeter(audio.sr, audio.channels))
+        return analyzer.analyze()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="リファレンスミックスの登録・一覧")
+    parser.add_argument('--db', help="データベース（既定: user_data/analyses.db）")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    add = sub.add_parser('add', help="録音を解析してリファレンスに登録")
+    add.add_argument('email')
+    add.add_argument('files', nargs='+')
+    add.add_argument('--venue')
+    add.add_argument('--mixer')
+    add.add_argument('--name', help="登録名（省略時はファイル名）")
+
+    lst = sub.add_parser('list', help="登録済みのリファレンスを表示")
+    lst.add_argument('email')
+    lst.add_argument('--venue')
+
+    args = parser.parse_args(argv)
+    index = SimpleReferenceIndex(args.db)
+
+    if args.command == 'add':
+        failed = 0
+        for path in args.files:
+            try:
+                result = fingerprint_file(path)
+            except Exception as e:
+                print(f"❌ {path}: {e}", file=sys.stderr)
+                failed += 1
+                continue
+            name = args.name or Path(path).stem
+            ref_id = index.add(args.email, name, result, {'venue': args.venue, 'mixer': args.mixer})
+            print(f"✅ #{ref_id} {name}")
+        return 1 if failed else 0
+
+    for ref in index.list(args.email, venue=args.venue):
+        print(f"#{ref['id']:<5} {ref['created'][:10]}  {ref['venue'] or '-':<16} {ref['name']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""
+PA Audio Analyzer V4.0 - ステム解析
+楽器分離後の各ステム（drums / bass / other / vocals）を (ステム, チャンネル, サンプル) の
+ブロックに重ね、全ステムの基本指標とバンドごとのマスキングを1パスで算出する
+
+使い方:
+    from pa_stems import SimpleStemAnalyzer
+
+    with SimpleStemAnalyzer({'drums': 'drums.wav', 'bass': 'bass.wav', ...}) as analyzer:
+        result = analyzer.analyze()
+    result['stems']['vocals']['band_energies']        # SimpleAnalyzer と同じ指標
+    result['masking']['masked_pct']['vocals']['mid']  # 他のステムに埋もれていた時間の割合
+    result['masking']['overlap_pct']['drums/bass']    # 2つのステムが同じ帯域で拮抗していた割合
+"""
+
+import numpy as np
+
+from pa_core import DEFAULT_BANDS, AudioHandle, SimpleBandEngine, power_to_db
+
+STEM_BLOCK_SIZE = 65536
+
+# フレーム内のバンドパワーが ACTIVE_DB 以下、または全ステム合計より ACTIVE_REL_DB 以上
+# 小さいステムはその帯域で「鳴っていない」とみなす（分離のにじみを数えないため）
+ACTIVE_DB = -60.0
+ACTIVE_REL_DB = -30.0
+# 2つのステムのバンドレベル差がこれ以内なら同じ帯域で拮抗しているとみなす
+OVERLAP_DB = 6.0
+
+
+class SimpleStemAnalyzer:
+    # stems: {名前: パス or AudioHandle}（全ステム同じサンプルレート）。
+    # update() には (ステム, チャンネル, n) のブロックを渡し、全ステムをまとめて処理する
+    def __init__(self, stems, bands=None, band_mode='fft', block_size=STEM_BLOCK_SIZE):
+        self.names = list(stems)
+        self.sources = stems
+        self.bands = bands or DEFAULT_BANDS
+        self.block_size = block_size
+
+        self.audio = [s if isinstance(s, AudioHandle) else AudioHandle(s) for s in stems.values()]
+        rates = {a.sr for a in self.audio}
+        if len(rates) != 1:
+            self.close()
+            raise ValueError(f"stems have different sample rates: {sorted(rates)}")
+        self.sr = rates.pop()
+
+        self.engine = SimpleBandEngine(self.sr, self.bands, mode=band_mode)
+        self.band_names = self.engine.names
+        # マスキングは全ステムの組で見る（i < j）
+        self.pairs = np.triu_indices(len(self.names), 1)
+        self.active_power = 10 ** (ACTIVE_DB / 10)
+        self.active_ratio = 10 ** (ACTIVE_REL_DB / 10)
+        self.reset()
+
+    def reset(self):
+        n_stems, n_bands = len(self.names), len(self.band_names)
+        self.n_samples = 0
+        self._sum_sq = np.zeros(n_stems)
+        self._peak = np.zeros(n_stems)
+        self._mid_e = np.zeros(n_stems)
+        self._side_e = np.zeros(n_stems)
+
+        self._frames = 0
+        self._active = np.zeros((n_stems, n_bands))
+        self._masked = np.zeros((n_stems, n_bands))
+        self._tmr_sum = np.zeros((n_stems, n_bands))
+        self._overlap = np.zeros((len(self.pairs[0]), n_bands))
+        self.engine.reset()
+
+    def update(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        mono = np.mean(block, axis=1)
+
+        self._sum_sq += np.einsum('sn,sn->s', mono, mono)
+        self._peak = np.maximum(self._peak, np.max(np.abs(mono), axis=1))
+
+        L = block[:, 0]
+        R = block[:, 1] if block.shape[1] > 1 else block[:, 0]
+        mid = (L + R) / 2
+        side = (L - R) / 2
+        self._mid_e += np.einsum('sn,sn->s', mid, mid)
+        self._side_e += np.einsum('sn,sn->s', side, side)
+        self.n_samples += block.shape[-1]
+
+        frames = self.engine.update(mono, return_frames=True)
+        if frames.shape[1]:
+            self._update_masking(frames)
+
+    def _update_masking(self, frames):
+        # frames: (ステム, フレーム, バンド) のパワー
+        total = frames.sum(axis=0, keepdims=True)
+        others = total - frames
+        active = (frames > self.active_power) & (frames > total * self.active_ratio)
+        tmr = 10 * np.log10((frames + 1e-20) / (others + 1e-20))
+
+        # 対象ステムが鳴っているフレームだけで、他の全ステムの合計に対する比（TMR）と
+        # 他のステムの合計の方が大きかった（＝埋もれていた）回数を数える
+        self._active += active.sum(axis=1)
+        self._masked += (active & (others > frames)).sum(axis=1)
+        self._tmr_sum += np.where(active, tmr, 0.0).sum(axis=1)
+
+        i, j = self.pairs
+        level = 10 * np.log10(frames + 1e-20)
+        close = (np.abs(level[i] - level[j]) < OVERLAP_DB) & active[i] & active[j]
+        self._overlap += close.sum(axis=1)
+        self._frames += frames.shape[1]
+
+    def analyze(self):
+        self.reset()
+        frames = min(a.frames for a in self.audio)
+        for start in range(0, frames, self.block_size):
+            n = min(self.block_size, frames - start)
+            blocks = [a.read(start, n) for a in self.audio]
+            # モノラルのステムはステレオに複製してからまとめる
+            channels = max(b.shape[0] for b in blocks)
+            self.update(np.stack([np.broadcast_to(b, (channels, n)) if b.shape[0] == 1 else b for b in blocks]))
+        return self.summary()
+
+    def summary(self):
+        rms_db = 20 * np.log10(np.sqrt(self._sum_sq / max(self.n_samples, 1)) + 1e-10)
+        peak_db = 20 * np.log10(self._peak + 1e-10)
+        width = self._side_e / (self._mid_e + self._side_e + 1e-10) * 100
+        # 1フレームも読めなかった（短すぎる）場合も (ステム, バンド) の形にそろえる
+        band_db = power_to_db(np.broadcast_to(self.engine.band_power(), (len(self.names), len(self.band_names))))
+
+        stems = {}
+        for s, name in enumerate(self.names):
+            stems[name] = {
+                'rms_db': float(rms_db[s]),
+                'peak_db': float(peak_db[s]),
+                'crest_factor': float(peak_db[s] - rms_db[s]),
+                'stereo_width': float(width[s]),
+                'band_energies': {band: float(band_db[s, b]) for b, band in enumerate(self.band_names)}
+            }
+
+        active = np.maximum(self._active, 1)
+        tmr = np.where(self._active > 0, self._tmr_sum / active, np.nan)
+        masked = np.where(self._active > 0, self._masked / active * 100, np.nan)
+        overlap = self._overlap / max(self._frames, 1) * 100
+
+        def by_band(row):
+            return {band: (None if np.isnan(v) else float(v)) for band, v in zip(self.band_names, row)}
+
+        masking = {
+            'tmr_db': {name: by_band(tmr[s]) for s, name in enumerate(self.names)},
+            'masked_pct': {name: by_band(masked[s]) for s, name in enumerate(self.names)},
+            'overlap_pct': {
+                f"{self.names[i]}/{self.names[j]}": by_band(overlap[p])
+                for p, (i, j) in enumerate(zip(*self.pairs))
+            }
+        }
+        return {'stems': stems, 'masking': masking}
+
+    def close(self):
+        # 自分で開いたハンドルだけを閉じる（Windowsでは開いたままのステムを削除できない）
+        for audio, source in zip(self.audio, self.sources.values()):
+            if audio is not source:
+                audio.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
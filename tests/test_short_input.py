@@ -0,0 +1,49 @@
+"""
+1フレーム（FFT長）に満たない短いクリップでも、ステム・マルチチャンネル解析が
+全バンドの値を返すことを確認する
+
+    python -m pytest -q tests
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pa_core import DEFAULT_BANDS  # noqa: E402
+from pa_multichannel import SimpleMultichannelAnalyzer  # noqa: E402
+from pa_stems import SimpleStemAnalyzer  # noqa: E402
+
+SR = 48000
+
+
+def write_clip(path, frames, channels):
+    rng = np.random.default_rng(0)
+    sf.write(path, (0.1 * rng.standard_normal((frames, channels))).astype(np.float32), SR)
+    return str(path)
+
+
+@pytest.mark.parametrize('frames', [0, 100])
+def test_stems_shorter_than_one_frame(tmp_path, frames):
+    stems = {name: write_clip(tmp_path / f"{name}.wav", frames, 2) for name in ('drums', 'vocals')}
+    with SimpleStemAnalyzer(stems) as analyzer:
+        result = analyzer.analyze()
+
+    for stem in result['stems'].values():
+        assert list(stem['band_energies']) == list(DEFAULT_BANDS)
+    assert list(result['masking']['overlap_pct']) == ['drums/vocals']
+
+
+@pytest.mark.parametrize('frames', [0, 100])
+def test_multichannel_shorter_than_one_frame(tmp_path, frames):
+    path = write_clip(tmp_path / 'console.wav', frames, 4)
+    result = SimpleMultichannelAnalyzer(path, {'drums': [1, 2], 'main': '3/4'}).analyze()
+
+    assert len(result['channels']) == 4
+    assert set(result['groups']) == {'drums', 'main'}
+    for metrics in list(result['channels'].values()) + list(result['groups'].values()):
+        assert list(metrics['band_energies']) == list(DEFAULT_BANDS)